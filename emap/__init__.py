@@ -1,2 +1,3 @@
 from .db import NetlistDB
+from .runner import Runner, Rule, Scheduler, BackoffScheduler, StopReason
 from . import rewrites
\ No newline at end of file
@@ -0,0 +1,193 @@
+"""
+Self-contained benchmarks: synthetic designs of growing size are built, rebuilt, rewritten rule by rule and saturated,
+and the timings, e-node counts and peak memory are reported as JSON (see python -m emap.bench --help).
+Each case runs in a fresh process, so that its peak resident set size is its own.
+"""
+import math
+import pathlib
+import platform
+import resource
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+from ..db import NetlistDB
+from ..runner import Runner
+from .. import rewrites
+from .generators import GENERATORS
+
+SCHEMA_FILE = str(pathlib.Path(__file__).parent.parent / "schema.sql")
+TARGET_TYPES = ["$addu", "$mulu"]
+
+
+def _clone(db: NetlistDB) -> NetlistDB:
+    """
+    Copy an in-memory NetlistDB, so that every rule starts from the same e-graph.
+    """
+    copy = NetlistDB(SCHEMA_FILE, packed=db.packed)
+    db.backup(copy)
+    copy._cnt, copy._clk = db._cnt, db._clk
+    return copy
+
+
+def _rule_pairs() -> dict[str, tuple]:
+    """
+    Every ematch_x/apply_x pair of emap.rewrites (the legacy rules, benchmarked against their patterns).
+    """
+    return {
+        name.removeprefix("ematch_"): (getattr(rewrites, name), getattr(rewrites, "apply_" + name.removeprefix("ematch_")))
+        for name in dir(rewrites) if name.startswith("ematch_") and hasattr(rewrites, "apply_" + name.removeprefix("ematch_"))
+    }
+
+
+def _patterns() -> dict[str, str]:
+    return {
+        "comm": rewrites.COMM, "assoc_to_right": rewrites.ASSOC_TO_RIGHT,
+        "assoc_to_left": rewrites.ASSOC_TO_LEFT, "dff_forward_aby_cell": rewrites.DFF_FORWARD_ABY_CELL,
+    }
+
+
+def _timed(f, *args, **kwargs) -> tuple[Any, float]:
+    t = time.perf_counter()
+    result = f(*args, **kwargs)
+    return result, time.perf_counter() - t
+
+
+def run_case(generator: str, size: int, width: int = 16, iters: int = 4, packed: bool = False, cpp: bool = True) -> dict[str, Any]:
+    """
+    Benchmark one design: build (Python bulk loader and, if available, the C++ builder), rebuild, each hand-written
+    matcher/applier and DSL rule applied once on a copy of the built e-graph, and a saturation run of iters iterations.
+    """
+    mod = GENERATORS[generator](size, width)
+    case: dict[str, Any] = {"generator": generator, "size": size, "width": width, "packed": packed, "cells": len(mod["cells"])}
+
+    db = NetlistDB(SCHEMA_FILE, packed=packed)
+    _, case["build"] = _timed(db.build_from_json, mod, bulk=True, progress=False)
+    case["build_cpp"] = None
+    if cpp and not packed:
+        with tempfile.TemporaryDirectory() as tmp:
+            cpp_db = NetlistDB(SCHEMA_FILE, str(pathlib.Path(tmp) / "cpp.db"))
+            try:
+                _, case["build_cpp"] = _timed(cpp_db.build_from_json_cpp, mod)
+            except RuntimeError:    # emapcc is not built
+                pass
+            cpp_db.close()
+    case["rebuilds"], case["rebuild"] = _timed(db.rebuild)
+    case["enodes"] = db.count_enodes()
+
+    case["rules"] = {}
+    for name, (ematch, apply) in _rule_pairs().items():
+        copy = _clone(db)
+        matches, match_time = _timed(lambda: list(ematch(copy, TARGET_TYPES, None)))
+        applied, apply_time = _timed(apply, copy, matches)
+        _, rebuild_time = _timed(copy.rebuild)
+        case["rules"][name] = {"matches": len(matches), "applied": applied, "match": match_time, "apply": apply_time, "rebuild": rebuild_time}
+        copy.close()
+    for name, src in _patterns().items():
+        copy = _clone(db)
+        pattern = rewrites.Pattern(name, src)
+        staged, match_time = _timed(pattern.stage, copy, TARGET_TYPES, None)     # applied inside SQLite, as in_db rules are
+        matches = len(staged)
+        applied, apply_time = _timed(pattern.apply, copy, staged)
+        _, rebuild_time = _timed(copy.rebuild)
+        case["rules"]["pattern:" + name] = {"matches": matches, "applied": applied, "match": match_time, "apply": apply_time, "rebuild": rebuild_time}
+        copy.close()
+
+    rules = [rewrites.rewrite(name, src, TARGET_TYPES, in_db=True) for name, src in _patterns().items()]
+    report = Runner(db, rules, iter_limit=iters).run()
+    case["saturation"] = {
+        "iterations": len(report.iterations),
+        "stop_reason": report.stop_reason.value if report.stop_reason is not None else None,
+        "enodes": db.count_enodes(),
+        "time": report.total_time,
+        "match": sum(it.match_time for it in report.iterations),
+        "apply": sum(rule.apply_time for it in report.iterations for rule in it.rules),
+        "rebuild": sum(it.rebuild_time for it in report.iterations),
+    }
+    case["peak_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024   # KiB on Linux
+    db.close()
+    return case
+
+
+def _metrics(case: dict[str, Any]) -> dict[str, float]:
+    """
+    Flatten the timings of a case, e.g. {"build": ..., "rules.comm.apply": ..., "saturation.time": ...}.
+    """
+    metrics = {key: case[key] for key in ("build", "build_cpp", "rebuild") if case.get(key) is not None}
+    for name, rule in case["rules"].items():
+        metrics.update({f"rules.{name}.{phase}": rule[phase] for phase in ("match", "apply", "rebuild")})
+    metrics.update({f"saturation.{phase}": case["saturation"][phase] for phase in ("time", "match", "apply", "rebuild")})
+    metrics["peak_rss"] = case["peak_rss"]
+    return metrics
+
+
+def scaling(cases: list[dict[str, Any]]) -> dict[str, dict[str, dict[str, Any]]]:
+    """
+    Fit t = c * cells^k per generator and metric (least squares in log-log space) and return k with the points.
+    """
+    curves: dict[str, dict[str, dict[str, Any]]] = {}
+    for case in cases:
+        for metric, value in _metrics(case).items():
+            curve = curves.setdefault(case["generator"], {}).setdefault(metric, {"points": []})
+            curve["points"].append([case["cells"], value])
+    for by_metric in curves.values():
+        for curve in by_metric.values():
+            points = [(math.log(x), math.log(y)) for x, y in curve["points"] if x > 0 and y > 0]
+            curve["exponent"] = None
+            if len({x for x, _ in points}) > 1:
+                mx, my = sum(x for x, _ in points) / len(points), sum(y for _, y in points) / len(points)
+                sxx = sum((x - mx) ** 2 for x, _ in points)
+                curve["exponent"] = sum((x - mx) * (y - my) for x, y in points) / sxx
+    return curves
+
+
+def run(
+    generators: list[str] | None = None,
+    sizes: list[int] | None = None,
+    width: int = 16,
+    iters: int = 4,
+    packed: bool = False,
+    cpp: bool = True
+) -> dict[str, Any]:
+    """
+    Run every (generator, size) case in its own process and return the report: environment, cases and scaling.
+    """
+    generators = list(GENERATORS) if generators is None else generators
+    sizes = [8, 16, 32] if sizes is None else sizes
+    cases = []
+    for generator in generators:
+        for size in sizes:
+            with ProcessPoolExecutor(1, max_tasks_per_child=1) as pool:
+                cases.append(pool.submit(run_case, generator, size, width, iters, packed, cpp).result())
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {
+        "environment": {
+            "python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "numpy": numpy_version,
+            "platform": platform.platform(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "cases": cases,
+        "scaling": scaling(cases),
+    }
+
+
+def compare(report: dict[str, Any], baseline: dict[str, Any], threshold: float = 1.2, min_time: float = 0.01) -> list[str]:
+    """
+    Return a line for each metric of a case present in both reports that got more than threshold times slower
+    (or bigger, for peak_rss). Timings below min_time seconds in the baseline are too noisy to compare.
+    """
+    key = lambda case: (case["generator"], case["size"], case["width"], case["packed"])
+    old = {key(case): _metrics(case) for case in baseline["cases"]}
+    regressions = []
+    for case in report["cases"]:
+        for metric, value in _metrics(case).items():
+            before = old.get(key(case), {}).get(metric)
+            if before is None or (metric != "peak_rss" and before < min_time):
+                continue
+            if value > before * threshold:
+                regressions.append(f"{case['generator']}/{case['size']} {metric}: {before:.4g} -> {value:.4g} ({value / before:.2f}x)")
+    return regressions
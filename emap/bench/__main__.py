@@ -0,0 +1,38 @@
+import argparse
+import json
+import sys
+from . import GENERATORS, compare, run
+
+
+parser = argparse.ArgumentParser(prog="python -m emap.bench", description="Benchmark emap on synthetic designs.")
+parser.add_argument("-g", "--generators", nargs="+", choices=list(GENERATORS), default=list(GENERATORS))
+parser.add_argument("-s", "--sizes", nargs="+", type=int, default=[8, 16, 32])
+parser.add_argument("-w", "--width", type=int, default=16)
+parser.add_argument("-i", "--iters", type=int, default=4, help="saturation iterations")
+parser.add_argument("--packed", action="store_true", help="use the packed wirevec layout")
+parser.add_argument("--no-cpp", dest="cpp", action="store_false", help="skip build_from_json_cpp()")
+parser.add_argument("-o", "--output", help="write the JSON report to this file (default: stdout)")
+parser.add_argument("-b", "--baseline", help="JSON report to compare against, exit status 1 on regressions")
+parser.add_argument("--threshold", type=float, default=1.2, help="slowdown ratio reported as a regression")
+args = parser.parse_args()
+
+report = run(args.generators, args.sizes, args.width, args.iters, args.packed, args.cpp)
+if args.output is None:
+    json.dump(report, sys.stdout, indent=2)
+    print()
+else:
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    for case in report["cases"]:
+        sat = case["saturation"]
+        print(
+            f"{case['generator']}/{case['size']}: {case['cells']} cells, build {case['build']:.3f}s, "
+            f"rebuild {case['rebuild']:.3f}s, saturation {sat['time']:.3f}s ({sat['enodes']} e-nodes), "
+            f"peak {case['peak_rss'] / 2**20:.0f} MiB"
+        )
+if args.baseline is not None:
+    with open(args.baseline, "r") as f:
+        regressions = compare(report, json.load(f), args.threshold)
+    for line in regressions:
+        print("REGRESSION", line, file=sys.stderr)
+    sys.exit(1 if regressions else 0)
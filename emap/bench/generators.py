@@ -0,0 +1,136 @@
+"""
+Parametric synthetic designs, as Yosys JSON module dicts (the input of NetlistDB.build_from_json()).
+Every generator takes a size (its main scaling parameter), a bit width and a seed.
+"""
+import random
+from typing import Any, Callable
+
+
+class _Module:
+    """
+    A Yosys JSON module under construction: bits are numbered from 2 as Yosys does, "0"/"1" are constants.
+    """
+    ports: dict[str, Any]
+    cells: dict[str, Any]
+    _next_bit: int
+
+    def __init__(self):
+        self.ports = {}
+        self.cells = {}
+        self._next_bit = 2
+
+    def bits(self, width: int) -> list[int]:
+        bits = list(range(self._next_bit, self._next_bit + width))
+        self._next_bit += width
+        return bits
+
+    def input(self, name: str, width: int) -> list[int]:
+        bits = self.bits(width)
+        self.ports[name] = {"direction": "input", "bits": bits}
+        return bits
+
+    def output(self, name: str, bits: list[int]):
+        self.ports[name] = {"direction": "output", "bits": bits}
+
+    def cell(self, type_: str, width: int, **conns: list) -> list[int]:
+        """
+        Add a cell driving a fresh Y (Q for $dff) of the given width and return it.
+        """
+        y = self.bits(width)
+        if type_ == "$dff":
+            params = {"CLK_POLARITY": "1", "WIDTH": width}
+            conns = {"CLK": self.ports["clk"]["bits"], **conns, "Q": y}
+        elif type_ == "$mux":
+            params = {"WIDTH": width}
+            conns = {**conns, "Y": y}
+        else:
+            params = {"A_SIGNED": "0", "B_SIGNED": "0", "Y_WIDTH": width}
+            conns = {**conns, "Y": y}
+        self.cells[f"$cell{len(self.cells)}"] = {
+            "hide_name": 1, "type": type_, "parameters": params, "attributes": {}, "connections": conns
+        }
+        return y
+
+    def to_json(self) -> dict[str, Any]:
+        return {"ports": self.ports, "cells": self.cells}
+
+
+def adder_tree(size: int, width: int = 16, seed: int = 0) -> dict[str, Any]:
+    """
+    A balanced tree of $add cells summing size inputs.
+    """
+    m = _Module()
+    level = [m.input(f"x{i}", width) for i in range(max(size, 2))]
+    while len(level) > 1:
+        level = [m.cell("$add", width, A=a, B=b) for a, b in zip(level[::2], level[1::2])] + level[len(level) & ~1:]
+    m.output("y", level[0])
+    return m.to_json()
+
+
+def systolic(size: int, width: int = 16, seed: int = 0) -> dict[str, Any]:
+    """
+    A size x size array of multiply-accumulate cells with registered partial sums flowing down the columns.
+    """
+    m = _Module()
+    m.input("clk", 1)
+    xs = [m.input(f"x{i}", width) for i in range(size)]
+    ws = [m.input(f"w{j}", width) for j in range(size)]
+    for j in range(size):
+        acc = ["0"] * width
+        for i in range(size):
+            prod = m.cell("$mul", width, A=xs[i], B=ws[(i + j) % size])
+            acc = m.cell("$dff", width, D=m.cell("$add", width, A=acc, B=prod))
+        m.output(f"y{j}", acc)
+    return m.to_json()
+
+
+def mac_chain(size: int, width: int = 16, seed: int = 0) -> dict[str, Any]:
+    """
+    A pipelined chain of size MAC stages: acc' = acc + a * b, with a register after every stage.
+    """
+    m = _Module()
+    m.input("clk", 1)
+    acc = m.input("acc", width)
+    for i in range(size):
+        a, b = m.input(f"a{i}", width), m.input(f"b{i}", width)
+        acc = m.cell("$dff", width, D=m.cell("$add", width, A=acc, B=m.cell("$mul", width, A=a, B=b)))
+    m.output("y", acc)
+    return m.to_json()
+
+
+def random_dag(size: int, width: int = 16, seed: int = 0) -> dict[str, Any]:
+    """
+    size random cells ($add, $mul, $not, $mux, $eq, $dff) over earlier signals, with a bias towards recent ones.
+    """
+    rnd = random.Random(seed)
+    m = _Module()
+    m.input("clk", 1)
+    nets = [m.input(f"x{i}", width) for i in range(max(2, size // 16))]
+    flags = [m.input("s", 1)]
+
+    def pick() -> list[int]:
+        return nets[max(0, len(nets) - 1 - int(rnd.expovariate(0.05)))]
+
+    for _ in range(size):
+        kind = rnd.choices(["$add", "$mul", "$not", "$mux", "$eq", "$dff"], weights=[8, 4, 1, 2, 1, 2])[0]
+        if kind == "$eq":
+            flags.append(m.cell("$eq", 1, A=pick(), B=pick()))
+        elif kind == "$mux":
+            nets.append(m.cell("$mux", width, A=pick(), B=pick(), S=rnd.choice(flags)))
+        elif kind == "$not":
+            nets.append(m.cell("$not", width, A=pick()))
+        elif kind == "$dff":
+            nets.append(m.cell("$dff", width, D=pick()))
+        else:
+            nets.append(m.cell(kind, width, A=pick(), B=pick()))
+    for i, net in enumerate(nets[-max(1, size // 16):]):
+        m.output(f"y{i}", net)
+    return m.to_json()
+
+
+GENERATORS: dict[str, Callable[..., dict[str, Any]]] = {
+    "adder_tree": adder_tree,
+    "systolic": systolic,
+    "mac_chain": mac_chain,
+    "random_dag": random_dag,
+}
@@ -1,7 +1,15 @@
 import sqlite3
 import json
-from typing import Any
-from . import utils
+import itertools
+import os
+import pathlib
+from contextlib import AbstractContextManager, closing, contextmanager, nullcontext
+from array import array
+from typing import Any, Iterable, Iterator, TextIO
+from . import stats, utils, yosys
+
+
+_NO_PHASE = nullcontext()
 
 
 class NetlistDB(sqlite3.Connection):
@@ -10,6 +18,74 @@ class NetlistDB(sqlite3.Connection):
     _cnt: int
     _rhash: utils.RollingHash
     _emapcc_handle: Any | None
+    _n_powers: int
+    _epoch: int
+    _packed: bool
+    _ledgers: dict[str, tuple[tuple[str, ...], tuple[str, ...]]]
+    _submodules: set[str]   # cell types naming other modules of the design, stored as instances
+    _batch_depth: int
+    _stats: stats.Stats | None   # see enable_stats()
+    _interned: utils.InternCache     # wirevec contents -> canonical id, in front of _create_or_lookup_wirevec()
+
+    # scratch tables of the rebuild phases and of extraction (emap.extract), private to the connection
+    _TEMP_SCHEMA = """
+        CREATE TEMP TABLE IF NOT EXISTS rhash_powers (
+            idx INTEGER PRIMARY KEY, power INTEGER NOT NULL, range_sum INTEGER NOT NULL, range_wsum INTEGER NOT NULL,
+            power2 INTEGER, range_sum2 INTEGER, range_wsum2 INTEGER
+        );
+        CREATE TEMP TABLE IF NOT EXISTS congruent_cells (type VARCHAR(16), a INTEGER, b INTEGER, y INTEGER);
+        CREATE TEMP TABLE IF NOT EXISTS wire_map (wire INTEGER PRIMARY KEY, root INTEGER NOT NULL);
+        CREATE TEMP TABLE IF NOT EXISTS wirevec_map (wirevec INTEGER PRIMARY KEY, root INTEGER NOT NULL);
+        CREATE TEMP TABLE IF NOT EXISTS live_wirevecs (id INTEGER PRIMARY KEY);
+        CREATE TEMP TABLE IF NOT EXISTS wirevec_ids (old INTEGER PRIMARY KEY, new INTEGER NOT NULL);
+        CREATE TEMP TABLE IF NOT EXISTS fresh_wirevecs (id INTEGER PRIMARY KEY, start INTEGER NOT NULL, width INTEGER NOT NULL);
+        CREATE TEMP TABLE IF NOT EXISTS extract_costs (type VARCHAR(16), width INTEGER, cost REAL, PRIMARY KEY (type, width));
+        CREATE TEMP TABLE IF NOT EXISTS extract_classes (id INTEGER PRIMARY KEY);
+        CREATE TEMP TABLE IF NOT EXISTS extract_nodes (tbl VARCHAR(16), node INTEGER, PRIMARY KEY (tbl, node));
+    """
+
+    # cell tables: (non-wirevec key columns, wirevec columns)
+    _CELL_TABLES: dict[str, tuple[tuple[str, ...], tuple[str, ...]]] = {
+        "ay_cells": (("type",), ("a", "y")),
+        "aby_cells": (("type",), ("a", "b", "y")),
+        "absy_cells": (("type",), ("a", "b", "s", "y")),
+        "dffs": ((), ("d", "q")),
+    }
+    # port tables: wirevec column
+    _PORT_TABLES: dict[str, str] = {
+        "from_inputs": "source",
+        "as_outputs": "sink",
+        "instance_ports": "signal",
+    }
+
+    # pragmas set by NetlistDB(profile=...), page_size first since it must precede any table (and WAL mode)
+    PROFILES: dict[str, dict[str, Any]] = {
+        # for databases that can be rebuilt: no fsync (an OS crash may corrupt the file), rollback journal in memory,
+        # 1 GiB page cache and memory map, bigger pages for the wide index rows of the cell tables
+        "bulk": {
+            "page_size": 16384, "journal_mode": "MEMORY", "synchronous": "OFF",
+            "cache_size": -1048576, "mmap_size": 1 << 30, "temp_store": "MEMORY",
+        },
+        # every commit survives a power loss, and readers never block the writer
+        "durable": {
+            "journal_mode": "WAL", "synchronous": "FULL", "cache_size": -65536, "mmap_size": 1 << 28, "temp_store": "MEMORY",
+        },
+    }
+
+    # insert statements used by _bulk_load(), in flush order
+    _BULK_INSERTS: dict[str, str] = {
+        "wirevecs": "INSERT INTO wirevecs (id, hash, width, members) VALUES (?, ?, ?, ?)",
+        "wirevec_members": "INSERT INTO wirevec_members (wirevec, idx, wire) VALUES (?, ?, ?)",
+        "wire_refs": "INSERT OR IGNORE INTO wire_refs (wire, wirevec) VALUES (?, ?)",
+        "from_inputs": "INSERT INTO from_inputs (source, name) VALUES (?, ?)",
+        "as_outputs": "INSERT INTO as_outputs (sink, name) VALUES (?, ?)",
+        "aby_cells": "INSERT OR IGNORE INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)",
+        "dffs": "INSERT OR IGNORE INTO dffs (d, q) VALUES (?, ?)",
+        "absy_cells": "INSERT OR IGNORE INTO absy_cells (type, a, b, s, y) VALUES (?, ?, ?, ?, ?)",
+        "ay_cells": "INSERT OR IGNORE INTO ay_cells (type, a, y) VALUES (?, ?, ?)",
+        "instances": "INSERT INTO instances (name, params, module) VALUES (?, ?, ?)",
+        "instance_ports": "INSERT INTO instance_ports (instance, port, signal) VALUES (?, ?, ?)",
+    }
 
     @staticmethod
     def bit_to_int(bit: str | int) -> int:
@@ -19,64 +95,472 @@ class NetlistDB(sqlite3.Connection):
     def param_to_int(param: str | int) -> int:
         return param if isinstance(param, int) else int(param, base=2)
 
+    @staticmethod
+    def pack_wirevec(wv: Iterable[int]) -> bytes:
+        """
+        Encode wirevec members as a packed int32 BLOB (native byte order), as stored in wirevecs.members.
+        """
+        return array("i", wv).tobytes()
+
+    @staticmethod
+    def unpack_wirevec(blob: bytes) -> memoryview:
+        """
+        Decode a packed wirevec without copying: a read-only int32 view over the BLOB.
+        """
+        return memoryview(blob).cast("i")
+
     @property
     def auto_id(self) -> int:
         self._cnt += 1
         return self._cnt
 
-    def __init__(self, schema_file: str, db_file: str = ":memory:", cnt: int = 0):
-        super().__init__(db_file)
+    def __init__(
+        self,
+        schema_file: str,
+        db_file: str = ":memory:",
+        cnt: int = 0,
+        packed: bool = False,
+        profile: str | dict[str, Any] | None = None
+    ):
+        """
+        With packed=True, wirevec members are stored as a packed BLOB in wirevecs.members (plus the wire_refs
+        reverse index) instead of one wirevec_members row per bit.
+        profile is the name of one of PROFILES (e.g. "bulk" for fast file-backed runs), or a dict of pragmas.
+        """
+        super().__init__(db_file, cached_statements=512)  # room for the compiled rewrite statements
+        if isinstance(profile, str):
+            if profile not in self.PROFILES:
+                raise ValueError(f"Unknown profile: {profile}")
+            profile = self.PROFILES[profile]
+        for pragma, value in (profile or {}).items():
+            self.execute(f"PRAGMA {pragma} = {value}")
         with open(schema_file, "r") as f:
             self.executescript(f.read())
+        self.executescript(self._TEMP_SCHEMA)
+        self.create_function(
+            "emap_pack_range", 2, lambda start, width: self.pack_wirevec(range(start, start + width)), deterministic=True
+        )
         # self.execute("PRAGMA foreign_keys = ON")    # enable foreign key enforcement
         self._db_file = db_file
         self._clk = None
         self._cnt = cnt
         self._rhash = utils.RollingHash()
         self._emapcc_handle = None
+        self._n_powers = 0
+        self._epoch = 0
+        self._packed = packed
+        self._ledgers = {}
+        self._submodules = set()
+        self._stats = None
+        self._batch_depth = 0
+        self._interned = utils.InternCache()
+        for table, (keys, refs) in self._CELL_TABLES.items():
+            self._register_ledger(f"origin_{table}", keys, refs)
+        self._load_meta()
 
-    def dump_tables(self) -> dict:
-        # get all tables except sqlite internal tables
-        cur = self.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%';")
-        db = {}
-        for (table,) in cur.fetchall():
-            cur.execute(f"SELECT * FROM {table}")
-            rows = cur.fetchall()
-            db[table] = [dict(zip([col[0] for col in cur.description], row)) for row in rows]
+    def _save_meta(self):
+        """
+        Record the state of the object in the meta table (committed with the current transaction).
+        """
+        self.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [
+            ("cnt", self._cnt), ("clk", self._clk), ("epoch", self._epoch), ("packed", int(self._packed)),
+            ("hash_B", self._rhash.B), ("hash_M", self._rhash.M), ("hash_M2", self._rhash.M2),
+        ])
+
+    def _load_meta(self):
+        """
+        Restore the state recorded by _save_meta(), if any. The counter is also raised past the largest wire in use,
+        since appliers allocate wires without updating the meta table.
+        """
+        meta = dict(self.execute("SELECT key, value FROM meta").fetchall())
+        if not meta:
+            return
+        if bool(meta["packed"]) != self._packed:
+            raise ValueError(f"Database {self._db_file} uses the {'packed' if meta['packed'] else 'row'} wirevec layout")
+        self._rhash = utils.RollingHash(meta["hash_B"], meta["hash_M"], meta["hash_M2"])
+        self._n_powers = 0
+        self._clk = meta["clk"]
+        self._epoch = meta["epoch"]
+        self._cnt = max(self._cnt, meta["cnt"], self._max_wire() or 0)
+
+    def get_meta(self, key: str, default: Any = None) -> Any:
+        """
+        Return a value stored by set_meta() (or one of the fields of the object, e.g. "epoch").
+        """
+        row = self.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0]) if isinstance(row[0], str) else row[0]
+
+    def set_meta(self, key: str, value: Any):
+        """
+        Store a JSON value in the meta table, e.g. the state of a Runner (committed with the current transaction).
+        """
+        self.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    @classmethod
+    def open(
+        cls, db_file: str, schema_file: str | None = None, in_memory: bool = False, profile: str | dict[str, Any] | None = None
+    ) -> "NetlistDB":
+        """
+        Reopen a database written by a NetlistDB (e.g. a checkpoint()) with its wire counter, clock, hash parameters
+        and epoch, skipping the build. With in_memory, the file is copied into a new in-memory database, to resume
+        a run at full speed without touching the file.
+        """
+        if isinstance(profile, str):
+            profile = cls.PROFILES[profile]
+        if schema_file is None:
+            schema_file = str(pathlib.Path(__file__).with_name("schema.sql"))
+        uri = pathlib.Path(db_file).absolute().as_uri() + "?mode=ro"
+        with closing(sqlite3.connect(uri, uri=True)) as src:
+            try:
+                row = src.execute("SELECT value FROM meta WHERE key = 'packed'").fetchone()
+            except sqlite3.OperationalError:    # not written by a NetlistDB
+                row = None
+            packed = row is not None and bool(row[0])
+            if not in_memory:
+                return cls(schema_file, db_file, packed=packed, profile=profile)
+            # the backup API cannot change the page size of an in-memory database
+            page_size = src.execute("PRAGMA page_size").fetchone()[0]
+            db = cls(schema_file, packed=packed, profile={**(profile or {}), "page_size": page_size})
+            src.backup(db)
+        db._load_meta()
         return db
 
+    def checkpoint(self, path: str, pages: int = 4096):
+        """
+        Snapshot the database to path with the SQLite backup API, pages at a time (the temp tables are not copied).
+        The copy goes to path + ".tmp" and is renamed over path once complete, so that a crash never leaves a torn
+        checkpoint. Restore it with NetlistDB.open(path).
+        """
+        if self._db_file != ":memory:" and pathlib.Path(path).absolute() == pathlib.Path(self._db_file).absolute():
+            raise ValueError("Cannot checkpoint a database onto itself")
+        if self._batch_depth:
+            raise RuntimeError("Cannot checkpoint inside batch()")  # the backup would wait for the open transaction
+        self._save_meta()
+        self.commit()
+        tmp = path + ".tmp"
+        pathlib.Path(tmp).unlink(missing_ok=True)
+        with closing(sqlite3.connect(tmp)) as target:
+            self.backup(target, pages=pages)
+        os.replace(tmp, path)
+
+    def enable_stats(self, explain: bool = True) -> stats.Stats:
+        """
+        Start collecting per-phase and per-statement statistics (see emap.stats), with the query plan of every
+        distinct statement if explain. Return the (possibly already running) collector.
+        """
+        if self._stats is None:
+            self._stats = stats.Stats(self, explain)
+            self._stats._attach()
+        return self._stats
+
+    def disable_stats(self) -> stats.Stats | None:
+        """
+        Stop collecting statistics and return what was collected.
+        """
+        collected, self._stats = self._stats, None
+        if collected is not None:
+            collected._detach()
+        return collected
+
+    @property
+    def stats(self) -> stats.Stats | None:
+        return self._stats
+
+    def phase(self, name: str) -> AbstractContextManager:
+        """
+        Context manager charging its block to phase name when statistics are enabled, a no-op otherwise.
+        """
+        return self._stats.phase(name) if self._stats is not None else _NO_PHASE
+
+    def commit(self):
+        """
+        Commit the current transaction, unless inside batch(): every NetlistDB method and rewrite commits through it.
+        """
+        if not self._batch_depth:
+            super().commit()
+
+    def rollback(self):
+        self._interned.clear()  # it may hold wirevecs that are about to disappear
+        super().rollback()
+
+    @contextmanager
+    def batch(self) -> Iterator["NetlistDB"]:
+        """
+        Defer the commits made in the block to a single transaction, committed when the outermost batch() exits
+        and rolled back if it raises, e.g.
+
+            with db.batch():
+                db.build_from_json(mod)     # one transaction instead of one per cell
+                db.rebuild()
+
+        Readers (open_reader()) and checkpoints only see committed rows, so they are refused inside the block.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.rollback()
+            raise
+        self._batch_depth -= 1
+        if not self._batch_depth:
+            self.commit()
+
+    @property
+    def in_batch(self) -> bool:
+        return self._batch_depth > 0
+
+    @property
+    def epoch(self) -> int:
+        return self._epoch
+
+    def new_epoch(self) -> int:
+        """
+        Stamp the cell rows inserted (or canonicalized) since the last call with a new epoch and return it.
+        Call it before each round of e-matching: a matcher given since=e only returns matches involving rows newer than e.
+        """
+        self._epoch += 1
+        for table in self._CELL_TABLES:
+            self.execute(f"UPDATE {table} SET epoch = ? WHERE epoch IS NULL", (self._epoch,))
+        self._save_meta()
+        self.commit()
+        return self._epoch
+
+    def enable_wal(self):
+        """
+        Switch a file-backed database to WAL mode, so that readers see a consistent snapshot while the writer goes on.
+        """
+        if self._db_file == ":memory:":
+            raise RuntimeError("WAL mode needs a file-backed database")
+        if self._batch_depth:
+            raise RuntimeError("Cannot switch to WAL mode inside batch()")
+        if self.in_transaction:
+            self.commit()
+        self.execute("PRAGMA journal_mode = WAL")
+
+    def open_reader(self) -> sqlite3.Connection:
+        """
+        Open a read-only connection to the same database file, usable from another thread.
+        Only committed rows are visible to it (temp tables are not), which is all a matcher needs.
+        """
+        if self._db_file == ":memory:":
+            raise RuntimeError("Cannot open a reader on an in-memory database")
+        if self._batch_depth:
+            raise RuntimeError("Cannot open a reader inside batch(): it would not see the uncommitted rows")
+        uri = pathlib.Path(self._db_file).absolute().as_uri() + "?mode=ro"
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    def _register_ledger(self, table: str, keys: tuple[str, ...], refs: tuple[str, ...]):
+        """
+        Have rebuild() keep the wirevec columns refs of table canonical, like those of the cell tables.
+        Used for the ledgers of applied matches (see rewrites.Pattern.apply()) and for the origin tables.
+        """
+        self._ledgers[table] = (keys, refs)
+
+    def snapshot_origin(self):
+        """
+        Record the current cells in the origin tables (see schema.sql): the netlist as built, which extraction
+        falls back to when it is cheaper. Called by the builders.
+        """
+        for table, (keys, refs) in self._CELL_TABLES.items():
+            cols = ", ".join(keys + refs)
+            self.execute(f"INSERT OR IGNORE INTO origin_{table} ({cols}) SELECT {cols} FROM {table}")
+        self.commit()
+
+    def count_enodes(self) -> int:
+        return sum(self.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in self._CELL_TABLES)
+
+    @property
+    def packed(self) -> bool:
+        return self._packed
+
+    def _user_tables(self) -> list[str]:
+        # all tables except sqlite internal tables
+        cur = self.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%';")
+        return [table for (table,) in cur]
+
+    def iter_rows(self, table: str, chunk_size: int = 10000) -> Iterator[dict[str, Any]]:
+        """
+        Yield the rows of table as dicts, fetched chunk_size at a time. Packed members are decoded to lists.
+        """
+        cur = self.execute(f"SELECT * FROM {table}")
+        cols = [col[0] for col in cur.description]
+        while rows := cur.fetchmany(chunk_size):
+            for row in rows:
+                yield dict(zip(cols, (self.unpack_wirevec(v).tolist() if isinstance(v, bytes) else v for v in row)))
+
+    def dump_tables(self) -> dict:
+        return {table: list(self.iter_rows(table)) for table in self._user_tables()}
+
+    def write_tables(self, f: TextIO, chunk_size: int = 10000):
+        """
+        Write dump_tables() to f as JSON, one row per line, without holding more than chunk_size rows in memory.
+        """
+        f.write("{")
+        for i, table in enumerate(self._user_tables()):
+            f.write(f'{"," if i else ""}\n  {json.dumps(table)}: [')
+            sep = "\n    "
+            for row in self.iter_rows(table, chunk_size):
+                f.write(sep + json.dumps(row))
+                sep = ",\n    "
+            f.write("]" if sep == "\n    " else "\n  ]")
+        f.write("\n}\n")
+
+    def _members_sql(self, ref: str) -> str:
+        """
+        SQL expression of the members of wirevec ref, to be decoded by _decode_members().
+        ref must be qualified if the outer query has an id column, e.g. w.id.
+        """
+        if self._packed:
+            return f"(SELECT m.members FROM wirevecs AS m WHERE m.id = {ref})"
+        return f"(SELECT json_group_array(wire) FROM (SELECT wire FROM wirevec_members WHERE wirevec = {ref} ORDER BY idx))"
+
+    def _decode_members(self, value: bytes | str) -> list[int]:
+        return self.unpack_wirevec(value).tolist() if self._packed else json.loads(value)
+
+    def _get_width(self, id: int) -> int:
+        return self.execute("SELECT width FROM wirevecs WHERE id = ?", (id,)).fetchone()[0]
+
+    def _lookup_aby_cell(self, type_: str, a: int, b: int, width: int) -> int | None:
+        """
+        Return the output of an existing (type, a, b) cell of the given width, if any.
+        """
+        row = self.execute("""
+            SELECT cell.y FROM aby_cells AS cell JOIN wirevecs AS w ON w.id = cell.y
+            WHERE cell.type = ? AND cell.a = ? AND cell.b = ? AND w.width = ? LIMIT 1
+        """, (type_, a, b, width)).fetchone()
+        return None if row is None else row[0]
+
     def _get_wirevec(self, id: int) -> list[int]:
+        if self._packed:
+            (blob,) = self.execute("SELECT members FROM wirevecs WHERE id = ?", (id,)).fetchone()
+            return self.unpack_wirevec(blob).tolist()
         cur = self.execute("SELECT wire FROM wirevec_members WHERE wirevec = ? ORDER BY idx", (id,))
         return [w for (w,) in cur]
 
+    def _insert_wirevec(self, h: int, wv: list[int]) -> int:
+        if self._packed:
+            cur = self.execute(
+                "INSERT INTO wirevecs (hash, width, members) VALUES (?, ?, ?) RETURNING id",
+                (h, len(wv), self.pack_wirevec(wv))
+            )
+            id = cur.fetchone()[0]
+            self.executemany("INSERT OR IGNORE INTO wire_refs (wire, wirevec) VALUES (?, ?)", ((w, id) for w in set(wv)))
+        else:
+            cur = self.execute("INSERT INTO wirevecs (hash, width) VALUES (?, ?) RETURNING id", (h, len(wv)))
+            id = cur.fetchone()[0]
+            self.executemany(
+                "INSERT INTO wirevec_members (wirevec, idx, wire) VALUES (?, ?, ?)",
+                ((id, i, w) for i, w in enumerate(wv))
+            )
+        return id
+
+    def _max_wirevec_id(self) -> int:
+        return self.execute("""
+            SELECT MAX(
+                COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'wirevecs'), 0),
+                COALESCE((SELECT MAX(id) FROM wirevecs), 0)
+            )
+        """).fetchone()[0]
+
+    def _range_hash_sql(self, start: str, row: str = "p") -> str:
+        """
+        Return an SQL expression computing RollingHash.hash() of the wires start, start + 1, ..., in closed form
+        sum((start + i) * B^i) = start * sum(B^i) + sum(i * B^i), with row the temp.rhash_powers row of the width.
+        """
+        h1 = f"({start} % :M * {row}.range_sum + {row}.range_wsum) % :M"
+        if self._rhash.M2 is None:
+            return h1
+        h2 = f"({start} % :M2 * {row}.range_sum2 + {row}.range_wsum2) % :M2"
+        return f"{h1} * :M2 + {h2}"
+
+    def _add_fresh_wirevecs(self, table: str) -> int:
+        """
+        Give every row of table (columns key INTEGER PRIMARY KEY, width, id) a new wirevec of width fresh wires,
+        and store its id in the row. Wirevec ids and wire ranges are allocated in bulk with window prefix sums
+        instead of one auto_id at a time. Return the number of wirevecs created.
+        """
+        n, total, width = self.execute(f"SELECT COUNT(*), SUM(width), MAX(width) FROM {table}").fetchone()
+        if not n:
+            return 0
+        self._sync_rhash_powers(width + 1)
+        params = {"next_id": self._max_wirevec_id(), "cnt": self._cnt, "M": self._rhash.M, "M2": self._rhash.M2}
+        cur = self.execute("DELETE FROM temp.fresh_wirevecs")
+        cur.execute(f"""
+            INSERT INTO temp.fresh_wirevecs (id, start, width)
+            SELECT :next_id + ROW_NUMBER() OVER w, :cnt + SUM(width) OVER w - width + 1, width
+            FROM {table} WINDOW w AS (ORDER BY key)
+        """, params)
+        cur.execute(f"""
+            UPDATE {table} SET id = :next_id + r.n
+            FROM (SELECT key, ROW_NUMBER() OVER (ORDER BY key) AS n FROM {table}) AS r
+            WHERE {table}.key = r.key
+        """, params)
+        members = "emap_pack_range(f.start, f.width)" if self._packed else "NULL"
+        cur.execute(f"""
+            INSERT INTO wirevecs (id, hash, width, members)
+            SELECT f.id, {self._range_hash_sql("f.start")}, f.width, {members}
+            FROM temp.fresh_wirevecs AS f JOIN temp.rhash_powers AS p ON p.idx = f.width
+        """, params)
+        if self._packed:
+            cur.execute("""
+                INSERT INTO wire_refs (wire, wirevec)
+                SELECT f.start + p.idx, f.id FROM temp.fresh_wirevecs AS f JOIN temp.rhash_powers AS p ON p.idx < f.width
+            """)
+        else:
+            cur.execute("""
+                INSERT INTO wirevec_members (wirevec, idx, wire)
+                SELECT f.id, p.idx, f.start + p.idx FROM temp.fresh_wirevecs AS f JOIN temp.rhash_powers AS p ON p.idx < f.width
+            """)
+        self._cnt += total
+        return n
+
     def _add_wirevec(self, wv: list[int]) -> int:
-        h = self._rhash.hash(wv)
-        cur = self.execute("INSERT INTO wirevecs (hash) VALUES (?) RETURNING id", (h,))
-        id = cur.fetchone()[0]
-        self.executemany(
-            "INSERT INTO wirevec_members (wirevec, idx, wire) VALUES (?, ?, ?)",
-            ((id, i, w) for i, w in enumerate(wv))
-        )
-        self.commit()
+        """
+        Insert a wirevec of fresh wires (as appliers create them): no identical one can be in the database,
+        but one may already be interned.
+        """
+        key = tuple(wv)
+        id = self._interned.get(key)
+        if id is None:
+            id = self._insert_wirevec(self._rhash.hash(wv), wv)
+            self._interned.put(key, id)
+            self.commit()
         return id
 
     def _create_or_lookup_wirevec(self, wv: list[int]) -> int:
+        key = tuple(wv)
+        id = self._interned.get(key)
+        if id is not None:
+            return id
         h = self._rhash.hash(wv)
-        cur = self.execute("SELECT id FROM wirevecs WHERE hash = ?", (h,))
-        rows = cur.fetchall()
-        for (id,) in rows:  # lookup
-            if self._get_wirevec(id) == wv:
-                return id
-        # not found, insert
-        cur.execute("INSERT INTO wirevecs (hash) VALUES (?) RETURNING id", (h,))
-        id = cur.fetchone()[0]
-        self.executemany(
-            "INSERT INTO wirevec_members (wirevec, idx, wire) VALUES (?, ?, ?)",
-            ((id, i, w) for i, w in enumerate(wv))
-        )
-        self.commit()
+        if self._packed:
+            row = self.execute(
+                "SELECT id FROM wirevecs WHERE hash = ? AND width = ? AND members = ? ORDER BY id LIMIT 1",
+                (h, len(wv), self.pack_wirevec(wv))
+            ).fetchone()
+            id = None if row is None else row[0]
+        else:
+            # the members of every candidate in one query
+            cur = self.execute("""
+                SELECT m.wirevec, m.wire FROM wirevecs AS w JOIN wirevec_members AS m ON m.wirevec = w.id
+                WHERE w.hash = ? AND w.width = ? ORDER BY m.wirevec, m.idx
+            """, (h, len(wv)))
+            id = next((id for id, rows in itertools.groupby(cur, key=lambda row: row[0]) if tuple(w for _, w in rows) == key), None)
+        if id is None:  # not found, insert
+            id = self._insert_wirevec(h, wv)
+            self.commit()
+        self._interned.put(key, id)
         return id
 
+    def _max_wire(self) -> int | None:
+        if self._packed:
+            return self.execute("SELECT MAX(wire) FROM wire_refs").fetchone()[0]
+        return self.execute("SELECT MAX(wire) FROM wirevec_members").fetchone()[0]
+
     def _add_input(self, name: str, source: list[int]):
         ws = self._create_or_lookup_wirevec(source)
         self.execute("INSERT INTO from_inputs (source, name) VALUES (?, ?)", (ws, name))
@@ -116,220 +600,578 @@ class NetlistDB(sqlite3.Connection):
     def build_from_json_cpp(self, mod: dict[str, Any], clk: str = "clk"):
         if self._db_file == ":memory:":
             raise RuntimeError("Cannot call build_from_json_cpp() on in-memory database")
+        if self._packed:
+            raise RuntimeError("build_from_json_cpp() does not support the packed wirevec layout")
         try:
             from .emapcc.build import emapcc
-            self._clk, self._cnt = emapcc.build_from_json(self._db_file, mod, clk, self._rhash._POWER_B[1], self._rhash._M)
+            self._clk, self._cnt = emapcc.build_from_json(
+                self._db_file, mod, clk, self._rhash.B, self._rhash.M, self._rhash.M2 or 0
+            )
         except ImportError:
             raise RuntimeError("emapcc module is not available. Please build emapcc to use build_from_json_cpp()")
         except Exception as e:
             raise RuntimeError(f"Failed to build from JSON: {e}")
+        self.snapshot_origin()
+        self._save_meta()
+        self.commit()
+
+    def _iter_netlist(self, mod: dict[str, Any], clk: str = "clk", progress: bool = True) -> Iterator[tuple]:
+        """
+        Parse a Yosys module into a stream of netlist records, shared by the row-by-row and bulk builders.
+        """
+        items = itertools.chain(
+            (("port", name, port) for name, port in mod["ports"].items()),
+            (("cell", name, cell) for name, cell in mod["cells"].items())
+        )
+        reporter = utils.Progress("cells", total=len(mod["cells"])) if progress else None
+        return self._iter_records(items, clk, reporter)
 
-    def build_from_json(self, mod: dict[str, Any], clk: str = "clk"):
+    def _iter_records(self, items: Iterable[tuple[str, str, Any]], clk: str = "clk", progress: utils.Progress | None = None) -> Iterator[tuple]:
+        """
+        Turn ("port", name, port) and ("cell", name, cell) items (see yosys.iter_module()) into netlist records.
+        The ports must come first, as the clock is needed by the dffs.
+        """
         # NOTE: only support single global clock
-        ports: dict[str, Any] = mod["ports"]
-        cells: dict[str, Any] = mod["cells"]
-
-        # build inputs & outputs
-        for name, port in ports.items():
-            direction, bits = port["direction"], [self.bit_to_int(bit) for bit in port["bits"]]
-            if direction == "input":
-                if name == clk:
-                    if len(bits) != 1:
-                        raise ValueError("Clock port must have exactly one bit")
-                    self._clk = bits[0]
-                self._add_input(name, bits)
-            elif direction == "output":
-                self._add_output(name, bits)
+        for kind, name, item in items:
+            if kind == "port":
+                yield self._port_record(name, item, clk)
             else:
-                raise ValueError(f"Unsupported port direction: {direction}")
-
-        # build cells
-        print(f"Found {len(cells)} cells")
-        for i, (name, cell) in enumerate(cells.items()):
-            if i % 1000 == 0:
-                print(f"Processing cell {i}/{len(cells)}: {name}")
-            type_: str = cell["type"]
-            params: dict[str, Any] = cell["parameters"]
-            conns: dict[str, Any] = cell["connections"]
-            # TODO: for simplicity, we treat bitwise logic gates as word-level operations
-            if type_ in {
-                "$and", "$or", "$xor",
-                "$add", "$sub", "$mul", "$mod"
-            }:
-                type_ += "s" if self.param_to_int(params["A_SIGNED"]) and self.param_to_int(params["B_SIGNED"]) else "u"
-                a = [self.bit_to_int(bit) for bit in conns["A"]]
-                b = [self.bit_to_int(bit) for bit in conns["B"]]
-                y = [self.bit_to_int(bit) for bit in conns["Y"]]
-                # assert len(a) == len(b) == len(y)
-                self._add_aby_cell(type_, a, b, y)
-            elif type_ == "$dff":
-                if not self.param_to_int(params["CLK_POLARITY"]):
-                    raise ValueError("$dff with negative clock polarity is not supported")
-                if self._clk is None:
-                    raise ValueError("Global clock is not defined")
-                d, clk, q = conns["D"], conns["CLK"], conns["Q"]
-                if len(clk) != 1 or self.bit_to_int(clk[0]) != self._clk:
-                    raise ValueError(f"Clock {clk} does not match global clock {self._clk}")
-                d = [self.bit_to_int(bit) for bit in d]
-                q = [self.bit_to_int(bit) for bit in q]
-                assert len(d) == len(q)
-                self._add_dff(d, q)
-            elif type_ == "$mux":
-                a = [self.bit_to_int(bit) for bit in conns["A"]]
-                b = [self.bit_to_int(bit) for bit in conns["B"]]
-                s = [self.bit_to_int(bit) for bit in conns["S"]]
-                y = [self.bit_to_int(bit) for bit in conns["Y"]]
-                assert len(s) == 1 and len(a) == len(b) == len(y)
-                self._add_absy_cell(type_, a, b, s, y)
-            elif type_ in {"$not", "$logic_not"}:
-                a = [self.bit_to_int(bit) for bit in conns["A"]]
-                y = [self.bit_to_int(bit) for bit in conns["Y"]]
-                self._add_ay_cell(type_, a, y)
-            elif type_ in {
-                "$eq", "$ge", "$le", "$gt", "$lt",
-                "$logic_and", "$logic_or"
-            }:
-                a = [self.bit_to_int(bit) for bit in conns["A"]]
-                b = [self.bit_to_int(bit) for bit in conns["B"]]
-                y = [self.bit_to_int(bit) for bit in conns["Y"]]
-                # assert len(a) == len(b)
-                self._add_aby_cell(type_, a, b, y)
+                yield self._cell_record(name, item)
+                if progress is not None:
+                    progress.update()
+        if progress is not None:
+            progress.close()
+
+    def _port_record(self, name: str, port: dict[str, Any], clk: str) -> tuple:
+        direction, bits = port["direction"], [self.bit_to_int(bit) for bit in port["bits"]]
+        if direction == "input":
+            if name == clk:
+                if len(bits) != 1:
+                    raise ValueError("Clock port must have exactly one bit")
+                self._clk = bits[0]
+            return ("input", name, bits)
+        elif direction == "output":
+            return ("output", name, bits)
+        else:
+            raise ValueError(f"Unsupported port direction: {direction}")
+
+    def _cell_record(self, name: str, cell: dict[str, Any]) -> tuple:
+        type_: str = cell["type"]
+        params: dict[str, Any] = cell["parameters"]
+        conns: dict[str, Any] = cell["connections"]
+        # TODO: for simplicity, we treat bitwise logic gates as word-level operations
+        if type_ in {
+            "$and", "$or", "$xor",
+            "$add", "$sub", "$mul", "$mod"
+        }:
+            type_ += "s" if self.param_to_int(params["A_SIGNED"]) and self.param_to_int(params["B_SIGNED"]) else "u"
+            a = [self.bit_to_int(bit) for bit in conns["A"]]
+            b = [self.bit_to_int(bit) for bit in conns["B"]]
+            y = [self.bit_to_int(bit) for bit in conns["Y"]]
+            # assert len(a) == len(b) == len(y)
+            return ("aby", type_, a, b, y)
+        elif type_ == "$dff":
+            if not self.param_to_int(params["CLK_POLARITY"]):
+                raise ValueError("$dff with negative clock polarity is not supported")
+            if self._clk is None:
+                raise ValueError("Global clock is not defined")
+            d, clk, q = conns["D"], conns["CLK"], conns["Q"]
+            if len(clk) != 1 or self.bit_to_int(clk[0]) != self._clk:
+                raise ValueError(f"Clock {clk} does not match global clock {self._clk}")
+            d = [self.bit_to_int(bit) for bit in d]
+            q = [self.bit_to_int(bit) for bit in q]
+            assert len(d) == len(q)
+            return ("dff", d, q)
+        elif type_ == "$mux":
+            a = [self.bit_to_int(bit) for bit in conns["A"]]
+            b = [self.bit_to_int(bit) for bit in conns["B"]]
+            s = [self.bit_to_int(bit) for bit in conns["S"]]
+            y = [self.bit_to_int(bit) for bit in conns["Y"]]
+            assert len(s) == 1 and len(a) == len(b) == len(y)
+            return ("absy", type_, a, b, s, y)
+        elif type_ in {"$not", "$logic_not"}:
+            a = [self.bit_to_int(bit) for bit in conns["A"]]
+            y = [self.bit_to_int(bit) for bit in conns["Y"]]
+            return ("ay", type_, a, y)
+        elif type_ in {
+            "$eq", "$ge", "$le", "$gt", "$lt",
+            "$logic_and", "$logic_or"
+        }:
+            a = [self.bit_to_int(bit) for bit in conns["A"]]
+            b = [self.bit_to_int(bit) for bit in conns["B"]]
+            y = [self.bit_to_int(bit) for bit in conns["Y"]]
+            # assert len(a) == len(b)
+            return ("aby", type_, a, b, y)
+        else:
+            attrs = cell["attributes"]
+            if type_ in self._submodules or "module_not_derived" in attrs and self.param_to_int(attrs["module_not_derived"]): # blackbox cell
+                return ("blackbox", name, type_, params, [(port, [self.bit_to_int(bit) for bit in signal]) for port, signal in conns.items()])
             else:
-                attrs = cell["attributes"]
-                if "module_not_derived" in attrs and self.param_to_int(attrs["module_not_derived"]): # blackbox cell
-                    self._add_blackbox_cell(name, type_, params, [(port, [self.bit_to_int(bit) for bit in signal]) for port, signal in conns.items()])
-                else:
-                    raise ValueError(f"Unsupported cell type: {type_}")
+                raise ValueError(f"Unsupported cell type: {type_}")
+
+    def build_from_json(
+        self, mod: dict[str, Any], clk: str = "clk", bulk: bool = False, progress: bool = True, submodules: Iterable[str] = ()
+    ):
+        """
+        Build the netlist from a Yosys JSON module.
+        With bulk=True, the whole module is loaded in one transaction (see _bulk_load()), which yields exactly
+        the same tables as the row-by-row path but is orders of magnitude faster on large designs.
+        Cells whose type is one of submodules (the other modules of the design) are stored as instances, like blackboxes.
+        """
+        self._submodules = set(submodules)
+        if bulk:
+            self._bulk_load(self._iter_netlist(mod, clk, progress))
+        else:
+            with self.batch():
+                for rec in self._iter_netlist(mod, clk, progress):
+                    kind = rec[0]
+                    if kind == "input":
+                        self._add_input(*rec[1:])
+                    elif kind == "output":
+                        self._add_output(*rec[1:])
+                    elif kind == "aby":
+                        self._add_aby_cell(*rec[1:])
+                    elif kind == "dff":
+                        self._add_dff(*rec[1:])
+                    elif kind == "absy":
+                        self._add_absy_cell(*rec[1:])
+                    elif kind == "ay":
+                        self._add_ay_cell(*rec[1:])
+                    else:
+                        self._add_blackbox_cell(*rec[1:])
 
-        self.commit()
         # set cnt
-        self._cnt = self.execute("SELECT MAX(wire) FROM wirevec_members").fetchone()[0] or 1
+        self._cnt = self._max_wire() or 1
+        self.snapshot_origin()
+        self._save_meta()
+        self.commit()
 
-    def _merge_cells(self) -> utils.DisjointSetUnion:
+    def build_from_file(
+        self,
+        path: str,
+        module: str | None = None,
+        clk: str = "clk",
+        batch_size: int = 100000,
+        progress: bool = True,
+        submodules: Iterable[str] = ()
+    ):
+        """
+        Build the netlist from a module (the first one if None) of a Yosys JSON file, parsing the file as it is
+        loaded: cells are decoded one at a time and flushed by _bulk_load() every batch_size records, so the JSON
+        never has to fit in memory. Same tables as build_from_json(json.load(f)["modules"][module], bulk=True).
+        """
+        self._submodules = set(submodules)
+        with open(path, "r") as f:
+            stream = yosys.JsonStream(f)
+            reporter = utils.Progress("cells", size=pathlib.Path(path).stat().st_size, tell=stream.tell) if progress else None
+            self._bulk_load(self._iter_records(yosys.iter_module(stream, module), clk, reporter), batch_size)
+        self._cnt = self._max_wire() or 1
+        self.snapshot_origin()
+        self._save_meta()
+        self.commit()
+
+    def _bulk_load(self, records: Iterable[tuple], batch_size: int = 100000):
+        """
+        Load netlist records in a single transaction (a savepoint of the current one, if any).
+        Wirevecs are interned in Python (ids are assigned in the same order as _create_or_lookup_wirevec() would),
+        rows are staged and flushed with executemany(), and the secondary indexes of the loaded tables are dropped
+        during the load and recreated afterwards.
+        """
+        # intern table seeded with the existing wirevecs, keeping the smallest id for duplicated contents
+        interned: dict[tuple[int, ...], int] = {}
+        if self._packed:
+            for id, blob in self.execute("SELECT id, members FROM wirevecs ORDER BY id"):
+                interned.setdefault(tuple(self.unpack_wirevec(blob)), id)
+        else:
+            cur = self.execute("""
+                SELECT w.id, m.wire FROM wirevecs AS w LEFT JOIN wirevec_members AS m ON m.wirevec = w.id
+                ORDER BY w.id, m.idx
+            """)
+            for id, rows in itertools.groupby(cur, key=lambda row: row[0]):
+                interned.setdefault(tuple(w for _, w in rows if w is not None), id)
+        next_id = self._max_wirevec_id()
+
+        staged: dict[str, list[tuple]] = {table: [] for table in self._BULK_INSERTS}
+        new_wirevecs: list[tuple[int, list[int]]] = []  # hashed in one batch at flush time
+
+        def flush():
+            hashes = self._rhash.hash_many([wv for _, wv in new_wirevecs])
+            staged["wirevecs"].extend(
+                (id, h, len(wv), self.pack_wirevec(wv) if self._packed else None) for (id, wv), h in zip(new_wirevecs, hashes)
+            )
+            new_wirevecs.clear()
+            for table, rows in staged.items():
+                if rows:
+                    self.executemany(self._BULK_INSERTS[table], rows)
+                    rows.clear()
+
+        def intern(wv: list[int]) -> int:
+            nonlocal next_id
+            key = tuple(wv)
+            id = interned.get(key)
+            if id is None:
+                next_id += 1
+                id = interned[key] = next_id
+                new_wirevecs.append((id, wv))
+                if self._packed:
+                    staged["wire_refs"].extend((w, id) for w in set(wv))
+                else:
+                    staged["wirevec_members"].extend((id, i, w) for i, w in enumerate(wv))
+            return id
+
+        # inside a transaction (e.g. in batch()) the load is a savepoint, so that a failure only undoes the load
+        nested = self.in_transaction
+        self.execute("SAVEPOINT bulk_load" if nested else "BEGIN")
+        try:
+            indexes = self.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({})".format(
+                    ",".join("?" * len(self._BULK_INSERTS))
+                ),
+                list(self._BULK_INSERTS)
+            ).fetchall()
+            for name, _ in indexes:
+                self.execute(f"DROP INDEX {name}")
+
+            n_staged = 0
+            for rec in records:
+                kind = rec[0]
+                if kind == "input":
+                    _, name, source = rec
+                    staged["from_inputs"].append((intern(source), name))
+                elif kind == "output":
+                    _, name, sink = rec
+                    staged["as_outputs"].append((intern(sink), name))
+                elif kind == "aby":
+                    _, type_, a, b, y = rec
+                    staged["aby_cells"].append((type_, intern(a), intern(b), intern(y)))
+                elif kind == "dff":
+                    _, d, q = rec
+                    staged["dffs"].append((intern(d), intern(q)))
+                elif kind == "absy":
+                    _, type_, a, b, s, y = rec
+                    staged["absy_cells"].append((type_, intern(a), intern(b), intern(s), intern(y)))
+                elif kind == "ay":
+                    _, type_, a, y = rec
+                    staged["ay_cells"].append((type_, intern(a), intern(y)))
+                else:
+                    _, name, module, params, signals = rec
+                    staged["instances"].append((name, json.dumps(params), module))
+                    staged["instance_ports"].extend((name, port, intern(signal)) for port, signal in signals)
+                n_staged += 1
+                if n_staged % batch_size == 0:
+                    flush()
+            flush()
+
+            for _, sql in indexes:
+                self.execute(sql)
+            if nested:
+                self.execute("RELEASE bulk_load")
+            self.commit()
+        except BaseException:
+            if nested:
+                self._interned.clear()
+                self.execute("ROLLBACK TO bulk_load")
+                self.execute("RELEASE bulk_load")
+            else:
+                self.rollback()
+            raise
+
+    def _sync_rhash_powers(self, n: int):
+        """
+        Make sure temp.rhash_powers holds B^idx mod M (and mod M2) for idx < n, so that hashes can be updated in SQL,
+        along with the sums of B^i and i * B^i over i < idx used to hash ranges of fresh wires.
+        """
+        if n <= self._n_powers:
+            return
+        columns = []
+        for k, m in enumerate((self._rhash.M, self._rhash.M2)):
+            if m is None:
+                columns += [itertools.repeat(None)] * 3
+                continue
+            powers = self._rhash.powers(n, k)[:n]
+            columns.append(powers)
+            columns.append(list(itertools.accumulate(powers[:-1], lambda acc, p: (acc + p) % m, initial=0)))
+            columns.append(list(itertools.accumulate(range(n - 1), lambda acc, i: (acc + i * powers[i]) % m, initial=0)))
+        self.executemany(
+            """
+            INSERT INTO temp.rhash_powers (idx, power, range_sum, range_wsum, power2, range_sum2, range_wsum2)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            itertools.islice(zip(itertools.count(), *columns), self._n_powers, n)
+        )
+        self._n_powers = n
+
+    def _merge_cells(self, full: bool = False) -> utils.DisjointSetUnion:
         """
         Return the wires that need to be merged.
+        Only the (type, a, b) groups logged in dirty_aby_cells are checked, unless full is set.
         """
         # TODO: for now, we only check aby_cells
         dsu = utils.DisjointSetUnion()
-        cur = self.execute("SELECT type, a, b, y FROM aby_cells")
-        wires: dict[tuple[str, int, int], list[int]] = {}
-        for type_, a, b, y in cur:
-            if (type_, a, b) not in wires:
-                wires[(type_, a, b)] = []
-            wires[(type_, a, b)].append(y)
-
-        for (type_, a, b), ys in wires.items():
-            if len(ys) > 1:
-                # remove duplicates
-                cur.execute("DELETE FROM aby_cells WHERE type = ? AND a = ? AND b = ? AND y != ?", (type_, a, b, ys[0]))
-                wv0 = self._get_wirevec(ys[0])
-                for y in ys[1:]:
-                    wv = self._get_wirevec(y)
-                    for w0, w in zip(wv0, wv):
-                        dsu.union(w0, w)
+        cur = self.execute("DELETE FROM temp.congruent_cells")
+        # the kept cell of each congruence group is the one with the smallest y
+        if full:
+            cur.execute("""
+                INSERT INTO temp.congruent_cells (type, a, b, y)
+                SELECT type, a, b, MIN(y) FROM aby_cells GROUP BY type, a, b HAVING COUNT(*) > 1
+            """)
+        else:
+            cur.execute("""
+                INSERT INTO temp.congruent_cells (type, a, b, y)
+                SELECT cell.type, cell.a, cell.b, MIN(cell.y)
+                FROM dirty_aby_cells AS d JOIN aby_cells AS cell ON cell.type = d.type AND cell.a = d.a AND cell.b = d.b
+                GROUP BY cell.type, cell.a, cell.b HAVING COUNT(*) > 1
+            """)
+        cur.execute("DELETE FROM dirty_aby_cells")
+        if self._packed:
+            cur.execute("""
+                SELECT keep.members, dup.members
+                FROM temp.congruent_cells AS grp
+                JOIN aby_cells AS cell ON cell.type = grp.type AND cell.a = grp.a AND cell.b = grp.b AND cell.y != grp.y
+                JOIN wirevecs AS keep ON keep.id = grp.y
+                JOIN wirevecs AS dup ON dup.id = cell.y
+            """)
+            for keep, dup in cur:
+                dsu.union_many(zip(self.unpack_wirevec(keep), self.unpack_wirevec(dup)))
+        else:
+            cur.execute("""
+                SELECT keep.wire, dup.wire
+                FROM temp.congruent_cells AS grp
+                JOIN aby_cells AS cell ON cell.type = grp.type AND cell.a = grp.a AND cell.b = grp.b AND cell.y != grp.y
+                JOIN wirevec_members AS keep ON keep.wirevec = grp.y
+                JOIN wirevec_members AS dup ON dup.wirevec = cell.y AND dup.idx = keep.idx
+            """)
+            dsu.union_many(cur)
+        # remove duplicates
+        cur.execute("""
+            DELETE FROM aby_cells WHERE rowid IN (
+                SELECT cell.rowid FROM temp.congruent_cells AS grp
+                JOIN aby_cells AS cell ON cell.type = grp.type AND cell.a = grp.a AND cell.b = grp.b AND cell.y != grp.y
+            )
+        """)
         self.commit()
         return dsu
 
     def _merge_wires(self, wires_to_merge: utils.DisjointSetUnion):
-        for w in wires_to_merge.parents:
-            cur = self.execute("SELECT wirevec, idx FROM wirevec_members WHERE wire = ?", (w,))
-            for wv, idx in cur.fetchall():
-                cur.execute("SELECT hash FROM wirevecs WHERE id = ?", (wv,))
-                old_h = cur.fetchone()[0]
-                new_w = wires_to_merge.find(w)
-                # update wirevec member
-                cur.execute("UPDATE wirevec_members SET wire = ? WHERE wirevec = ? AND idx = ?", (new_w, wv, idx))
-                # update hash
-                cur.execute("UPDATE wirevecs SET hash = ? WHERE id = ?", (self._rhash.update(old_h, idx, w, new_w), wv))
-        self.commit()
+        cur = self.execute("DELETE FROM temp.wire_map")
+        # the interned contents mentioning a merged wire are no longer those of any wirevec
+        self._interned.discard_wires(w for w, _ in wires_to_merge.mapping())
+        wires_to_merge.to_sql(self, "temp.wire_map", ("wire", "root"))
+        # the CROSS JOINs keep the (small) wire map as the outer loop, probing the references by wire: left to itself,
+        # the planner scans all of wire_refs / wirevec_members and probes the map instead
+        if self._packed:
+            # rewrite the members of every wirevec referencing a merged wire, and move the reverse index entries
+            cur.execute("""
+                SELECT id, hash, members FROM wirevecs
+                WHERE id IN (SELECT r.wirevec FROM temp.wire_map AS wm CROSS JOIN wire_refs AS r ON r.wire = wm.wire)
+            """)
+            updates = []
+            for id, h, blob in cur:
+                old = self.unpack_wirevec(blob)
+                wv = wires_to_merge.canonicalize(old)
+                subs = [(i, w, root) for i, (w, root) in enumerate(zip(old, wv)) if w != root]
+                updates.append((self.pack_wirevec(wv), self._rhash.update_many(h, subs), id))
+            cur.executemany("UPDATE wirevecs SET members = ?, hash = ? WHERE id = ?", updates)
+            cur.execute("""
+                INSERT OR IGNORE INTO wire_refs (wire, wirevec)
+                SELECT wm.root, r.wirevec FROM temp.wire_map AS wm CROSS JOIN wire_refs AS r ON r.wire = wm.wire
+            """)
+            cur.execute("DELETE FROM wire_refs WHERE wire IN (SELECT wire FROM temp.wire_map)")
+            self.commit()
+            return
 
-    def _merge_wirevecs(self):
-        dsu = utils.DisjointSetUnion()
-        cur = self.execute("SELECT id, hash FROM wirevecs")
-        wirevecs: dict[int, list[int]] = {}
-        for id, h in cur:
-            if h not in wirevecs:
-                wirevecs[h] = []
-            wirevecs[h].append(id)
-
-        for h, ids in wirevecs.items():
-            if len(ids) > 1:
-                wvs: dict[tuple[int, ...], list[int]] = {}
-                for id in ids:
-                    wv = self._get_wirevec(id)
-                    if tuple(wv) not in wvs:
-                        wvs[tuple(wv)] = []
-                    wvs[tuple(wv)].append(id)
-                for wvids in wvs.values():
-                    if len(wvids) > 1:
-                        for wvid in range(1, len(wvids)):
-                            dsu.union(wvids[0], wvids[wvid])
-
-        cur.executemany("DELETE FROM wirevecs WHERE id = ?", ((wv,) for wv in dsu.parents if dsu.find(wv) != wv))
-        cur.executemany("DELETE FROM wirevec_members WHERE wirevec = ?", ((wv,) for wv in dsu.parents if dsu.find(wv) != wv))   # TODO: it seems that SQLite does not support ON DELETE CASCADE, delete manually
+        # shift the hashes of the touched wirevecs by the substituted members (the batched form of RollingHash.update()),
+        # before the members themselves change
+        max_idx = cur.execute(
+            "SELECT MAX(m.idx) FROM temp.wire_map AS wm CROSS JOIN wirevec_members AS m ON m.wire = wm.wire"
+        ).fetchone()[0]
+        if max_idx is None:
+            self.commit()
+            return
+        self._sync_rhash_powers(max_idx + 1)
+        params = {"M": self._rhash.M, "M2": self._rhash.M2}
+        if self._rhash.M2 is None:
+            deltas = "SUM((wm.root - wm.wire) % :M * p.power % :M) % :M AS d1"
+            new_hash = "((wirevecs.hash + d.d1) % :M + :M) % :M"
+        else:
+            deltas = """
+                SUM((wm.root - wm.wire) % :M * p.power % :M) % :M AS d1,
+                SUM((wm.root - wm.wire) % :M2 * p.power2 % :M2) % :M2 AS d2
+            """
+            new_hash = "((wirevecs.hash / :M2 + d.d1) % :M + :M) % :M * :M2 + ((wirevecs.hash % :M2 + d.d2) % :M2 + :M2) % :M2"
+        cur.execute(f"""
+            UPDATE wirevecs SET hash = {new_hash} FROM (
+                SELECT m.wirevec AS id, {deltas}
+                FROM temp.wire_map AS wm
+                CROSS JOIN wirevec_members AS m ON m.wire = wm.wire
+                CROSS JOIN temp.rhash_powers AS p ON p.idx = m.idx
+                GROUP BY m.wirevec
+            ) AS d
+            WHERE wirevecs.id = d.id
+        """, params)
+        # update wirevec members
+        cur.execute("""
+            UPDATE wirevec_members SET wire = (SELECT wm.root FROM temp.wire_map AS wm WHERE wm.wire = wirevec_members.wire)
+            WHERE wire IN (SELECT wire FROM temp.wire_map)
+        """)
         self.commit()
-        return dsu
 
-    def _update_cells(self, dsu: utils.DisjointSetUnion):
-        # TODO: for now, we only update aby_cells and dffs
-        for wv in dsu.parents:
-            leader = dsu.find(wv)
-            if leader != wv:
-                # update aby_cells
-                cur = self.execute("SELECT type, b, y FROM aby_cells WHERE a = ?", (wv,))
-                rows = cur.fetchall()
-                cur.execute("DELETE FROM aby_cells WHERE a = ?", (wv,))
-                cur.executemany(
-                    "INSERT OR IGNORE INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)",
-                    ((type_, leader, b, y) for type_, b, y in rows)
-                )
-                cur = self.execute("SELECT type, a, y FROM aby_cells WHERE b = ?", (wv,))
-                rows = cur.fetchall()
-                cur.execute("DELETE FROM aby_cells WHERE b = ?", (wv,))
-                cur.executemany(
-                    "INSERT OR IGNORE INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)",
-                    ((type_, a, leader, y) for type_, a, y in rows)
-                )
-                cur = self.execute("SELECT type, a, b FROM aby_cells WHERE y = ?", (wv,))
-                rows = cur.fetchall()
-                cur.execute("DELETE FROM aby_cells WHERE y = ?", (wv,))
-                cur.executemany(
-                    "INSERT OR IGNORE INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)",
-                    ((type_, a, b, leader) for type_, a, b in rows)
-                )
+    @property
+    def _same_wirevec(self) -> str:
+        """
+        SQL condition: wirevecs w1 and w2 of the same width have the same members.
+        """
+        if self._packed:
+            return "w1.members = w2.members"
+        return """
+            NOT EXISTS (
+                SELECT 1 FROM wirevec_members AS m1 JOIN wirevec_members AS m2 ON m2.wirevec = w2.id AND m2.idx = m1.idx
+                WHERE m1.wirevec = w1.id AND m1.wire != m2.wire
+            )
+        """
 
-                # update dffs
-                cur = self.execute("SELECT d, q FROM dffs WHERE d = ?", (wv,))
-                rows = cur.fetchall()
-                cur.execute("DELETE FROM dffs WHERE d = ?", (wv,))
-                cur.executemany(
-                    "INSERT OR IGNORE INTO dffs (d, q) VALUES (?, ?)",
-                    ((leader, q) for _, q in rows)
-                )
-                cur = self.execute("SELECT d, q FROM dffs WHERE q = ?", (wv,))
-                rows = cur.fetchall()
-                cur.execute("DELETE FROM dffs WHERE q = ?", (wv,))
-                cur.executemany(
-                    "INSERT OR IGNORE INTO dffs (d, q) VALUES (?, ?)",
-                    ((d, leader) for d, _ in rows)
+    def _merge_wirevecs(self, full: bool = False):
+        """
+        Fill temp.wirevec_map with the wirevecs that duplicate another one, mapped to the smallest id of their class,
+        and delete the duplicates.
+        Only the wirevecs logged in dirty_wirevecs are looked up, unless full is set.
+        """
+        cur = self.execute("DELETE FROM temp.wirevec_map")
+        if full:
+            cur.execute(f"""
+                INSERT INTO temp.wirevec_map (wirevec, root)
+                SELECT w2.id, MIN(w1.id)
+                FROM wirevecs AS w1 JOIN wirevecs AS w2 ON w2.hash = w1.hash AND w2.width = w1.width AND w2.id > w1.id
+                WHERE {self._same_wirevec}
+                GROUP BY w2.id
+            """)
+        else:
+            # a class is a dirty wirevec plus all its duplicates, which need not be dirty themselves
+            cur.execute(f"""
+                WITH pairs AS (
+                    SELECT w1.id AS w, w2.id AS o
+                    FROM dirty_wirevecs AS d
+                    JOIN wirevecs AS w1 ON w1.id = d.id
+                    JOIN wirevecs AS w2 ON w2.hash = w1.hash AND w2.width = w1.width AND w2.id != w1.id
+                    WHERE {self._same_wirevec}
+                ), roots AS (
+                    SELECT w, MIN(MIN(o), w) AS root FROM pairs GROUP BY w
                 )
+                INSERT OR IGNORE INTO temp.wirevec_map (wirevec, root)
+                SELECT w, root FROM roots WHERE w != root
+                UNION
+                SELECT pairs.o, roots.root FROM pairs JOIN roots ON roots.w = pairs.w WHERE pairs.o != roots.root
+            """)
+        cur.execute("DELETE FROM dirty_wirevecs")
+        if len(self._interned):
+            self._interned.remap(cur.execute("SELECT wirevec, root FROM temp.wirevec_map").fetchall())
+        cur.execute("DELETE FROM wirevecs WHERE id IN (SELECT wirevec FROM temp.wirevec_map)")
+        # TODO: it seems that SQLite does not support ON DELETE CASCADE, delete manually
+        if self._packed:
+            cur.execute("DELETE FROM wire_refs WHERE wirevec IN (SELECT wirevec FROM temp.wirevec_map)")
+        else:
+            cur.execute("DELETE FROM wirevec_members WHERE wirevec IN (SELECT wirevec FROM temp.wirevec_map)")
+        self.commit()
+
+    def _update_cells(self):
+        """
+        Rewrite every reference to a wirevec in temp.wirevec_map to its root.
+        """
+        cur = self.cursor()
+        for table, (keys, refs) in itertools.chain(self._CELL_TABLES.items(), self._ledgers.items()):
+            cols = ", ".join(keys + refs)
+            canon = ", ".join(tuple(f"t.{key}" for key in keys) + tuple(f"COALESCE(m_{ref}.root, t.{ref})" for ref in refs))
+            joins = " ".join(f"LEFT JOIN temp.wirevec_map AS m_{ref} ON m_{ref}.wirevec = t.{ref}" for ref in refs)
+            stale = " OR ".join(f"t.{ref} IN (SELECT wirevec FROM temp.wirevec_map)" for ref in refs)
+            # insert the canonical rows first, then drop the stale ones
+            cur.execute(f"INSERT OR IGNORE INTO {table} ({cols}) SELECT {canon} FROM {table} AS t {joins} WHERE {stale}")
+            cur.execute(f"DELETE FROM {table} AS t WHERE {stale}")
+        for table, ref in self._PORT_TABLES.items():
+            cur.execute(f"UPDATE {table} SET {ref} = m.root FROM temp.wirevec_map AS m WHERE {table}.{ref} = m.wirevec")
         self.commit()
 
-    def rebuild_once(self) -> bool:
+    def _wirevec_refs(self) -> Iterator[tuple[str, tuple[str, ...]]]:
+        """
+        Yield every table referencing wirevecs by id, with the referencing columns.
+        """
+        for table, (_, refs) in itertools.chain(self._CELL_TABLES.items(), self._ledgers.items()):
+            yield table, refs
+        for table, ref in self._PORT_TABLES.items():
+            yield table, (ref,)
+        yield "wirevec_members" if not self._packed else "wire_refs", ("wirevec",)
+        yield "dirty_aby_cells", ("a", "b")
+        yield "dirty_wirevecs", ("id",)
+
+    def compact(self, renumber: bool = False, vacuum: bool = True) -> dict[str, int]:
+        """
+        Garbage-collect the e-graph: mark the wirevecs reachable from the outputs, instance ports and inputs by
+        walking back from the output of every cell to its inputs, then delete every row referencing an unreachable
+        wirevec. With renumber, wirevec ids are then made dense (1, 2, ...) in their current order. Finally the
+        database is vacuumed (if vacuum, and not inside batch()) and analyzed. Return the number of rows deleted per table.
+        """
+        self._interned.clear()
+        cur = self.execute("DELETE FROM temp.live_wirevecs")
+        # one recursive step per cell input: the inputs of a cell are live if its output is
+        steps = " UNION ".join(
+            f"SELECT c.{ref} FROM live JOIN {table} AS c ON c.{refs[-1]} = live.id"
+            for table, (_, refs) in self._CELL_TABLES.items() for ref in refs[:-1]
+        )
+        cur.execute(f"""
+            INSERT INTO temp.live_wirevecs (id)
+            WITH RECURSIVE live(id) AS (
+                SELECT sink FROM as_outputs UNION SELECT signal FROM instance_ports UNION SELECT source FROM from_inputs
+                UNION {steps}
+            )
+            SELECT id FROM live
+        """)
+        removed = {}
+        for table, refs in itertools.chain(self._wirevec_refs(), [("wirevecs", ("id",))]):
+            dead = " OR ".join(f"{ref} NOT IN (SELECT id FROM temp.live_wirevecs)" for ref in refs)
+            removed[table] = cur.execute(f"DELETE FROM {table} WHERE {dead}").rowcount
+        if renumber:
+            self._renumber_wirevecs()
+        self.commit()
+        if vacuum and not self._batch_depth:
+            self.execute("VACUUM")
+        self.execute("ANALYZE")
+        self.commit()
+        return removed
+
+    def _renumber_wirevecs(self):
+        """
+        Renumber wirevec ids densely, keeping their order. Every reference is first set to the negated new id
+        and then flipped, so that no intermediate state collides with an id still in use.
+        """
+        cur = self.execute("DELETE FROM temp.wirevec_ids")
+        cur.execute("INSERT INTO temp.wirevec_ids (old, new) SELECT id, ROW_NUMBER() OVER (ORDER BY id) FROM wirevecs")
+        for table, refs in itertools.chain(self._wirevec_refs(), [("wirevecs", ("id",))]):
+            sets = ", ".join(f"{ref} = -(SELECT new FROM temp.wirevec_ids WHERE old = {table}.{ref})" for ref in refs)
+            cur.execute(f"UPDATE {table} SET {sets}")
+            cur.execute(f"UPDATE {table} SET {', '.join(f'{ref} = -{ref}' for ref in refs)}")
+        cur.execute("UPDATE sqlite_sequence SET seq = (SELECT COUNT(*) FROM wirevecs) WHERE name = 'wirevecs'")
+
+    def rebuild_once(self, full: bool = False) -> bool:
         # union
         # merge_cells -> merge_wires -> merge_wirevecs -> update_cells
         # all phases are batched processing
-        # TODO: parallelize them
-        wires_to_merge = self._merge_cells()
-        if not wires_to_merge.parents:
+        # every phase is a handful of set-based statements over the temp tables
+        # by default only the rows logged since the last rebuild are checked (see the change log in schema.sql),
+        # full=True rescans every table, e.g. as a fallback or to validate the incremental path
+        with self.phase("rebuild.merge_cells"):
+            wires_to_merge = self._merge_cells(full)
+        if not len(wires_to_merge):
             return False
-        self._merge_wires(wires_to_merge)
-        wirevecs_to_merge = self._merge_wirevecs()
-        self._update_cells(wirevecs_to_merge)
+        with self.phase("rebuild.merge_wires"):
+            self._merge_wires(wires_to_merge)
+        with self.phase("rebuild.merge_wirevecs"):
+            self._merge_wirevecs(full)
+        with self.phase("rebuild.update_cells"):
+            self._update_cells()
         return True
 
-    def rebuild(self) -> int:
+    def rebuild(self, full: bool = False) -> int:
         cnt = 0
-        while self.rebuild_once():
-            cnt += 1
-        return cnt
\ No newline at end of file
+        with self.phase("rebuild"):
+            while self.rebuild_once(full):
+                cnt += 1
+        return cnt
@@ -0,0 +1,259 @@
+"""
+Multi-module designs: every module of a Yosys JSON netlist is built and saturated in its own process, with its own
+NetlistDB file. Identical modules (same ports and cells, whatever their names and attributes) are only optimized once,
+and a small index database records which file holds each module and the instance hierarchy between them.
+"""
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Iterator
+from .db import NetlistDB
+from .runner import Rule, Runner
+from . import rewrites, yosys
+
+
+_INDEX_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS modules (
+        name VARCHAR(16) PRIMARY KEY,
+        digest CHAR(64) NOT NULL,
+        db_file TEXT NOT NULL,
+        cells INTEGER,
+        enodes INTEGER,
+        stop_reason VARCHAR(16),
+        build_time REAL,
+        run_time REAL
+    );
+    CREATE TABLE IF NOT EXISTS hierarchy (
+        parent VARCHAR(16),
+        instance VARCHAR(16),
+        module VARCHAR(16),
+        PRIMARY KEY (parent, instance)
+    );
+    CREATE INDEX IF NOT EXISTS hierarchy_module ON hierarchy(module);
+"""
+
+
+def default_rules() -> list[Rule]:
+    """
+    The rules run on every module unless optimize() is given others (a picklable, e.g. module-level, function).
+    """
+    types = ["$adds", "$addu", "$muls", "$mulu"]
+    return [
+        rewrites.rewrite("comm", rewrites.COMM, types, in_db=True),
+        rewrites.rewrite("assoc_to_right", rewrites.ASSOC_TO_RIGHT, types, in_db=True),
+        rewrites.rewrite("assoc_to_left", rewrites.ASSOC_TO_LEFT, types, in_db=True),
+        rewrites.rewrite("dff_forward_aby_cell", rewrites.DFF_FORWARD_ABY_CELL, types, in_db=True),
+    ]
+
+
+def module_digest(mod: dict[str, Any]) -> str:
+    """
+    Hash the netlist content of a module: its ports and the type, parameters and connections of its cells.
+    Names and attributes (source locations) are left out, except the module_not_derived marker of blackboxes.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps(mod["ports"], sort_keys=True).encode())
+    for cell in sorted(
+        json.dumps([c["type"], c["parameters"], c["connections"], "module_not_derived" in c.get("attributes", {})], sort_keys=True)
+        for c in mod["cells"].values()
+    ):
+        h.update(cell.encode())
+    return h.hexdigest()
+
+
+@dataclass
+class ModuleResult:
+    name: str
+    digest: str
+    db_file: str
+    cells: int = 0
+    enodes: int = 0
+    stop_reason: str | None = None
+    build_time: float = 0.0
+    run_time: float = 0.0
+    instances: list[tuple[str, str]] = field(default_factory=list)  # (instance, module) of the submodules
+
+
+@dataclass
+class _Job:
+    name: str
+    digest: str
+    db_file: str
+    source: str | dict[str, Any]    # a Yosys JSON file, streamed by the worker, or the module itself
+    submodules: list[str]
+    schema_file: str
+    packed: bool
+    profile: str | None
+    clk: str
+    rules: Callable[[], list[Rule]]
+    runner_options: dict[str, Any]
+
+
+def _optimize_module(job: _Job) -> ModuleResult:
+    """
+    Build and saturate one module into its own database file (run in a worker process).
+    """
+    for suffix in ("", "-wal", "-shm"):
+        pathlib.Path(job.db_file + suffix).unlink(missing_ok=True)
+    db = NetlistDB(job.schema_file, job.db_file, packed=job.packed, profile=job.profile)
+    t = time.time()
+    if isinstance(job.source, str):
+        db.build_from_file(job.source, job.name, job.clk, progress=False, submodules=job.submodules)
+    else:
+        db.build_from_json(job.source, job.clk, bulk=True, progress=False, submodules=job.submodules)
+    db.rebuild()
+    result = ModuleResult(job.name, job.digest, job.db_file, cells=db.count_enodes(), build_time=time.time() - t)
+    report = Runner(db, job.rules(), **job.runner_options).run()
+    result.run_time = report.total_time
+    result.stop_reason = report.stop_reason.value if report.stop_reason is not None else None
+    result.enodes = db.count_enodes()
+    result.instances = db.execute(
+        "SELECT name, module FROM instances WHERE module IN ({})".format(",".join("?" * len(job.submodules))), job.submodules
+    ).fetchall()
+    db.close()
+    return result
+
+
+def _iter_modules(source: str | dict[str, Any]) -> Iterator[tuple[str, dict[str, Any]]]:
+    """
+    Yield the (name, module) pairs of a design, one module in memory at a time for a file, of which only the ports
+    and cells are read.
+    """
+    if not isinstance(source, str):
+        yield from source["modules"].items()
+        return
+    with open(source, "r") as f:
+        stream = yosys.JsonStream(f)
+        for key in stream.iter_object():
+            if key != "modules":
+                stream.skip_value()
+                continue
+            for name in stream.iter_object():
+                # port by port and cell by cell, as iter_module() does: read_value() of a whole module holds its
+                # text and its decoded form at once
+                mod = {"ports": {}, "cells": {}}
+                for section in stream.iter_object():
+                    if section not in mod:
+                        stream.skip_value()
+                        continue
+                    for key in stream.iter_object():
+                        mod[section][key] = stream.read_value()
+                yield name, mod
+
+
+class Design:
+    """
+    The optimized modules of a design, as recorded in the index database (see optimize()).
+    """
+    modules: dict[str, ModuleResult]
+    _index_file: str
+    _schema_file: str
+    _packed: bool
+    _clk: str
+
+    def __init__(self, index_file: str, modules: dict[str, ModuleResult], schema_file: str, packed: bool, clk: str):
+        self._index_file = index_file
+        self.modules = modules
+        self._schema_file = schema_file
+        self._packed = packed
+        self._clk = clk
+
+    @property
+    def index_file(self) -> str:
+        return self._index_file
+
+    def index(self) -> sqlite3.Connection:
+        """
+        Open the index database (tables modules and hierarchy).
+        """
+        return sqlite3.connect(self._index_file)
+
+    def tops(self) -> list[str]:
+        """
+        Return the modules not instantiated by any other.
+        """
+        used = {module for result in self.modules.values() for _, module in result.instances}
+        return [name for name in self.modules if name not in used]
+
+    def open(self, name: str) -> NetlistDB:
+        """
+        Open the database of a module.
+        """
+        return NetlistDB.open(self.modules[name].db_file, self._schema_file)
+
+    def attach(self, conn: sqlite3.Connection, name: str, alias: str | None = None) -> str:
+        """
+        ATTACH the database of a module to conn and return its schema name, e.g. to join the cells of
+        a parent and a submodule in one query. SQLite allows 10 attached databases by default.
+        """
+        alias = alias or "m_" + self.modules[name].digest[:16]
+        if not alias.isidentifier():
+            raise ValueError(f"Invalid schema name: {alias}")
+        conn.execute(f"ATTACH DATABASE ? AS {alias}", (self.modules[name].db_file,))
+        return alias
+
+
+def optimize(
+    source: str | dict[str, Any],
+    out_dir: str,
+    rules: Callable[[], list[Rule]] = default_rules,
+    workers: int | None = None,
+    clk: str = "clk",
+    packed: bool = True,
+    schema_file: str | None = None,
+    profile: str | None = "bulk",
+    **runner_options
+) -> Design:
+    """
+    Build and saturate every module of a design (a Yosys JSON file, or its parsed dict) in parallel processes.
+    Each distinct module gets out_dir/<digest>.db, shared by its identical copies; out_dir/design.db indexes them.
+    rules is called in each worker to create the rules, runner_options are passed to the Runner. The module databases
+    are written with the given NetlistDB profile: "bulk" skips the fsyncs, since they can be rebuilt from the source.
+    """
+    out = pathlib.Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    if schema_file is None:
+        schema_file = str(pathlib.Path(__file__).with_name("schema.sql"))
+
+    # one job per distinct module, the largest first so that the pool stays busy
+    names, digests, sizes, jobs = [], {}, {}, {}
+    for name, mod in _iter_modules(source):
+        digest = digests[name] = module_digest(mod)
+        names.append(name)
+        if digest not in jobs:
+            sizes[digest] = len(mod["cells"])
+            jobs[digest] = (name, mod if not isinstance(source, str) else source)
+    results: dict[str, ModuleResult] = {}
+    with ProcessPoolExecutor(workers or os.cpu_count()) as pool:
+        futures = {
+            digest: pool.submit(_optimize_module, _Job(
+                name, digest, str(out / f"{digest[:16]}.db"), src, names, schema_file, packed, profile, clk, rules, runner_options
+            ))
+            for digest, (name, src) in sorted(jobs.items(), key=lambda job: -sizes[job[0]])
+        }
+        by_digest = {digest: future.result() for digest, future in futures.items()}
+    for name in names:
+        result = by_digest[digests[name]]
+        results[name] = result if result.name == name else replace(result, name=name)
+
+    index_file = str(out / "design.db")
+    with closing(sqlite3.connect(index_file)) as conn:
+        conn.executescript(_INDEX_SCHEMA)
+        conn.execute("DELETE FROM modules")
+        conn.execute("DELETE FROM hierarchy")
+        conn.executemany(
+            "INSERT INTO modules (name, digest, db_file, cells, enodes, stop_reason, build_time, run_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            ((r.name, r.digest, r.db_file, r.cells, r.enodes, r.stop_reason, r.build_time, r.run_time) for r in results.values())
+        )
+        conn.executemany(
+            "INSERT INTO hierarchy (parent, instance, module) VALUES (?, ?, ?)",
+            ((r.name, instance, module) for r in results.values() for instance, module in r.instances)
+        )
+        conn.commit()
+    return Design(index_file, results, schema_file, packed, clk)
@@ -4,6 +4,7 @@
 #include <pybind11/pytypes.h>
 #include <pybind11/stl.h>
 #include <sqlite3.h>
+#include <iostream>
 
 
 namespace emapcc::db {
@@ -28,20 +29,26 @@ std::vector<int> _get_bits_of_wirevec(sqlite3* db, int id) {
     return bits;
 }
 
-int _create_or_lookup_wirevec(sqlite3* db, const std::vector<int>& bits, int B, int M) {
-    // compute hash
-    int h = 0;
-    for (int bit : bits) {
-        h = (h * B + bit) % M;
+int _create_or_lookup_wirevec(sqlite3* db, const std::vector<int>& bits, int B, int M, int M2) {
+    // compute hash: sum(bits[i] * B^i) mod M, combined with the same sum mod M2 as h * M2 + h2 if M2 != 0,
+    // same as utils.RollingHash.hash()
+    int64_t h = 0, h2 = 0;
+    for (auto it = bits.rbegin(); it != bits.rend(); ++it) {
+        h = ((h * B + *it) % M + M) % M;
+        if (M2)
+            h2 = ((h2 * B + *it) % M2 + M2) % M2;
     }
+    if (M2)
+        h = h * M2 + h2;
 
     // lookup existing wirevec by hash
     sqlite3_stmt* lookup_stmt;
-    const char* lookup_sql = "SELECT id FROM wirevecs WHERE hash = ?";
+    const char* lookup_sql = "SELECT id FROM wirevecs WHERE hash = ? AND width = ?";
     if (sqlite3_prepare_v2(db, lookup_sql, -1, &lookup_stmt, nullptr) != SQLITE_OK)
         throw std::runtime_error("Failed to prepare lookup statement: " + std::string(sqlite3_errmsg(db)));
 
-    sqlite3_bind_int(lookup_stmt, 1, h);
+    sqlite3_bind_int64(lookup_stmt, 1, h);
+    sqlite3_bind_int(lookup_stmt, 2, static_cast<int>(bits.size()));
     while (sqlite3_step(lookup_stmt) == SQLITE_ROW) {
         int id = sqlite3_column_int(lookup_stmt, 0);
         if (_get_bits_of_wirevec(db, id) == bits) {
@@ -57,11 +64,12 @@ int _create_or_lookup_wirevec(sqlite3* db, const std::vector<int>& bits, int B,
 
     // insert new wirevec
     sqlite3_stmt* insert_wirevec;
-    const char* insert_sql = "INSERT INTO wirevecs (hash) VALUES (?)";
+    const char* insert_sql = "INSERT INTO wirevecs (hash, width) VALUES (?, ?)";
     if (sqlite3_prepare_v2(db, insert_sql, -1, &insert_wirevec, nullptr) != SQLITE_OK)
         throw std::runtime_error("Failed to prepare insert statement: " + std::string(sqlite3_errmsg(db)));
 
-    sqlite3_bind_int(insert_wirevec, 1, h);
+    sqlite3_bind_int64(insert_wirevec, 1, h);
+    sqlite3_bind_int(insert_wirevec, 2, static_cast<int>(bits.size()));
     if (sqlite3_step(insert_wirevec) != SQLITE_DONE) {
         sqlite3_finalize(insert_wirevec);
         throw std::runtime_error("Failed to insert wirevec: " + std::string(sqlite3_errmsg(db)));
@@ -95,10 +103,10 @@ int _create_or_lookup_wirevec(sqlite3* db, const std::vector<int>& bits, int B,
 }
 
 
-void _add_aby_cell(sqlite3* db, const std::string& type, const std::vector<int>& a, const std::vector<int>& b, const std::vector<int>& y, int B, int M) {
-    auto wva = _create_or_lookup_wirevec(db, a, B, M);
-    auto wvb = _create_or_lookup_wirevec(db, b, B, M);
-    auto wvy = _create_or_lookup_wirevec(db, y, B, M);
+void _add_aby_cell(sqlite3* db, const std::string& type, const std::vector<int>& a, const std::vector<int>& b, const std::vector<int>& y, int B, int M, int M2) {
+    auto wva = _create_or_lookup_wirevec(db, a, B, M, M2);
+    auto wvb = _create_or_lookup_wirevec(db, b, B, M, M2);
+    auto wvy = _create_or_lookup_wirevec(db, y, B, M, M2);
     sqlite3_stmt* stmt;
     const char* sql = "INSERT INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)";
     if (sqlite3_prepare_v2(db, sql, -1, &stmt, nullptr) != SQLITE_OK) {
@@ -115,9 +123,9 @@ void _add_aby_cell(sqlite3* db, const std::string& type, const std::vector<int>&
     sqlite3_finalize(stmt);
 }
 
-void _add_dff(sqlite3* db, const std::vector<int>& d, const std::vector<int>& q, int B, int M) {
-    auto wvd = _create_or_lookup_wirevec(db, d, B, M);
-    auto wvq = _create_or_lookup_wirevec(db, q, B, M);
+void _add_dff(sqlite3* db, const std::vector<int>& d, const std::vector<int>& q, int B, int M, int M2) {
+    auto wvd = _create_or_lookup_wirevec(db, d, B, M, M2);
+    auto wvq = _create_or_lookup_wirevec(db, q, B, M, M2);
     sqlite3_stmt* stmt;
     const char* sql = "INSERT INTO dffs (d, q) VALUES (?, ?)";
     if (sqlite3_prepare_v2(db, sql, -1, &stmt, nullptr) != SQLITE_OK) {
@@ -132,11 +140,11 @@ void _add_dff(sqlite3* db, const std::vector<int>& d, const std::vector<int>& q,
     sqlite3_finalize(stmt);
 }
 
-void _add_absy_cell(sqlite3* db, const std::string& type, const std::vector<int>& a, const std::vector<int>& b, const std::vector<int>& s, const std::vector<int>& y, int B, int M) {
-    auto wva = _create_or_lookup_wirevec(db, a, B, M);
-    auto wvb = _create_or_lookup_wirevec(db, b, B, M);
-    auto wvs = _create_or_lookup_wirevec(db, s, B, M);
-    auto wvy = _create_or_lookup_wirevec(db, y, B, M);
+void _add_absy_cell(sqlite3* db, const std::string& type, const std::vector<int>& a, const std::vector<int>& b, const std::vector<int>& s, const std::vector<int>& y, int B, int M, int M2) {
+    auto wva = _create_or_lookup_wirevec(db, a, B, M, M2);
+    auto wvb = _create_or_lookup_wirevec(db, b, B, M, M2);
+    auto wvs = _create_or_lookup_wirevec(db, s, B, M, M2);
+    auto wvy = _create_or_lookup_wirevec(db, y, B, M, M2);
     sqlite3_stmt* stmt;
     const char* sql = "INSERT INTO absy_cells (type, a, b, s, y) VALUES (?, ?, ?, ?, ?)";
     if (sqlite3_prepare_v2(db, sql, -1, &stmt, nullptr) != SQLITE_OK) {
@@ -154,9 +162,9 @@ void _add_absy_cell(sqlite3* db, const std::string& type, const std::vector<int>
     sqlite3_finalize(stmt);
 }
 
-void _add_ay_cell(sqlite3* db, const std::string& type, const std::vector<int>& a, const std::vector<int>& y, int B, int M) {
-    auto wva = _create_or_lookup_wirevec(db, a, B, M);
-    auto wvy = _create_or_lookup_wirevec(db, y, B, M);
+void _add_ay_cell(sqlite3* db, const std::string& type, const std::vector<int>& a, const std::vector<int>& y, int B, int M, int M2) {
+    auto wva = _create_or_lookup_wirevec(db, a, B, M, M2);
+    auto wvy = _create_or_lookup_wirevec(db, y, B, M, M2);
     sqlite3_stmt* stmt;
     const char* sql = "INSERT INTO ay_cells (type, a, y) VALUES (?, ?, ?)";
     if (sqlite3_prepare_v2(db, sql, -1, &stmt, nullptr) != SQLITE_OK) {
@@ -195,7 +203,7 @@ std::tuple<int, int> build_from_json(
     const std::string& db_file,
     const pybind11::dict& mod,
     const std::string& clk_name,
-    int B, int M    // rolling hash parameters
+    int B, int M, int M2    // rolling hash parameters, M2 = 0 for a single modulus
 ) {
     // open sqlite3 connection
     sqlite3* db;
@@ -222,7 +230,7 @@ std::tuple<int, int> build_from_json(
                 }
                 clk = bits[0];
             }
-            auto id = _create_or_lookup_wirevec(db, bits, B, M);
+            auto id = _create_or_lookup_wirevec(db, bits, B, M, M2);
             sqlite3_stmt* stmt;
             const char* sql = "INSERT INTO from_inputs (source, name) VALUES (?, ?)";
             if (sqlite3_prepare_v2(db, sql, -1, &stmt, nullptr) != SQLITE_OK) {
@@ -237,7 +245,7 @@ std::tuple<int, int> build_from_json(
             sqlite3_finalize(stmt);
         }
         else if (direction == "output") {
-            auto id = _create_or_lookup_wirevec(db, bits, B, M);
+            auto id = _create_or_lookup_wirevec(db, bits, B, M, M2);
             sqlite3_stmt* stmt;
             const char* sql = "INSERT INTO as_outputs (sink, name) VALUES (?, ?)";
             if (sqlite3_prepare_v2(db, sql, -1, &stmt, nullptr) != SQLITE_OK) {
@@ -282,7 +290,7 @@ std::tuple<int, int> build_from_json(
             for (auto bit : conns["A"].cast<pybind11::list>()) a.push_back(_bit_to_int(bit));
             for (auto bit : conns["B"].cast<pybind11::list>()) b.push_back(_bit_to_int(bit));
             for (auto bit : conns["Y"].cast<pybind11::list>()) y.push_back(_bit_to_int(bit));
-            _add_aby_cell(db, type, a, b, y, B, M);  // implement similarly to Python version
+            _add_aby_cell(db, type, a, b, y, B, M, M2);  // implement similarly to Python version
         }
         else if (type == "$dff") {
             // int clk_polarity = params.contains("CLK_POLARITY") ? pybind11::cast<int>(params["CLK_POLARITY"]) : 1;
@@ -301,7 +309,7 @@ std::tuple<int, int> build_from_json(
 
             if (d.size() != q.size()) throw std::runtime_error("D and Q bit widths mismatch");
 
-            _add_dff(db, d, q, B, M);  // implement similarly to Python version
+            _add_dff(db, d, q, B, M, M2);  // implement similarly to Python version
         }
         else if (type == "$mux") {
             std::vector<int> a, b, s, y;
@@ -313,13 +321,13 @@ std::tuple<int, int> build_from_json(
             if (s.size() != 1 || a.size() != b.size() || a.size() != y.size())
                 throw std::runtime_error("Invalid mux connection widths");
 
-            _add_absy_cell(db, type, a, b, s, y, B, M);  // implement similarly to Python version
+            _add_absy_cell(db, type, a, b, s, y, B, M, M2);  // implement similarly to Python version
         }
         else if (type == "$not" || type == "$logic_not") {
             std::vector<int> a, y;
             for (auto bit : conns["A"].cast<pybind11::list>()) a.push_back(_bit_to_int(bit));
             for (auto bit : conns["Y"].cast<pybind11::list>()) y.push_back(_bit_to_int(bit));
-            _add_ay_cell(db, type, a, y, B, M);  // implement similarly to Python version
+            _add_ay_cell(db, type, a, y, B, M, M2);  // implement similarly to Python version
         }
         else if (type == "$eq" || type == "$ge" || type == "$le" || type == "$gt" || type == "$lt" ||
                  type == "$logic_and" || type == "$logic_or") {
@@ -328,7 +336,7 @@ std::tuple<int, int> build_from_json(
             for (auto bit : conns["B"].cast<pybind11::list>()) b.push_back(_bit_to_int(bit));
             for (auto bit : conns["Y"].cast<pybind11::list>()) y.push_back(_bit_to_int(bit));
 
-            _add_aby_cell(db, type, a, b, y, B, M);
+            _add_aby_cell(db, type, a, b, y, B, M, M2);
         }
         // else {
         //     auto attrs = cell["attributes"].cast<pybind11::dict>();
@@ -0,0 +1,305 @@
+"""
+Cost-based extraction: choose one e-node per e-class (wirevec) needed by the outputs, minimizing a pluggable cost,
+and emit the chosen netlist as a new NetlistDB or as Yosys JSON.
+
+The e-graph is loaded into flat arrays (one row per e-node) and the class costs are computed by batched passes
+over them: a worklist pass in which each e-node fires once all its inputs have a cost (linear in the number of
+e-nodes), then a few relaxation passes until the fixpoint. Registers cut the cost graph: the cost of a dff never
+depends on its own output and its d input is extracted as a root of its own, so cycles through dffs need no special
+handling (for area, a dff is also charged the logic of its input as costed with the registers cut). Requires NumPy.
+
+The choice is greedy: the cost of an e-class is that of a tree, so with combine="sum" a subterm shared by several
+users is counted once per use, and the netlist chosen can cost more than the one the e-graph was built from (the
+total reported, like the AREA of the netlist, counts every chosen e-node once). As a floor, extract() runs the same
+choice over the cells as built (the origin tables, see NetlistDB.snapshot_origin()) and keeps it when it is cheaper,
+so extraction never returns a worse netlist than its input. It is not an optimal DAG extraction.
+"""
+import pathlib
+from dataclasses import dataclass, field
+from typing import TextIO
+from .db import NetlistDB
+from . import yosys
+
+try:
+    import numpy as np
+except ImportError:     # optional: only extract() needs it
+    np = None
+
+
+@dataclass
+class CostModel:
+    """
+    Cost of an e-node: weights[type] (default for the other types) times the width of its output.
+    With combine="sum" the cost of an e-class adds up the costs of its inputs (area), with "max" it takes the
+    largest (delay). Override cost() for other shapes, e.g. quadratic multipliers.
+    """
+    weights: dict[str, float] = field(default_factory=dict)
+    default: float = 1.0
+    combine: str = "sum"
+
+    def cost(self, type_: str, width: int) -> float:
+        return self.weights.get(type_, self.default) * max(width, 1)
+
+
+AREA = CostModel({"$addu": 1.0, "$adds": 1.0, "$mulu": 8.0, "$muls": 8.0, "$mux": 1.0, "$dff": 2.0}, combine="sum")
+DELAY = CostModel({"$addu": 1.0, "$adds": 1.0, "$mulu": 4.0, "$muls": 4.0, "$mux": 0.1, "$dff": 0.0}, combine="max")
+
+
+class Extraction:
+    """
+    The result of extract(): the chosen e-nodes (rowids per cell table) and e-classes (wirevec ids).
+    """
+    cost: float         # total cost: sum of the chosen e-nodes, or the largest root cost for combine="max"
+    _db: NetlistDB
+    _ids: "np.ndarray"          # all wirevec ids, sorted
+    _class_cost: "np.ndarray"   # cost per wirevec, aligned with _ids
+    _classes: "np.ndarray"      # ids of the extracted wirevecs
+    _nodes: dict[str, "np.ndarray"]
+
+    def __init__(self, db: NetlistDB, ids, class_cost, classes, nodes: dict[str, "np.ndarray"], cost: float):
+        self._db = db
+        self._ids = ids
+        self._class_cost = class_cost
+        self._classes = classes
+        self._nodes = nodes
+        self.cost = cost
+
+    def __len__(self) -> int:
+        return sum(len(rowids) for rowids in self._nodes.values())
+
+    def class_cost(self, id: int) -> float:
+        """
+        Return the best cost of wirevec id.
+        """
+        return float(self._class_cost[np.searchsorted(self._ids, id)])
+
+    def to_db(self, schema_file: str | None = None, db_file: str = ":memory:", packed: bool | None = None) -> NetlistDB:
+        """
+        Copy the extracted netlist into a new NetlistDB (same wirevec ids and wires, layout of the source unless
+        packed is given), streaming the rows from the source database.
+        """
+        src = self._db
+        if schema_file is None:
+            schema_file = str(pathlib.Path(__file__).with_name("schema.sql"))
+        dst = NetlistDB(schema_file, db_file, cnt=src._cnt, packed=src.packed if packed is None else packed)
+        dst._clk, dst._rhash = src._clk, src._rhash
+
+        src.execute("DELETE FROM temp.extract_classes")
+        src.executemany("INSERT INTO temp.extract_classes (id) VALUES (?)", ((id,) for id in self._classes.tolist()))
+        src.execute("DELETE FROM temp.extract_nodes")
+        for table, rowids in self._nodes.items():
+            src.executemany("INSERT INTO temp.extract_nodes (tbl, node) VALUES (?, ?)", ((table, r) for r in rowids.tolist()))
+
+        cur = src.execute(f"""
+            SELECT w.id, w.hash, w.width, {src._members_sql('w.id')} FROM wirevecs AS w
+            WHERE w.id IN (SELECT id FROM temp.extract_classes)
+        """)
+        while rows := cur.fetchmany(10000):
+            wvs = [(id, h, width, src._decode_members(members)) for id, h, width, members in rows]
+            dst.executemany(
+                "INSERT INTO wirevecs (id, hash, width, members) VALUES (?, ?, ?, ?)",
+                ((id, h, width, dst.pack_wirevec(wv) if dst.packed else None) for id, h, width, wv in wvs)
+            )
+            if dst.packed:
+                dst.executemany("INSERT INTO wire_refs (wire, wirevec) VALUES (?, ?)", ((w, id) for id, _, _, wv in wvs for w in set(wv)))
+            else:
+                dst.executemany("INSERT INTO wirevec_members (wirevec, idx, wire) VALUES (?, ?, ?)", ((id, i, w) for id, _, _, wv in wvs for i, w in enumerate(wv)))
+        for table, (keys, refs) in src._CELL_TABLES.items():
+            cols = ", ".join(keys + refs)
+            cur = src.execute(f"SELECT {cols} FROM {table} WHERE rowid IN (SELECT node FROM temp.extract_nodes WHERE tbl = ?)", (table,))
+            dst.executemany(f"INSERT INTO {table} ({cols}) VALUES ({', '.join('?' * (len(keys) + len(refs)))})", cur)
+        for table in ("from_inputs", "as_outputs", "instances", "instance_ports"):
+            cur = src.execute(f"SELECT * FROM {table}")
+            cols = [col[0] for col in cur.description]
+            dst.executemany(f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})", cur)
+        dst.execute("DELETE FROM dirty_aby_cells")   # a fresh netlist, nothing to rebuild
+        dst.execute("DELETE FROM dirty_wirevecs")
+        dst.snapshot_origin()
+        dst._save_meta()
+        dst.commit()
+        return dst
+
+    def write_json(self, f: TextIO, module: str = "top"):
+        """
+        Write the extracted netlist to f as a Yosys JSON netlist.
+        """
+        yosys.write_module(self.to_db(), f, module)
+
+
+def _fetch(cur, ncols: int) -> "np.ndarray":
+    return np.fromiter((x for row in cur for x in row), dtype=np.float64).reshape(-1, ncols)
+
+
+def _segments(ptr: "np.ndarray", keys: "np.ndarray") -> tuple["np.ndarray", "np.ndarray"]:
+    """
+    Gather the CSR segments ptr[k]:ptr[k + 1] of keys: return (positions, index into keys of each position).
+    """
+    starts, lens = ptr[keys], ptr[keys + 1] - ptr[keys]
+    owner = np.repeat(np.arange(len(keys)), lens)
+    return np.arange(len(owner)) - np.repeat(np.cumsum(lens) - lens, lens) + starts[owner], owner
+
+
+def _aggregate(combine: str, owner: "np.ndarray", values: "np.ndarray", n: int) -> "np.ndarray":
+    if combine == "sum":
+        return np.bincount(owner, weights=values, minlength=n)
+    agg = np.zeros(n)
+    np.maximum.at(agg, owner, values)
+    return agg
+
+
+def _solve(n_classes: int, out, node_cost, edge_node, edge_child, combine: str) -> tuple["np.ndarray", "np.ndarray"]:
+    """
+    Return (class cost, node cost including its inputs), where the cost of a class is the minimum over its nodes.
+    Classes without nodes (inputs, constants, blackbox outputs) cost 0, those without an acyclic derivation inf.
+    """
+    n_nodes = len(out)
+    by_node = np.argsort(edge_node, kind="stable")
+    node_ptr = np.searchsorted(edge_node[by_node], np.arange(n_nodes + 1))
+    by_child = np.argsort(edge_child, kind="stable")
+    child_ptr = np.searchsorted(edge_child[by_child], np.arange(n_classes + 1))
+
+    cost = np.full(n_classes, np.inf)
+    known = np.ones(n_classes, dtype=bool)
+    known[out] = False
+    cost[known] = 0.0
+    pending = np.diff(node_ptr)
+
+    # worklist pass: a node fires once all its inputs have a cost, each node and edge is visited once
+    newly = np.flatnonzero(known)
+    frontier = np.flatnonzero(pending == 0)
+    while len(newly) or len(frontier):
+        if len(newly):
+            pos, _ = _segments(child_ptr, newly)
+            parents, counts = np.unique(edge_node[by_child[pos]], return_counts=True)
+            pending[parents] -= counts
+            frontier = np.concatenate((frontier, parents[pending[parents] == 0]))
+            newly = newly[:0]
+        if len(frontier):
+            pos, owner = _segments(node_ptr, frontier)
+            cand = node_cost[frontier] + _aggregate(combine, owner, cost[edge_child[by_node[pos]]], len(frontier))
+            np.minimum.at(cost, out[frontier], cand)
+            classes = np.unique(out[frontier])
+            newly = classes[~known[classes]]
+            known[newly] = True
+            frontier = frontier[:0]
+
+    # relaxation passes: a class may have got its cost before its cheapest node fired
+    by_out = np.argsort(out, kind="stable")
+    starts = np.flatnonzero(np.r_[True, out[by_out][1:] != out[by_out][:-1]]) if n_nodes else np.zeros(0, dtype=np.int64)
+    while True:
+        cand = node_cost + _aggregate(combine, edge_node, cost[edge_child], n_nodes)
+        relaxed = cost.copy()
+        if n_nodes:
+            relaxed[out[by_out][starts]] = np.minimum(cost[out[by_out][starts]], np.minimum.reduceat(cand[by_out], starts))
+        if np.array_equal(relaxed, cost):
+            return cost, cand
+        cost = relaxed
+
+
+def extract(db: NetlistDB, model: CostModel | None = None) -> Extraction:
+    """
+    Choose the cheapest e-node of every e-class needed by the outputs, the instance ports and the dffs chosen,
+    or the cells as built when they make a cheaper netlist (see the module docstring).
+    """
+    if np is None:
+        raise RuntimeError("extract() requires NumPy")
+    model = AREA if model is None else model
+
+    # cost of every (type, width) pair in use
+    outputs = {table: (("c.type" if keys else "'$dff'"), refs[-1]) for table, (keys, refs) in db._CELL_TABLES.items()}
+    pairs = set()
+    for table, (type_, y) in outputs.items():
+        pairs |= set(db.execute(f"SELECT DISTINCT {type_}, w.width FROM {table} AS c JOIN wirevecs AS w ON w.id = c.{y}"))
+    db.execute("DELETE FROM temp.extract_costs")
+    db.executemany("INSERT INTO temp.extract_costs (type, width, cost) VALUES (?, ?, ?)", ((t, w, model.cost(t, w)) for t, w in pairs))
+
+    ids = np.fromiter((id for (id,) in db.execute("SELECT id FROM wirevecs ORDER BY id")), dtype=np.int64)
+    tables, rowids, node_cost, origin, out = [], [], [], [], []
+    edge_node, edge_child, dep_node, dep_child = [], [], [], []
+    n_nodes = 0
+    for table, (type_, y) in outputs.items():
+        refs = db._CELL_TABLES[table][1]
+        cols = db._CELL_TABLES[table][0] + refs
+        rows = _fetch(db.execute(f"""
+            SELECT c.rowid, k.cost, EXISTS (
+                SELECT 1 FROM origin_{table} AS o WHERE {' AND '.join(f'o.{col} = c.{col}' for col in cols)}
+            ), {', '.join(f'c.{ref}' for ref in refs)}
+            FROM {table} AS c JOIN wirevecs AS w ON w.id = c.{y} JOIN temp.extract_costs AS k ON k.type = {type_} AND k.width = w.width
+        """), 3 + len(refs))
+        classes = np.searchsorted(ids, rows[:, 3:].astype(np.int64))
+        nodes = np.arange(n_nodes, n_nodes + len(rows))
+        tables.append(np.full(len(rows), len(rowids)))
+        rowids.append(rows[:, 0].astype(np.int64))
+        node_cost.append(rows[:, 1])
+        origin.append(rows[:, 2] > 0)
+        out.append(classes[:, -1])
+        for k in range(len(refs) - 1):
+            dep_node.append(nodes)
+            dep_child.append(classes[:, k])
+            if table != "dffs":     # registers cut the cost graph
+                edge_node.append(nodes)
+                edge_child.append(classes[:, k])
+        n_nodes += len(rows)
+    table_names = list(outputs)
+    tables, rowids, node_cost, origin, out = (np.concatenate(xs) for xs in (tables, rowids, node_cost, origin, out))
+    edge_node, edge_child, dep_node, dep_child = (
+        np.concatenate(xs) if xs else np.zeros(0, dtype=np.int64) for xs in (edge_node, edge_child, dep_node, dep_child)
+    )
+    own_cost = np.maximum(node_cost, 1e-9)   # strictly positive costs keep the choice acyclic
+    dffs = tables == table_names.index("dffs")
+    d = np.full(n_nodes, -1)
+    d[dep_node[dffs[dep_node]]] = dep_child[dffs[dep_node]]
+    by_dep = np.argsort(dep_node, kind="stable")
+    dep_ptr = np.searchsorted(dep_node[by_dep], np.arange(n_nodes + 1))
+    roots = np.unique(np.searchsorted(ids, np.array([
+        id for (id,) in db.execute("SELECT sink FROM as_outputs UNION SELECT signal FROM instance_ports UNION SELECT source FROM from_inputs")
+    ], dtype=np.int64)))
+
+    def choose(node_cost: "np.ndarray") -> tuple["np.ndarray", "np.ndarray", "np.ndarray", float]:
+        """
+        Return (class cost, selected classes, chosen nodes, total) of the greedy choice under node_cost.
+        """
+        cost, cand = _solve(len(ids), out, node_cost, edge_node, edge_child, model.combine)
+        if model.combine == "sum":
+            # a dff also pays for the logic of its input, as costed with the registers cut
+            cost, cand = _solve(len(ids), out, node_cost + np.where(dffs, cost[d], 0.0), edge_node, edge_child, model.combine)
+
+        # best node of each class: the first of its nodes by (class, cost)
+        order = np.lexsort((cand, out))
+        first = order[np.r_[True, out[order][1:] != out[order][:-1]]] if n_nodes else order
+        choice = np.full(len(ids), -1)
+        choice[out[first]] = first
+
+        # walk the chosen nodes from the roots
+        selected = np.zeros(len(ids), dtype=bool)
+        frontier = roots
+        while len(frontier):
+            frontier = frontier[~selected[frontier]]
+            selected[frontier] = True
+            if np.isinf(cost[frontier]).any():
+                raise ValueError(f"Wirevec {ids[frontier[np.isinf(cost[frontier])][0]]} has no acyclic derivation")
+            nodes = choice[frontier]
+            nodes = nodes[nodes >= 0]
+            pos, _ = _segments(dep_ptr, nodes)
+            frontier = np.unique(dep_child[by_dep[pos]])
+
+        chosen = choice[selected]
+        chosen = chosen[chosen >= 0]
+        if model.combine == "sum":
+            total = float(own_cost[chosen].sum())   # each chosen node once, however many times it is used
+        else:
+            total = float(cost[selected].max()) if selected.any() else 0.0
+        return cost, selected, chosen, total
+
+    best = choose(own_cost)
+    if origin.any():
+        # the cells as built (only), kept when the greedy choice over the whole e-graph is worse
+        try:
+            fallback = choose(np.where(origin, own_cost, np.inf))
+        except ValueError:      # some class needed has no original derivation left
+            fallback = None
+        if fallback is not None and fallback[3] < best[3]:
+            best = fallback
+    cost, selected, chosen, total = best
+    nodes = {name: np.sort(rowids[chosen[tables[chosen] == i]]) for i, name in enumerate(table_names)}
+    return Extraction(db, ids, cost, ids[selected], nodes, total)
@@ -1,3 +1,4 @@
+# legacy hand-written rules, kept as the baseline of emap.bench: use the patterns below with rewrite(..., in_db=True)
 from .basic import (
     ematch_comm, apply_comm,
     ematch_assoc_to_right, apply_assoc_to_right,
@@ -6,4 +7,8 @@ from .basic import (
 
 from .retiming import (
     ematch_dff_forward_aby_cell, apply_dff_forward_aby_cell
-)
\ No newline at end of file
+)
+from .pattern import (
+    Pattern, rewrite,
+    COMM, ASSOC_TO_RIGHT, ASSOC_TO_LEFT, DFF_FORWARD_ABY_CELL
+)
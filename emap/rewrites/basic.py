@@ -1,22 +1,35 @@
+"""
+Legacy hand-written rules: matches come back to Python and are applied row by row. Superseded by the pattern
+versions (COMM, ASSOC_TO_RIGHT, ASSOC_TO_LEFT with rewrite(..., in_db=True)), which apply inside SQLite and are the
+ones eval.py and design.default_rules() run. Kept as the baseline of emap.bench.
+They have no ledger of applied matches (see Pattern.apply()): a match found again is applied again, which inserts
+nothing new but repeats its lookups.
+"""
 from typing import Iterable
 from ..db import NetlistDB
 
 
-def ematch_comm(db: NetlistDB, target_types: list[str]) -> Iterable[tuple[str, int, int, int]]:
+def ematch_comm(db: NetlistDB, target_types: list[str], since: int | None = None) -> Iterable[tuple[str, int, int, int]]:
     """
     Return a list of tuples (type, a, b, y) for commutative cells.
+    If since is given, only cells newer than epoch since are matched (see NetlistDB.new_epoch()).
     """
-    cur = db.execute(
-        "SELECT type, a, b, y FROM aby_cells WHERE type IN ({})".format(",".join("?" * len(target_types))),
-        target_types
-    )
+    if since is None:
+        cur = db.execute(
+            "SELECT type, a, b, y FROM aby_cells WHERE type IN ({})".format(",".join("?" * len(target_types))),
+            target_types
+        )
+    else:
+        cur = db.execute(
+            "SELECT type, a, b, y FROM aby_cells WHERE epoch > ? AND type IN ({})".format(",".join("?" * len(target_types))),
+            [since, *target_types]
+        )
     return cur
 
 def apply_comm(db: NetlistDB, matches: Iterable[tuple[str, int, int, int]]) -> int:
     """
     Return the number of rows rewritten by applying commutative matches.
     """
-    matches = list(matches) # for debug
     cur = db.executemany(
         "INSERT OR IGNORE INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)",
         ((type_, b, a, y) for type_, a, b, y in matches)
@@ -25,20 +38,44 @@ def apply_comm(db: NetlistDB, matches: Iterable[tuple[str, int, int, int]]) -> i
     return cur.rowcount
 
 
-def ematch_assoc_to_right(db: NetlistDB, target_types: list[str]) -> Iterable[tuple[str, int, int, int]]:
+def _ematch_chain(db: NetlistDB, target_types: list[str], since: int | None) -> Iterable[tuple[str, int, int, int, int]]:
+    """
+    Return a list of tuples (type, a, b, c, y) for chains (a op b) op c = y.
+    If since is given, only chains with at least one cell newer than epoch since are matched:
+    new cell1 with any cell2, plus old cell1 with new cell2.
+    """
+    types = ",".join("?" * len(target_types))
+    select = "SELECT cell1.type, cell1.a, cell1.b, cell2.b, cell2.y"
+    if since is None:
+        return db.execute(f"""
+            {select}
+            FROM aby_cells AS cell1 JOIN aby_cells AS cell2 ON cell1.y = cell2.a
+            WHERE cell1.type = cell2.type AND cell1.type IN ({types})
+            """,
+            target_types
+        )
+    # CROSS JOIN makes the delta side the outer loop, the unary + keeps the epoch index off the inner side
+    return db.execute(f"""
+        {select}
+        FROM aby_cells AS cell1 CROSS JOIN aby_cells AS cell2 ON cell1.y = cell2.a
+        WHERE cell1.type = cell2.type AND cell1.type IN ({types}) AND cell1.epoch > ?
+        UNION ALL
+        {select}
+        FROM aby_cells AS cell2 CROSS JOIN aby_cells AS cell1 ON cell1.y = cell2.a
+        WHERE cell1.type = cell2.type AND cell2.type IN ({types}) AND cell2.epoch > ? AND +cell1.epoch <= ?
+        """,
+        [*target_types, since, *target_types, since, since]
+    )
+
+
+def ematch_assoc_to_right(db: NetlistDB, target_types: list[str], since: int | None = None) -> Iterable[tuple[str, int, int, int]]:
     """
     Return a list of tuples (type, a, b, y) for associative cells that can be rewritten to right associative form.
     E.g. (a + b) + c => a + (b + c)
     NOTE: The width of b + c should be the same as (a + b) + c to preserve the semantics.
+    If since is given, only matches involving cells newer than epoch since are returned.
     """
-    cur = db.execute("""
-        SELECT cell1.type, cell1.a, cell1.b, cell2.b, cell2.y
-        FROM aby_cells AS cell1 JOIN aby_cells AS cell2 ON cell1.y = cell2.a
-        WHERE cell1.type = cell2.type AND cell1.type IN ({})
-        """.format(",".join("?" * len(target_types))),
-        target_types
-    )
-    return cur
+    return _ematch_chain(db, target_types, since)
 
 def apply_assoc_to_right(db: NetlistDB, matches: Iterable[tuple[str, int, int, int]]) -> int:
     """
@@ -47,38 +84,25 @@ def apply_assoc_to_right(db: NetlistDB, matches: Iterable[tuple[str, int, int, i
     """
     newrows = []
     for type_, a, b, c, y in matches:
-        cur = db.execute("SELECT MAX(idx) FROM wirevec_members WHERE wirevec = ?", (y,))
-        width_b_add_c = cur.fetchone()[0] + 1
-        cur.execute(
-            "SELECT y FROM aby_cells WHERE type = ? AND a = ? AND b = ? AND (SELECT MAX(idx) + 1 FROM wirevec_members WHERE wirevec = y) = ? LIMIT 1",
-            (type_, b, c, width_b_add_c)
-        )
-        row = cur.fetchone()
-        if row is None:
+        width_b_add_c = db._get_width(y)
+        b_add_c = db._lookup_aby_cell(type_, b, c, width_b_add_c)
+        if b_add_c is None:
             b_add_c = db._add_wirevec([db.auto_id for _ in range(width_b_add_c)])
-            cur.execute("INSERT INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", (type_, b, c, b_add_c))
-        else:
-            b_add_c = row[0]
+            db.execute("INSERT INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", (type_, b, c, b_add_c))
         newrows.append((type_, a, b_add_c, y))
     cur = db.executemany("INSERT OR IGNORE INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", newrows)
     db.commit()
     return cur.rowcount
 
 
-def ematch_assoc_to_left(db: NetlistDB, target_types: list[str]) -> Iterable[tuple[str, int, int, int]]:
+def ematch_assoc_to_left(db: NetlistDB, target_types: list[str], since: int | None = None) -> Iterable[tuple[str, int, int, int]]:
     """
     Return a list of tuples (type, a, b, y) for associative cells that can be rewritten to left associative form.
     E.g. a + (b + c) => (a + b) + c
     NOTE: The width of a + b should be the same as a + (b + c) to preserve the semantics.
+    If since is given, only matches involving cells newer than epoch since are returned.
     """
-    cur = db.execute("""
-        SELECT cell1.type, cell1.a, cell1.b, cell2.b, cell2.y
-        FROM aby_cells AS cell1 JOIN aby_cells AS cell2 ON cell1.y = cell2.a
-        WHERE cell1.type = cell2.type AND cell1.type IN ({})
-        """.format(",".join("?" * len(target_types))),
-        target_types
-    )
-    return cur
+    return _ematch_chain(db, target_types, since)
 
 def apply_assoc_to_left(db: NetlistDB, matches: Iterable[tuple[str, int, int, int]]) -> int:
     """
@@ -87,18 +111,11 @@ def apply_assoc_to_left(db: NetlistDB, matches: Iterable[tuple[str, int, int, in
     """
     newrows = []
     for type_, a, b, c, y in matches:
-        cur = db.execute("SELECT MAX(idx) FROM wirevec_members WHERE wirevec = ?", (y,))
-        width_a_add_b = cur.fetchone()[0] + 1
-        cur.execute(
-            "SELECT y FROM aby_cells WHERE type = ? AND a = ? AND b = ? AND (SELECT MAX(idx) + 1 FROM wirevec_members WHERE wirevec = y) = ? LIMIT 1",
-            (type_, a, b, width_a_add_b)
-        )
-        row = cur.fetchone()
-        if row is None:
+        width_a_add_b = db._get_width(y)
+        a_add_b = db._lookup_aby_cell(type_, a, b, width_a_add_b)
+        if a_add_b is None:
             a_add_b = db._add_wirevec([db.auto_id for _ in range(width_a_add_b)])
-            cur.execute("INSERT INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", (type_, a, b, a_add_b))
-        else:
-            a_add_b = row[0]
+            db.execute("INSERT INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", (type_, a, b, a_add_b))
         newrows.append((type_, a_add_b, c, y))
     cur = db.executemany("INSERT OR IGNORE INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", newrows)
     db.commit()
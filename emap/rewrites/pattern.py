@@ -0,0 +1,423 @@
+"""
+A small pattern language for rewrite rules over the cell tables, e.g.
+
+    (?op (?op ?a ?b) ?c) => (?op ?a (?op ?b ?c))
+
+A term (op x y ...) is a cell: one argument is an ay cell, two an aby cell, three an absy cell (a, b, s),
+and (dff x) is a dff. op is a cell type ($addu, or addu for short) or a type variable ?op ranging over the target types.
+The types stored with a signedness suffix may be written without it: add matches both $addu and $adds, and an add
+of the rhs takes the signedness matched by the lhs (all the unsuffixed adds of a rule share one signedness).
+?x in argument position is an e-class (wirevec). The lhs is compiled into one multi-way join (plus its semi-naive
+variant), the rhs into a few set-oriented INSERT ... SELECT statements. Every rhs term but the root is looked up
+among the existing cells (of the width of the lhs root) and created with fresh wires if missing; the rhs root gets
+the lhs root as its output.
+"""
+import hashlib
+import re
+from dataclasses import dataclass
+from typing import Iterable
+from ..db import NetlistDB
+from ..runner import Rule
+
+
+COMM = "(?op ?a ?b) => (?op ?b ?a)"
+ASSOC_TO_RIGHT = "(?op (?op ?a ?b) ?c) => (?op ?a (?op ?b ?c))"
+ASSOC_TO_LEFT = "(?op ?a (?op ?b ?c)) => (?op (?op ?a ?b) ?c)"
+DFF_FORWARD_ABY_CELL = "(?op (dff ?a) (dff ?b)) => (dff (?op ?a ?b))"
+
+# the cell types stored as <type>u / <type>s (see NetlistDB._cell_record())
+_SIGNED_TYPES = frozenset({"$and", "$or", "$xor", "$add", "$sub", "$mul", "$mod"})
+
+
+@dataclass(frozen=True)
+class Var:
+    name: str
+
+
+@dataclass(frozen=True)
+class Term:
+    op: str | Var
+    args: tuple["Term | Var", ...]
+
+    @property
+    def table(self) -> str:
+        if self.op == "$dff":
+            return "dffs"
+        return {1: "ay_cells", 2: "aby_cells", 3: "absy_cells"}[len(self.args)]
+
+    @property
+    def inputs(self) -> tuple[str, ...]:
+        return NetlistDB._CELL_TABLES[self.table][1][:-1]
+
+    @property
+    def output(self) -> str:
+        return NetlistDB._CELL_TABLES[self.table][1][-1]
+
+    @property
+    def typed(self) -> bool:
+        return self.table != "dffs"
+
+
+_TOKEN = re.compile(r"\(|\)|[^\s()]+")
+
+
+def parse(src: str) -> Term | Var:
+    """
+    Parse one s-expression of the pattern language.
+    """
+    tokens = _TOKEN.findall(src)
+    pos = 0
+
+    def expr() -> Term | Var:
+        nonlocal pos
+        if pos >= len(tokens):
+            raise ValueError(f"Unexpected end of pattern: {src!r}")
+        tok = tokens[pos]
+        pos += 1
+        if tok == ")":
+            raise ValueError(f"Unexpected ')' in pattern: {src!r}")
+        if tok != "(":
+            if not tok.startswith("?"):
+                raise ValueError(f"Bare symbol {tok!r} in pattern {src!r}, e-classes are written ?{tok}")
+            return Var(tok[1:])
+        if pos >= len(tokens) or tokens[pos] in "()":
+            raise ValueError(f"Missing operator in pattern: {src!r}")
+        op_tok = tokens[pos]
+        pos += 1
+        op = Var(op_tok[1:]) if op_tok.startswith("?") else op_tok if op_tok.startswith("$") else "$" + op_tok
+        args = []
+        while pos < len(tokens) and tokens[pos] != ")":
+            args.append(expr())
+        if pos >= len(tokens):
+            raise ValueError(f"Missing ')' in pattern: {src!r}")
+        pos += 1
+        term = Term(op, tuple(args))
+        if (op == "$dff" and len(args) != 1) or not 1 <= len(args) <= 3:
+            raise ValueError(f"Unsupported arity {len(args)} for {op_tok} in pattern: {src!r}")
+        return term
+
+    result = expr()
+    if pos != len(tokens):
+        raise ValueError(f"Trailing tokens in pattern: {src!r}")
+    return result
+
+
+class Pattern:
+    """
+    A rewrite rule lhs => rhs compiled into SQL once, e.g. Pattern("comm", "(?op ?a ?b) => (?op ?b ?a)").
+    ematch() and apply() have the signatures of the hand-written rules, so rule() plugs it into a Runner.
+    A match is (root, *vars): the e-class of the lhs root, then the variables in order of first occurrence.
+    """
+    name: str
+    lhs: Term
+    rhs: Term
+    vars: list[str]
+    _variants: dict[str, tuple[str, ...]]       # type variable standing for an unsuffixed type -> its stored types
+    _nodes: list[Term]                          # lhs terms in preorder, aliased n0, n1, ...
+    _edges: list[tuple[int, int, str]]          # (parent, child, parent input column)
+    _bindings: dict[str, str]                   # variable -> SQL expression of its first occurrence
+    _type_vars: set[str]
+    _conds: list[str]                           # join and equality conditions of the lhs
+    _lhs_params: dict[str, str]                 # cell type literals of the lhs
+    _match_sql: dict[tuple[bool, int], str]     # (semi-naive, number of target types) -> match query
+    _table: str                                 # temp table holding the matches being applied
+    _ledger: str                                # temp table of the matches already applied, kept canonical by rebuild
+    _applied_sql: str                           # SQL condition: match m is in the ledger
+    _apply_sql: list[tuple[str, str]]           # ("sql" | "root", statement) or ("fresh", table)
+    _params: dict[str, str]                     # cell type literals of the rhs
+
+    def __init__(self, name: str, src: str):
+        if src.count("=>") != 1:
+            raise ValueError(f"Expected 'lhs => rhs' in rule {name}: {src!r}")
+        lhs, rhs = (parse(side) for side in src.split("=>"))
+        if not isinstance(lhs, Term) or not isinstance(rhs, Term):
+            raise ValueError(f"Both sides of rule {name} must be cells: {src!r}")
+        self.name = name
+        self._variants = {}
+        self.lhs = self._expand_signedness(lhs, True)
+        self.rhs = self._expand_signedness(rhs, False)
+        self._match_sql = {}
+        self._compile_lhs()
+        self._compile_rhs()
+
+    def _expand_signedness(self, term: Term, lhs: bool) -> Term:
+        """
+        Replace the unsuffixed types of term (e.g. $add) by a type variable (?_add) ranging over the stored ones.
+        """
+        op = term.op
+        if isinstance(op, str) and op in _SIGNED_TYPES:
+            var = Var("_" + op[1:])
+            if lhs:
+                self._variants[var.name] = (op + "u", op + "s")
+            elif var.name not in self._variants:
+                raise ValueError(f"The signedness of {op} in rule {self.name} is not bound by the lhs, write {op}u or {op}s")
+            op = var
+        args = tuple(arg if isinstance(arg, Var) else self._expand_signedness(arg, lhs) for arg in term.args)
+        return Term(op, args)
+
+    def _compile_lhs(self):
+        self._nodes, self._edges = [], []
+        self._bindings, self._type_vars = {}, set()
+        self._conds, self._lhs_params = [], {}
+        self.vars = []
+
+        def bind(name: str, expr: str):
+            if name in self._bindings:
+                self._conds.append(f"{expr} = {self._bindings[name]}")
+            else:
+                self._bindings[name] = expr
+                self.vars.append(name)
+
+        def visit(term: Term) -> int:
+            i = len(self._nodes)
+            self._nodes.append(term)
+            if isinstance(term.op, Var):
+                self._type_vars.add(term.op.name)
+                bind(term.op.name, f"n{i}.type")
+                if term.op.name in self._variants:
+                    keys = [f"lit{len(self._lhs_params) + k}" for k in range(len(self._variants[term.op.name]))]
+                    self._lhs_params.update(zip(keys, self._variants[term.op.name]))
+                    self._conds.append(f"n{i}.type IN ({', '.join(':' + key for key in keys)})")
+            elif term.typed:
+                key = f"lit{len(self._lhs_params)}"
+                self._lhs_params[key] = term.op
+                self._conds.append(f"n{i}.type = :{key}")
+            for col, arg in zip(term.inputs, term.args):
+                if isinstance(arg, Var):
+                    bind(arg.name, f"n{i}.{col}")
+                else:
+                    j = visit(arg)
+                    self._edges.append((i, j, col))
+                    self._conds.append(f"n{j}.{arg.output} = n{i}.{col}")
+            return i
+
+        visit(self.lhs)
+
+    def _compile_rhs(self):
+        unbound = [name for name in self._rhs_vars(self.rhs) if name not in self._bindings]
+        if unbound:
+            raise ValueError(f"Variables {unbound} of rule {self.name} are not bound by the lhs")
+        # named after the rule and keyed by its shape: rules sharing a name on one connection get tables of their own
+        shape = hashlib.sha1(repr((self.lhs, self.rhs)).encode()).hexdigest()[:8]
+        self._table = "temp.rw_" + re.sub(r"\W", "_", self.name) + "_" + shape
+        self._params = {}
+        self._apply_sql = []
+        interior: list[Term] = []
+
+        def arg_sql(arg: Term | Var) -> str:
+            return f"m.v_{arg.name}" if isinstance(arg, Var) else f"m.t{interior.index(arg)}"
+
+        def type_sql(term: Term) -> str:
+            if isinstance(term.op, Var):
+                return f"m.v_{term.op.name}"
+            key = f"type{len(self._params)}"
+            self._params[key] = term.op
+            return f":{key}"
+
+        def visit(term: Term, root: bool):
+            for arg in term.args:
+                if isinstance(arg, Term) and arg not in interior:
+                    visit(arg, False)
+            args = [arg_sql(arg) for arg in term.args]
+            cols = (("type",) if term.typed else ()) + term.inputs
+            vals = ([type_sql(term)] if term.typed else []) + args
+            if root:
+                self._apply_sql.append(("root", f"""
+                    INSERT OR IGNORE INTO {term.table} ({", ".join(cols)}, {term.output})
+                    SELECT {", ".join(vals)}, m.root FROM {self._table} AS m
+                """))
+                return
+            k = len(interior)
+            interior.append(term)
+            match = " AND ".join(f"cell.{col} = {val}" for col, val in zip(cols, vals))
+            # an existing cell of the right width
+            self._apply_sql.append(("sql", f"""
+                UPDATE {self._table} AS m SET t{k} = (
+                    SELECT cell.{term.output} FROM {term.table} AS cell JOIN wirevecs AS w ON w.id = cell.{term.output}
+                    WHERE {match} AND w.width = m.width LIMIT 1
+                )
+            """))
+            # otherwise one fresh cell per distinct (type, inputs, width)
+            fresh_cols = ["type", "c0", "c1", "c2"][:len(vals)] if term.typed else ["c0", "c1", "c2"][:len(vals)]
+            self._apply_sql.append(("sql", "DELETE FROM temp.rw_fresh"))
+            self._apply_sql.append(("sql", f"""
+                INSERT INTO temp.rw_fresh ({", ".join(fresh_cols)}, width)
+                SELECT DISTINCT {", ".join(vals)}, m.width FROM {self._table} AS m WHERE m.t{k} IS NULL
+            """))
+            self._apply_sql.append(("fresh", "temp.rw_fresh"))
+            self._apply_sql.append(("sql", f"""
+                INSERT OR IGNORE INTO {term.table} ({", ".join(cols)}, {term.output})
+                SELECT {", ".join(fresh_cols)}, id FROM temp.rw_fresh
+            """))
+            self._apply_sql.append(("sql", f"""
+                UPDATE {self._table} AS m SET t{k} = f.id FROM temp.rw_fresh AS f
+                WHERE m.t{k} IS NULL AND {" AND ".join(f"f.{fc} = {val}" for fc, val in zip(fresh_cols, vals))}
+                    AND f.width = m.width
+            """))
+
+        visit(self.rhs, True)
+        columns = ["root INTEGER", *(f"v_{name}" for name in self.vars), "width INTEGER", *(f"t{k} INTEGER" for k in range(len(interior)))]
+        self._create_sql = f"CREATE TEMP TABLE IF NOT EXISTS {self._table.removeprefix('temp.')} ({', '.join(columns)})"
+        key = ["root", *(f"v_{name}" for name in self.vars)]
+        self._key = ", ".join(key)
+        self._insert_sql = f"INSERT INTO {self._table} ({self._key}) VALUES ({', '.join('?' * (len(self.vars) + 1))})"
+        self._ledger = self._table + "_done"
+        # a primary key lookup per match, rather than a pass over the whole ledger (EXCEPT, IN) per statement;
+        # the unary + drops the INTEGER affinity of m.root, which would keep the lookup off the ledger's key
+        self._applied_sql = f"EXISTS (SELECT 1 FROM {self._ledger} AS l WHERE {' AND '.join(f'l.{c} = +m.{c}' for c in key)})"
+        self._create_ledger_sql = (
+            f"CREATE TEMP TABLE IF NOT EXISTS {self._ledger.removeprefix('temp.')} "
+            f"({self._key}, PRIMARY KEY ({self._key})) WITHOUT ROWID"
+        )
+
+    def _rhs_vars(self, term: Term) -> Iterable[str]:
+        if isinstance(term.op, Var):
+            yield term.op.name
+        for arg in term.args:
+            if isinstance(arg, Var):
+                yield arg.name
+            else:
+                yield from self._rhs_vars(arg)
+
+    def _order(self, start: int) -> list[int]:
+        """
+        Return the lhs nodes in BFS order from start, so that every node joins on an already bound one.
+        """
+        adjacent: dict[int, list[int]] = {i: [] for i in range(len(self._nodes))}
+        for parent, child, _ in self._edges:
+            adjacent[parent].append(child)
+            adjacent[child].append(parent)
+        order, seen = [start], {start}
+        for i in order:
+            for j in adjacent[i]:
+                if j not in seen:
+                    seen.add(j)
+                    order.append(j)
+        return order
+
+    def _compile_match(self, semi_naive: bool, n_targets: int) -> str:
+        targets = ", ".join(f":target{i}" for i in range(n_targets))
+        # every node with a type variable is restricted to the target types (or to the variants of an unsuffixed type),
+        # so each can drive a delta scan
+        conds = self._conds + [
+            f"n{i}.type IN ({targets})" for i, term in enumerate(self._nodes)
+            if isinstance(term.op, Var) and term.op.name not in self._variants
+        ]
+        select = f"SELECT n0.{self.lhs.output}, {', '.join(self._bindings[name] for name in self.vars)}"
+        if not semi_naive:
+            tables = ", ".join(f"{term.table} AS n{i}" for i, term in enumerate(self._nodes))
+            return f"{select} FROM {tables} WHERE {' AND '.join(conds)}"
+        # one branch per delta node: it is newer than since, the nodes before it are not (so no match is found twice);
+        # CROSS JOIN makes the delta node the outer loop, the unary + keeps the epoch index off the inner side
+        branches = []
+        for i in range(len(self._nodes)):
+            tables = " CROSS JOIN ".join(f"{self._nodes[j].table} AS n{j}" for j in self._order(i))
+            epochs = [f"n{i}.epoch > :since"] + [f"+n{j}.epoch <= :since" for j in range(i)]
+            branches.append(f"{select} FROM {tables} WHERE {' AND '.join(conds + epochs)}")
+        return "\nUNION ALL\n".join(branches)
+
+    def _query(self, target_types: list[str], since: int | None) -> tuple[str, dict]:
+        key = (since is not None, len(target_types))
+        if key not in self._match_sql:
+            self._match_sql[key] = self._compile_match(*key)
+        params = {f"target{i}": t for i, t in enumerate(target_types)}
+        params.update(self._lhs_params, since=since)
+        return self._match_sql[key], params
+
+    def ematch(self, db: NetlistDB, target_types: list[str], since: int | None = None) -> Iterable[tuple]:
+        """
+        Return the matches (root, *vars) of the lhs. If since is given, only matches involving rows newer than
+        epoch since are returned (see NetlistDB.new_epoch()).
+        """
+        sql, params = self._query(target_types, since)
+        return db.execute(sql, params)
+
+    def _create_tables(self, db: NetlistDB):
+        db.execute(self._create_sql)
+        db.execute(self._create_ledger_sql)
+        db._register_ledger(
+            self._ledger,
+            tuple(f"v_{name}" for name in self.vars if name in self._type_vars),
+            ("root", *(f"v_{name}" for name in self.vars if name not in self._type_vars))
+        )
+        db.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS rw_fresh (
+                key INTEGER PRIMARY KEY, type VARCHAR(16), c0 INTEGER, c1 INTEGER, c2 INTEGER, width INTEGER, id INTEGER
+            )
+        """)
+
+    def stage(self, db: NetlistDB, target_types: list[str], since: int | None = None) -> "Staged":
+        """
+        Like ematch(), but leave the matches in the temp table of the pattern (INSERT ... SELECT), so that
+        apply() runs entirely inside SQLite. Only the number of matches comes back to Python.
+        Matches already applied (see apply()) are left out.
+        """
+        self._create_tables(db)
+        sql, params = self._query(target_types, since)
+        cur = db.execute(f"DELETE FROM {self._table}")
+        cur.execute(f"""
+            INSERT INTO {self._table} ({self._key})
+            WITH found ({self._key}) AS ({sql})
+            SELECT * FROM found AS m WHERE NOT {self._applied_sql}
+        """, params)
+        return Staged(self, cur.rowcount)
+
+    def apply(self, db: NetlistDB, matches: "Iterable[tuple] | Staged") -> int:
+        """
+        Apply the matches (or the staged ones) to the database. Return the number of rhs root cells inserted.
+        Applied matches are recorded in the ledger of the pattern, whose e-classes NetlistDB.rebuild() keeps canonical,
+        and are skipped when found again. Only pattern rules have a ledger: the legacy rules of rewrites.basic and
+        rewrites.retiming apply every match they find again.
+        """
+        self._create_tables(db)
+        if isinstance(matches, Staged):
+            if matches.pattern is not self:
+                raise ValueError(f"Matches staged by rule {matches.pattern.name} applied with rule {self.name}")
+            cur = db.cursor()
+        else:
+            cur = db.execute(f"DELETE FROM {self._table}")
+            cur.executemany(self._insert_sql, matches)
+            cur.execute(f"DELETE FROM {self._table} AS m WHERE {self._applied_sql}")
+        cur.execute(f"UPDATE {self._table} AS m SET width = (SELECT width FROM wirevecs WHERE id = m.root)")
+        inserted = 0
+        for kind, sql in self._apply_sql:
+            if kind == "fresh":
+                db._add_fresh_wirevecs(sql)
+            else:
+                cur.execute(sql, self._params)
+                if kind == "root":
+                    inserted = cur.rowcount
+        cur.execute(f"INSERT OR IGNORE INTO {self._ledger} ({self._key}) SELECT {self._key} FROM {self._table}")
+        cur.execute(f"DELETE FROM {self._table}")
+        db.commit()
+        return inserted
+
+    def rule(self, target_types: list[str], in_db: bool = False) -> Rule:
+        """
+        With in_db=True, the rule stages its matches with stage() instead of fetching them with ematch().
+        """
+        if in_db:
+            return Rule(self.stage, self.apply, target_types, name=self.name, in_db=True)
+        return Rule(self.ematch, self.apply, target_types, name=self.name)
+
+
+class Staged:
+    """
+    The matches staged by Pattern.stage(): they stay in the temp table of the pattern until apply().
+    """
+    pattern: Pattern
+    count: int
+
+    def __init__(self, pattern: Pattern, count: int):
+        self.pattern = pattern
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+
+def rewrite(name: str, src: str, target_types: list[str], in_db: bool = False) -> Rule:
+    """
+    Compile a rewrite rule, e.g. rewrite("comm", COMM, ["$addu", "$mulu"]).
+    """
+    return Pattern(name, src).rule(target_types, in_db)
@@ -1,19 +1,44 @@
+"""
+Legacy hand-written retiming rule, superseded by the pattern DFF_FORWARD_ABY_CELL with rewrite(..., in_db=True),
+which applies inside SQLite and is the one eval.py and design.default_rules() run. Kept as the baseline of emap.bench.
+It has no ledger of applied matches (see Pattern.apply()).
+"""
 from typing import Iterable
 from ..db import NetlistDB
 
 
-def ematch_dff_forward_aby_cell(db: NetlistDB, target_types: list[str]) -> Iterable[tuple[str, int, int, int]]:
+def ematch_dff_forward_aby_cell(db: NetlistDB, target_types: list[str], since: int | None = None) -> Iterable[tuple[str, int, int, int]]:
     """
     Return a list of tuples (type, a, b, y) for dff cells that can be rewritten to forward aby cells.
+    If since is given, only matches involving rows newer than epoch since are returned:
+    new dff1, old dff1 with new dff2, or old dffs with a new cell.
     """
-    cur = db.execute("""
-        SELECT cell.type, dff1.d, dff2.d, cell.y
-        FROM dffs AS dff1 JOIN dffs AS dff2 JOIN aby_cells as cell ON dff1.q = cell.a AND dff2.q = cell.b
-        WHERE cell.type IN ({})
-        """.format(",".join("?" * len(target_types))),
-        target_types
+    types = ",".join("?" * len(target_types))
+    select = "SELECT cell.type, dff1.d, dff2.d, cell.y"
+    if since is None:
+        return db.execute(f"""
+            {select}
+            FROM dffs AS dff1 JOIN dffs AS dff2 JOIN aby_cells as cell ON dff1.q = cell.a AND dff2.q = cell.b
+            WHERE cell.type IN ({types})
+            """,
+            target_types
+        )
+    # CROSS JOIN makes the delta side the outer loop, the unary + keeps the epoch index off the inner side
+    return db.execute(f"""
+        {select}
+        FROM dffs AS dff1 CROSS JOIN aby_cells AS cell ON dff1.q = cell.a CROSS JOIN dffs AS dff2 ON dff2.q = cell.b
+        WHERE cell.type IN ({types}) AND dff1.epoch > ?
+        UNION ALL
+        {select}
+        FROM dffs AS dff2 CROSS JOIN aby_cells AS cell ON dff2.q = cell.b CROSS JOIN dffs AS dff1 ON dff1.q = cell.a
+        WHERE cell.type IN ({types}) AND dff2.epoch > ? AND +dff1.epoch <= ?
+        UNION ALL
+        {select}
+        FROM aby_cells AS cell CROSS JOIN dffs AS dff1 ON dff1.q = cell.a CROSS JOIN dffs AS dff2 ON dff2.q = cell.b
+        WHERE cell.type IN ({types}) AND cell.epoch > ? AND +dff1.epoch <= ? AND +dff2.epoch <= ?
+        """,
+        [*target_types, since, *target_types, since, since, *target_types, since, since, since]
     )
-    return cur
 
 def apply_dff_forward_aby_cell(db: NetlistDB, matches: Iterable[tuple[str, int, int, int]]) -> int:
     """
@@ -22,16 +47,12 @@ def apply_dff_forward_aby_cell(db: NetlistDB, matches: Iterable[tuple[str, int,
     """
     newrows = []
     for type_, a, b, y in matches:
-        cur = db.execute("SELECT MAX(idx) + 1 FROM wirevec_members WHERE wirevec = ?", (y,))    # get width
-        width_y = cur.fetchone()[0]
-        cur.execute("SELECT y from aby_cells WHERE type = ? AND a = ? AND b = ? LIMIT 1", (type_, a, b))
-        row = cur.fetchone()
-        if row is None:
+        width_y = db._get_width(y)
+        d = db._lookup_aby_cell(type_, a, b, width_y)
+        if d is None:
             d = db._add_wirevec([db.auto_id for _ in range(width_y)])
-            cur.execute("INSERT INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", (type_, a, b, d))
-        else:
-            d = row[0]
+            db.execute("INSERT INTO aby_cells (type, a, b, y) VALUES (?, ?, ?, ?)", (type_, a, b, d))
         newrows.append((d, y))
-    cur.executemany("INSERT OR IGNORE INTO dffs (d, q) VALUES (?, ?)", newrows)
+    cur = db.executemany("INSERT OR IGNORE INTO dffs (d, q) VALUES (?, ?)", newrows)
     db.commit()
     return cur.rowcount
\ No newline at end of file
@@ -0,0 +1,381 @@
+import time
+import resource
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Callable, Iterable, Sized
+from .db import NetlistDB
+
+
+class Rule:
+    """
+    A rewrite rule: a matcher ematch(db, target_types, since) and an applier apply(db, matches),
+    e.g. Rule(rewrites.ematch_comm, rewrites.apply_comm, ["$addu", "$mulu"]) (see rewrites.rewrite() for rules
+    compiled from patterns, which are the ones to use).
+    An in_db rule's matcher returns a sized handle to matches kept inside the database (see Pattern.stage()),
+    which is passed to its applier as is; it always runs on the writer connection.
+    """
+    name: str
+    ematch: Callable[..., Iterable[tuple]]
+    apply: Callable[[NetlistDB, Iterable[tuple]], int]
+    target_types: list[str]
+    in_db: bool
+
+    def __init__(
+        self,
+        ematch: Callable[..., Iterable[tuple]],
+        apply: Callable[[NetlistDB, Iterable[tuple]], int],
+        target_types: list[str],
+        name: str | None = None,
+        in_db: bool = False
+    ):
+        self.name = name or ematch.__name__.removeprefix("ematch_")
+        self.ematch = ematch
+        self.apply = apply
+        self.target_types = target_types
+        self.in_db = in_db
+
+    def search(self, db: NetlistDB | sqlite3.Connection, since: int | None) -> Sized:
+        found = self.ematch(db, self.target_types, since)
+        return found if self.in_db else list(found)
+
+
+class StopReason(str, Enum):
+    SATURATED = "saturated"
+    ITERATION_LIMIT = "iteration_limit"
+    NODE_LIMIT = "node_limit"
+    TIME_LIMIT = "time_limit"
+    MEMORY_LIMIT = "memory_limit"
+
+
+@dataclass
+class RuleReport:
+    name: str
+    matches: int = 0
+    applied: int = 0
+    match_time: float = 0.0
+    apply_time: float = 0.0
+    banned: bool = False
+
+
+@dataclass
+class Iteration:
+    index: int
+    rules: list[RuleReport] = field(default_factory=list)
+    applied: int = 0
+    match_time: float = 0.0     # wall time of the search phase, less than the sum over the rules when parallel
+    rebuilds: int = 0
+    rebuild_time: float = 0.0
+    enodes: int = 0
+    swept: int = 0              # rows deleted by NetlistDB.compact(), if it ran this iteration
+    compact_time: float = 0.0
+    checkpoint_time: float = 0.0
+    total_time: float = 0.0
+    stop_reason: StopReason | None = None
+
+
+@dataclass
+class Report:
+    iterations: list[Iteration] = field(default_factory=list)
+    stop_reason: StopReason | None = None
+    total_time: float = 0.0
+
+
+class Scheduler:
+    """
+    Decide which rules are searched and applied in each iteration. The base scheduler runs every rule every time.
+    """
+
+    def can_search(self, rule: Rule, iteration: int) -> bool:
+        return True
+
+    def admit(self, rule: Rule, iteration: int, n_matches: int) -> bool:
+        """
+        Return whether the matches found for rule should be applied.
+        """
+        return True
+
+    def can_stop(self, iteration: int) -> bool:
+        """
+        Called when an iteration applied nothing. Return whether the runner may stop as saturated.
+        """
+        return True
+
+    def state(self) -> dict[str, Any]:
+        """
+        Return the JSON-serializable state saved with the database by the Runner, for a resumed run.
+        """
+        return {}
+
+    def load_state(self, state: dict[str, Any]):
+        pass
+
+
+class BackoffScheduler(Scheduler):
+    """
+    Ban rules whose match counts blow up, as egg's BackoffScheduler does.
+    A rule finding more than match_limit << times_banned matches is not applied and is banned for
+    ban_length << times_banned iterations. Saturation is only reported once no rule is banned.
+    """
+    _match_limit: int
+    _ban_length: int
+    _stats: dict[str, dict[str, int]]
+
+    def __init__(self, match_limit: int = 1000, ban_length: int = 5):
+        self._match_limit = match_limit
+        self._ban_length = ban_length
+        self._stats = {}
+
+    def _rule_stats(self, rule: Rule) -> dict[str, int]:
+        if rule.name not in self._stats:
+            self._stats[rule.name] = {"times_applied": 0, "times_banned": 0, "banned_until": 0}
+        return self._stats[rule.name]
+
+    def can_search(self, rule: Rule, iteration: int) -> bool:
+        return self._rule_stats(rule)["banned_until"] <= iteration
+
+    def admit(self, rule: Rule, iteration: int, n_matches: int) -> bool:
+        stats = self._rule_stats(rule)
+        threshold = self._match_limit << stats["times_banned"]
+        if n_matches > threshold:
+            stats["banned_until"] = iteration + (self._ban_length << stats["times_banned"])
+            stats["times_banned"] += 1
+            return False
+        stats["times_applied"] += 1
+        return True
+
+    def can_stop(self, iteration: int) -> bool:
+        banned = [stats for stats in self._stats.values() if stats["banned_until"] > iteration]
+        # unban everything and try once more before declaring saturation
+        for stats in banned:
+            stats["banned_until"] = iteration
+        return not banned
+
+    def state(self) -> dict[str, Any]:
+        return {name: dict(stats) for name, stats in self._stats.items()}
+
+    def load_state(self, state: dict[str, Any]):
+        self._stats.update((name, dict(stats)) for name, stats in state.items())
+
+
+class Runner:
+    """
+    Run rewrite rules to saturation on a NetlistDB, within iteration, e-node, wall-clock and memory limits.
+    Matching is semi-naive: each rule only looks at rows newer than the epoch of its last applied search.
+    Each iteration is one transaction (see NetlistDB.batch()), except for the compaction and the checkpoint.
+    With parallel=n (file-backed databases only), the database is switched to WAL mode and the rules are searched
+    by n threads, each on its own read-only connection and snapshot; the matches are still applied serially.
+    With compact_every=k, NetlistDB.compact() runs after every k-th rebuild to drop the e-nodes no longer reachable
+    from the outputs.
+    With checkpoint_every=k, the database is saved to checkpoint_path (see NetlistDB.checkpoint()) every k iterations
+    and when the run stops. The state of the run (iteration, epoch searched up to by each rule, scheduler) is kept in
+    the database, so a Runner created on NetlistDB.open(checkpoint_path) resumes where the run left off instead of
+    matching everything again. The limits apply to each run separately.
+    """
+    _db: NetlistDB
+    _rules: list[Rule]
+    _scheduler: Scheduler
+    _iter_limit: int | None
+    _node_limit: int | None
+    _time_limit: float | None
+    _memory_limit: int | None
+    _since: dict[str, int | None]
+    _first: int
+    _parallel: int | None
+    _compact_every: int | None
+    _checkpoint_every: int | None
+    _checkpoint_path: str | None
+    _pool: ThreadPoolExecutor | None
+    _local: threading.local
+    _readers: list[sqlite3.Connection]
+
+    def __init__(
+        self,
+        db: NetlistDB,
+        rules: list[Rule],
+        scheduler: Scheduler | None = None,
+        iter_limit: int | None = 30,
+        node_limit: int | None = None,
+        time_limit: float | None = None,
+        memory_limit: int | None = None,  # in bytes
+        parallel: int | None = None,        # number of matcher threads
+        compact_every: int | None = None,   # in iterations
+        checkpoint_every: int | None = None,    # in iterations
+        checkpoint_path: str | None = None
+    ):
+        if checkpoint_every is not None and checkpoint_path is None:
+            raise ValueError("checkpoint_every needs a checkpoint_path")
+        self._db = db
+        self._rules = rules
+        self._scheduler = BackoffScheduler() if scheduler is None else scheduler
+        self._iter_limit = iter_limit
+        self._node_limit = node_limit
+        self._time_limit = time_limit
+        self._memory_limit = memory_limit
+        state = db.get_meta("runner", {})
+        self._since = {rule.name: state.get("since", {}).get(rule.name) for rule in rules}
+        self._first = state.get("iteration", 0)
+        self._scheduler.load_state(state.get("scheduler", {}))
+        self._parallel = parallel
+        self._compact_every = compact_every
+        self._checkpoint_every = checkpoint_every
+        self._checkpoint_path = checkpoint_path
+        self._pool = None
+        self._local = threading.local()
+        self._readers = []
+
+    @staticmethod
+    def _memory_usage() -> int:
+        """
+        Return the peak resident set size of the process in bytes.
+        """
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024   # KiB on Linux
+
+    def _check_limits(self, iteration: Iteration, start: float) -> StopReason | None:
+        if self._node_limit is not None and iteration.enodes > self._node_limit:
+            return StopReason.NODE_LIMIT
+        if self._time_limit is not None and time.time() - start > self._time_limit:
+            return StopReason.TIME_LIMIT
+        if self._memory_limit is not None and self._memory_usage() > self._memory_limit:
+            return StopReason.MEMORY_LIMIT
+        if self._iter_limit is not None and iteration.index + 1 - self._first >= self._iter_limit:
+            return StopReason.ITERATION_LIMIT
+        return None
+
+    def _reader(self) -> sqlite3.Connection:
+        """
+        Return the read-only connection of the current matcher thread.
+        """
+        reader = getattr(self._local, "reader", None)
+        if reader is None:
+            reader = self._local.reader = self._db.open_reader()
+            self._readers.append(reader)
+        return reader
+
+    def _search(self, rule: Rule, since: int | None) -> tuple[list[tuple], float]:
+        t = time.time()
+        if self._pool is None or rule.in_db:
+            with self._db.phase(f"match.{rule.name}"):
+                found = rule.search(self._db, since)
+        else:
+            reader = self._reader()
+            reader.execute("BEGIN")    # one snapshot for the whole search
+            try:
+                found = rule.search(reader, since)
+            finally:
+                reader.rollback()
+        return found, time.time() - t
+
+    def _start_pool(self):
+        if self._parallel is not None and self._pool is None:
+            self._db.enable_wal()
+            self._pool = ThreadPoolExecutor(self._parallel, thread_name_prefix="ematch")
+
+    def _stop_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        for reader in self._readers:
+            reader.close()
+        self._readers.clear()
+        self._local = threading.local()
+
+    def _checkpoint(self, iteration: Iteration):
+        t = time.time()
+        with self._db.phase("checkpoint"):
+            self._db.checkpoint(self._checkpoint_path)
+        iteration.checkpoint_time += time.time() - t
+
+    def step(self, index: int) -> Iteration:
+        """
+        Run one iteration: search all rules, apply the admitted matches, then rebuild (and compact, and checkpoint).
+        """
+        db = self._db
+        iteration = Iteration(index)
+        start = time.time()
+        # one transaction per iteration, unless matcher threads have to see the stamped epoch
+        with db.batch() if self._pool is None else nullcontext():
+            epoch = db.new_epoch()
+
+            t = time.time()
+            searches = []
+            for rule in self._rules:
+                report = RuleReport(rule.name)
+                iteration.rules.append(report)
+                if not self._scheduler.can_search(rule, index):
+                    report.banned = True
+                    continue
+                since = self._since[rule.name]
+                if self._pool is None or rule.in_db:
+                    searches.append((rule, report, self._search(rule, since)))
+                else:
+                    searches.append((rule, report, self._pool.submit(self._search, rule, since)))
+
+            matches: list[tuple[Rule, RuleReport, Sized]] = []
+            for rule, report, search in searches:
+                found, report.match_time = search if isinstance(search, tuple) else search.result()
+                report.matches = len(found)
+                if not self._scheduler.admit(rule, index, len(found)):
+                    # the rule will see these rows again once it is unbanned
+                    report.banned = True
+                    continue
+                self._since[rule.name] = epoch
+                matches.append((rule, report, found))
+            iteration.match_time = time.time() - t
+
+            for rule, report, found in matches:
+                if found:
+                    t = time.time()
+                    with db.phase(f"apply.{rule.name}"):
+                        report.applied = rule.apply(db, found)
+                    report.apply_time = time.time() - t
+                    iteration.applied += report.applied
+
+            t = time.time()
+            iteration.rebuilds = db.rebuild()
+            iteration.rebuild_time = time.time() - t
+            # only now that the matches are applied may the rules skip them when resumed
+            state = db.get_meta("runner", {})
+            db.set_meta("runner", {
+                "iteration": index + 1,
+                "since": {**state.get("since", {}), **self._since},
+                "scheduler": {**state.get("scheduler", {}), **self._scheduler.state()},
+            })
+            db.commit()
+        if self._compact_every is not None and (index + 1) % self._compact_every == 0:
+            t = time.time()
+            with db.phase("compact"):
+                iteration.swept = sum(db.compact().values())
+            iteration.compact_time = time.time() - t
+        if self._checkpoint_every is not None and (index + 1) % self._checkpoint_every == 0:
+            self._checkpoint(iteration)
+        iteration.enodes = db.count_enodes()
+        iteration.total_time = time.time() - start
+        return iteration
+
+    def run(self) -> Report:
+        report = Report()
+        start = time.time()
+        index = self._first
+        self._start_pool()
+        try:
+            while True:
+                iteration = self.step(index)
+                report.iterations.append(iteration)
+                if iteration.applied == 0 and self._scheduler.can_stop(index):
+                    iteration.stop_reason = StopReason.SATURATED
+                else:
+                    iteration.stop_reason = self._check_limits(iteration, start)
+                if iteration.stop_reason is not None:
+                    break
+                index += 1
+        finally:
+            self._stop_pool()
+        if self._checkpoint_every is not None and (index + 1) % self._checkpoint_every != 0:
+            self._checkpoint(iteration)
+        report.stop_reason = iteration.stop_reason
+        report.total_time = time.time() - start
+        return report
@@ -1,9 +1,10 @@
 CREATE TABLE IF NOT EXISTS wirevecs (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    hash INTEGER NOT NULL
+    hash INTEGER NOT NULL,
+    width INTEGER NOT NULL, -- number of members, fixed at creation (merging wires never changes it)
+    members BLOB    -- packed int32 members in the packed layout (NetlistDB(packed=True)), NULL otherwise
 );
--- not sure whether we need length field, we can get it from max(idx) + 1 in wirevec_members
-CREATE INDEX IF NOT EXISTS wirevecs_hash ON wirevecs(hash); -- for quick lookup by hash
+CREATE INDEX IF NOT EXISTS wirevecs_hash ON wirevecs(hash, width); -- for quick lookup by hash
 
 CREATE TABLE IF NOT EXISTS wirevec_members (
     wirevec INTEGER,
@@ -14,6 +15,15 @@ CREATE TABLE IF NOT EXISTS wirevec_members (
 );
 CREATE INDEX IF NOT EXISTS wirevec_members_wire on wirevec_members(wire);   -- for quick lookup by wire
 
+-- reverse index of the packed layout: the wirevecs containing each wire
+CREATE TABLE IF NOT EXISTS wire_refs (
+    wire INTEGER,
+    wirevec INTEGER,
+    PRIMARY KEY (wire, wirevec),
+    FOREIGN KEY (wirevec) REFERENCES wirevecs(id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS wire_refs_wirevec ON wire_refs(wirevec);
+
 CREATE TABLE IF NOT EXISTS as_outputs (
     sink INTEGER NOT NULL,
     name VARCHAR(16) PRIMARY KEY,
@@ -30,16 +40,22 @@ CREATE TABLE IF NOT EXISTS ay_cells (
     type VARCHAR(16),
     a INTEGER,
     y INTEGER,
+    epoch INTEGER,  -- iteration in which the row was inserted or canonicalized, NULL until NetlistDB.new_epoch()
     PRIMARY KEY (type, a, y),
     FOREIGN KEY (a) REFERENCES wirevecs(id),
     FOREIGN KEY (y) REFERENCES wirevecs(id)
 );
+CREATE INDEX IF NOT EXISTS ay_cells_epoch ON ay_cells(type, epoch);
+CREATE INDEX IF NOT EXISTS ay_cells_unstamped ON ay_cells(epoch) WHERE epoch IS NULL;
+CREATE INDEX IF NOT EXISTS ay_cells_a ON ay_cells(a, type, y);
+CREATE INDEX IF NOT EXISTS ay_cells_y ON ay_cells(y, type, a);
 
 CREATE TABLE IF NOT EXISTS aby_cells (
     type VARCHAR(16),
     a INTEGER,
     b INTEGER,
     y INTEGER,
+    epoch INTEGER,
     PRIMARY KEY (type, a, b, y),
     FOREIGN KEY (a) REFERENCES wirevecs(id),
     FOREIGN KEY (b) REFERENCES wirevecs(id),
@@ -47,7 +63,15 @@ CREATE TABLE IF NOT EXISTS aby_cells (
 );
 -- not sure whether we need a bitwise version of it
 -- NOTE: be careful with the same inputs but different outputs' widths, they should be treated as different cells
--- TODO: add output width field
+-- the output width is wirevecs.width of y
+
+-- for semi-naive matching (delta rows of a type) and for NetlistDB.new_epoch()
+CREATE INDEX IF NOT EXISTS aby_cells_epoch ON aby_cells(type, epoch);
+CREATE INDEX IF NOT EXISTS aby_cells_unstamped ON aby_cells(epoch) WHERE epoch IS NULL;
+-- covering indexes for lookups by a single wirevec (joins on cell1.y = cell2.a, canonicalization in rebuild)
+CREATE INDEX IF NOT EXISTS aby_cells_a ON aby_cells(a, type, b, y);
+CREATE INDEX IF NOT EXISTS aby_cells_b ON aby_cells(b, type, a, y);
+CREATE INDEX IF NOT EXISTS aby_cells_y ON aby_cells(y, type, a, b);
 
 CREATE TABLE IF NOT EXISTS absy_cells (
     type VARCHAR(16),
@@ -55,21 +79,73 @@ CREATE TABLE IF NOT EXISTS absy_cells (
     b INTEGER,
     s INTEGER,
     y INTEGER,
+    epoch INTEGER,
     PRIMARY KEY (type, a, b, s, y),
     FOREIGN KEY (a) REFERENCES wirevecs(id),
     FOREIGN KEY (b) REFERENCES wirevecs(id),
     FOREIGN KEY (s) REFERENCES wirevecs(id),
     FOREIGN KEY (y) REFERENCES wirevecs(id)
 );
+CREATE INDEX IF NOT EXISTS absy_cells_epoch ON absy_cells(type, epoch);
+CREATE INDEX IF NOT EXISTS absy_cells_unstamped ON absy_cells(epoch) WHERE epoch IS NULL;
+CREATE INDEX IF NOT EXISTS absy_cells_a ON absy_cells(a);
+CREATE INDEX IF NOT EXISTS absy_cells_b ON absy_cells(b);
+CREATE INDEX IF NOT EXISTS absy_cells_s ON absy_cells(s);
+CREATE INDEX IF NOT EXISTS absy_cells_y ON absy_cells(y);
 
 CREATE TABLE IF NOT EXISTS dffs (
     d INTEGER,
     q INTEGER,
+    epoch INTEGER,
     PRIMARY KEY (d, q),
     FOREIGN KEY (d) REFERENCES wirevecs(id),
     FOREIGN KEY (q) REFERENCES wirevecs(id)
 );
 -- we assume there's a global clock wire
+CREATE INDEX IF NOT EXISTS dffs_epoch ON dffs(epoch);
+CREATE INDEX IF NOT EXISTS dffs_q ON dffs(q, d);
+
+-- the cells of the netlist as built (NetlistDB.snapshot_origin()), kept canonical by rebuild() like the cell tables:
+-- extraction falls back to them when they are cheaper than its greedy choice (see emap.extract)
+CREATE TABLE IF NOT EXISTS origin_ay_cells (
+    type VARCHAR(16),
+    a INTEGER,
+    y INTEGER,
+    PRIMARY KEY (type, a, y)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS origin_ay_cells_a ON origin_ay_cells(a);
+CREATE INDEX IF NOT EXISTS origin_ay_cells_y ON origin_ay_cells(y);
+
+CREATE TABLE IF NOT EXISTS origin_aby_cells (
+    type VARCHAR(16),
+    a INTEGER,
+    b INTEGER,
+    y INTEGER,
+    PRIMARY KEY (type, a, b, y)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS origin_aby_cells_a ON origin_aby_cells(a);
+CREATE INDEX IF NOT EXISTS origin_aby_cells_b ON origin_aby_cells(b);
+CREATE INDEX IF NOT EXISTS origin_aby_cells_y ON origin_aby_cells(y);
+
+CREATE TABLE IF NOT EXISTS origin_absy_cells (
+    type VARCHAR(16),
+    a INTEGER,
+    b INTEGER,
+    s INTEGER,
+    y INTEGER,
+    PRIMARY KEY (type, a, b, s, y)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS origin_absy_cells_a ON origin_absy_cells(a);
+CREATE INDEX IF NOT EXISTS origin_absy_cells_b ON origin_absy_cells(b);
+CREATE INDEX IF NOT EXISTS origin_absy_cells_s ON origin_absy_cells(s);
+CREATE INDEX IF NOT EXISTS origin_absy_cells_y ON origin_absy_cells(y);
+
+CREATE TABLE IF NOT EXISTS origin_dffs (
+    d INTEGER,
+    q INTEGER,
+    PRIMARY KEY (d, q)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS origin_dffs_q ON origin_dffs(q);
 
 CREATE TABLE IF NOT EXISTS instances (
     name VARCHAR(16) PRIMARY KEY,
@@ -86,3 +162,40 @@ CREATE TABLE IF NOT EXISTS instance_ports (
     FOREIGN KEY (instance) REFERENCES instances(name),
     FOREIGN KEY (signal) REFERENCES wirevecs(id)
 );
+
+-- change log driving the incremental rebuild, drained by NetlistDB.rebuild()
+CREATE TABLE IF NOT EXISTS dirty_aby_cells (
+    type VARCHAR(16),
+    a INTEGER,
+    b INTEGER,
+    PRIMARY KEY (type, a, b)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS dirty_wirevecs (
+    id INTEGER PRIMARY KEY
+);
+
+-- a new (type, a, b) may be congruent with an existing cell
+CREATE TRIGGER IF NOT EXISTS aby_cells_log_insert AFTER INSERT ON aby_cells BEGIN
+    INSERT OR IGNORE INTO dirty_aby_cells (type, a, b) VALUES (NEW.type, NEW.a, NEW.b);
+END;
+
+-- a new or rewritten wirevec may duplicate an existing one
+CREATE TRIGGER IF NOT EXISTS wirevecs_log_insert AFTER INSERT ON wirevecs BEGIN
+    INSERT OR IGNORE INTO dirty_wirevecs (id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS wirevec_members_log_update AFTER UPDATE OF wire ON wirevec_members BEGIN
+    INSERT OR IGNORE INTO dirty_wirevecs (id) VALUES (NEW.wirevec);
+END;
+
+CREATE TRIGGER IF NOT EXISTS wirevecs_log_update AFTER UPDATE OF members ON wirevecs BEGIN
+    INSERT OR IGNORE INTO dirty_wirevecs (id) VALUES (NEW.id);
+END;
+
+-- state of the NetlistDB object (wire counter, clock, hash parameters, epoch...), so that the file can be reopened
+-- with NetlistDB.open() and a run resumed from a NetlistDB.checkpoint()
+CREATE TABLE IF NOT EXISTS meta (
+    key VARCHAR(16) PRIMARY KEY,
+    value
+);
@@ -0,0 +1,274 @@
+"""
+Opt-in instrumentation of a NetlistDB (see NetlistDB.enable_stats()): wall time and changed rows per phase
+(rebuild steps, matchers, appliers), and per SQL statement its count, latency, rows and query plan.
+
+Statements are keyed by their normalized text (literals and parameters replaced by ?). Counts come from
+set_trace_callback(), so they include what SQLite runs for executescript() and executemany(). Latencies and rows
+come from wrapping the execute methods of the connection, fetching included. Nothing is wrapped while disabled.
+"""
+import functools
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Iterator
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|[xX]'[0-9a-fA-F]*'|\b\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b|[:@$][A-Za-z_]\w*|\?\d*")
+_LISTS = re.compile(r"\?(?:\s*,\s*\?)+")
+_SOURCES = re.compile(r"\b(?:FROM|JOIN)\s+([\w.]+)(?:\s+AS\s+(\w+))?", re.IGNORECASE)   # table [AS alias]
+_CTES = re.compile(r"\b(\w+)\s+AS\s+(?:NOT\s+)?(?:MATERIALIZED\s+)?\(", re.IGNORECASE)
+
+
+def normalize(sql: str) -> str:
+    """
+    Return sql with whitespace collapsed and every literal or parameter replaced by ?, lists of them by "?, ...".
+    """
+    return _LISTS.sub("?, ...", _LITERALS.sub("?", " ".join(sql.split())))
+
+
+_normalize_cached = functools.lru_cache(maxsize=4096)(normalize)     # for the statements as written in the code
+
+
+@dataclass
+class PhaseStats:
+    calls: int = 0
+    time: float = 0.0
+    rows: int = 0   # rows inserted, updated or deleted (sqlite3.Connection.total_changes)
+
+
+@dataclass
+class StatementStats:
+    count: int = 0          # executions seen by SQLite (trace callback), trigger programs included
+    calls: int = 0          # execute() calls
+    time: float = 0.0       # in execute() and in fetching the results
+    max_time: float = 0.0
+    rows: int = 0           # rowcount of the DML statements
+    plan: list[str] = field(default_factory=list)
+    full_scans: list[str] = field(default_factory=list)
+
+
+class _TimedCursor(sqlite3.Cursor):
+    """
+    A cursor charging its execution and fetch time to the statement it runs.
+    """
+    _stats: "Stats"
+    _entry: StatementStats | None = None
+
+    def _charge(self, dt: float):
+        if self._entry is not None:
+            self._entry.time += dt
+            self._entry.max_time = max(self._entry.max_time, dt)
+
+    def _run(self, method, sql: str, params=None, many: bool = False):
+        stats = self._stats
+        key, self._entry = stats._statement(sql, params, many)
+        start = time.perf_counter()
+        try:
+            return method(self, sql) if params is None else method(self, sql, params)
+        finally:
+            dt = time.perf_counter() - start
+            self._entry.calls += 1
+            self._charge(dt)
+            if self.rowcount > 0:
+                self._entry.rows += self.rowcount
+            stats._event(key, "sql", start, dt, {})
+
+    def execute(self, sql: str, params=None):
+        return self._run(sqlite3.Cursor.execute, sql, params)
+
+    def executemany(self, sql: str, params):
+        return self._run(sqlite3.Cursor.executemany, sql, params, many=True)
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return sqlite3.Cursor.__next__(self)
+        finally:
+            self._charge(time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return sqlite3.Cursor.fetchone(self)
+        finally:
+            self._charge(time.perf_counter() - start)
+
+    def fetchmany(self, size: int | None = None):
+        start = time.perf_counter()
+        try:
+            return sqlite3.Cursor.fetchmany(self, self.arraysize if size is None else size)
+        finally:
+            self._charge(time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return sqlite3.Cursor.fetchall(self)
+        finally:
+            self._charge(time.perf_counter() - start)
+
+
+class Stats:
+    """
+    The statistics collected on one connection, e.g.
+
+        stats = db.enable_stats()
+        db.rebuild()
+        print(stats.summary())
+        stats.write_trace("rebuild.json")     # chrome://tracing or https://ui.perfetto.dev
+    """
+    phases: dict[str, PhaseStats]
+    statements: dict[str, StatementStats]
+    _conn: sqlite3.Connection
+    _explain: bool
+    _events: list[dict[str, Any]]
+    _max_events: int
+    _start: float
+
+    def __init__(self, conn: sqlite3.Connection, explain: bool = True, max_events: int = 1_000_000):
+        self.phases = {}
+        self.statements = {}
+        self._conn = conn
+        self._explain = explain
+        self._events = []
+        self._max_events = max_events
+        self._start = time.perf_counter()
+
+    def _attach(self):
+        conn = self._conn
+        cursor_class = type("TimedCursor", (_TimedCursor,), {"_stats": self})
+        cursor = functools.partial(sqlite3.Connection.cursor, conn, cursor_class)
+        conn.cursor = cursor
+        conn.execute = lambda sql, params=(): cursor().execute(sql, params)
+        conn.executemany = lambda sql, params: cursor().executemany(sql, params)
+        conn.executescript = self._executescript
+        conn.set_trace_callback(self._trace)
+
+    def _detach(self):
+        conn = self._conn
+        for name in ("cursor", "execute", "executemany", "executescript"):
+            conn.__dict__.pop(name, None)
+        conn.set_trace_callback(None)
+
+    def _executescript(self, script: str):
+        start = time.perf_counter()
+        try:
+            return sqlite3.Connection.executescript(self._conn, script)
+        finally:
+            self._event("executescript", "sql", start, time.perf_counter() - start, {})
+
+    def _trace(self, sql: str):
+        if not sql.startswith("EXPLAIN"):
+            self.statements.setdefault(normalize(sql), StatementStats()).count += 1
+
+    def _statement(self, sql: str, params, many: bool) -> tuple[str, StatementStats]:
+        key = _normalize_cached(sql)
+        entry = self.statements.get(key)
+        if entry is None:
+            entry = self.statements[key] = StatementStats()
+        if self._explain and not entry.plan and not entry.calls:
+            self._explain_plan(entry, sql, params, many)
+        return key, entry
+
+    def _explain_plan(self, entry: StatementStats, sql: str, params, many: bool):
+        if many:    # the plan does not depend on the values, but a generator cannot be peeked at
+            params = None if not isinstance(params, (list, tuple)) or not params else params[0]
+            if params is None:
+                return
+        try:
+            rows = sqlite3.Connection.execute(self._conn, f"EXPLAIN QUERY PLAN {sql}", params or ()).fetchall()
+        except sqlite3.Error:   # BEGIN, PRAGMA, DDL...
+            return
+        entry.plan = [detail for *_, detail in rows]
+        entry.full_scans = [detail for detail in entry.plan if self._scans_table(detail, sql)]
+
+    def _scans_table(self, detail: str, sql: str) -> bool:
+        """
+        Whether plan line detail of sql scans a whole table of the database, through an index or not.
+        Scans of temporary tables, CTEs, subqueries and table-valued functions are not counted.
+        """
+        if not detail.startswith("SCAN ") or detail.startswith(("SCAN CONSTANT ROW", "SCAN (")) or "VIRTUAL TABLE" in detail:
+            return False
+        name = detail.split()[1]
+        if name in _CTES.findall(sql):
+            return False
+        table = {alias or table: table for table, alias in _SOURCES.findall(sql)}.get(name, name)
+        if table.lower().startswith("temp."):
+            return False
+        self._conn.set_trace_callback(None)     # not a statement of the workload
+        try:
+            return not sqlite3.Connection.execute(
+                self._conn, "SELECT 1 FROM temp.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+            ).fetchone()
+        finally:
+            self._conn.set_trace_callback(self._trace)
+
+    def _event(self, name: str, cat: str, start: float, dt: float, args: dict[str, Any]):
+        if len(self._events) < self._max_events:
+            self._events.append({
+                "name": name, "cat": cat, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                "ts": (start - self._start) * 1e6, "dur": dt * 1e6, "args": args,
+            })
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[PhaseStats]:
+        """
+        Charge the wall time and changed rows of the block to phase name.
+        """
+        entry = self.phases.get(name)
+        if entry is None:
+            entry = self.phases[name] = PhaseStats()
+        changes = self._conn.total_changes
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            dt = time.perf_counter() - start
+            rows = self._conn.total_changes - changes
+            entry.calls += 1
+            entry.time += dt
+            entry.rows += rows
+            self._event(name, "phase", start, dt, {"rows": rows})
+
+    def full_scans(self) -> dict[str, list[str]]:
+        """
+        Return the statements whose plan scans a whole table, with the offending plan lines.
+        """
+        return {sql: entry.full_scans for sql, entry in self.statements.items() if entry.full_scans}
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "phases": {name: vars(entry) for name, entry in self.phases.items()},
+            "statements": {
+                sql: vars(entry) for sql, entry in sorted(self.statements.items(), key=lambda item: -item[1].time)
+            },
+        }
+
+    def summary(self, top: int = 10) -> str:
+        """
+        Return a text report: the phases, then the top statements by time.
+        """
+        lines = [f"{'phase':<40} {'calls':>8} {'time (s)':>10} {'rows':>10}"]
+        for name, entry in sorted(self.phases.items(), key=lambda item: -item[1].time):
+            lines.append(f"{name:<40} {entry.calls:>8} {entry.time:>10.3f} {entry.rows:>10}")
+        lines.append(f"{'statement':<60} {'count':>8} {'time (s)':>10} {'rows':>10}")
+        for sql, entry in sorted(self.statements.items(), key=lambda item: -item[1].time)[:top]:
+            flag = " [SCAN]" if entry.full_scans else ""
+            lines.append(f"{sql[:60]:<60} {entry.count:>8} {entry.time:>10.3f} {entry.rows:>10}{flag}")
+        return "\n".join(lines)
+
+    def write_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def write_trace(self, path: str):
+        """
+        Write the phases and statements as a Chrome trace (Trace Event Format).
+        """
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self._events, "displayTimeUnit": "ms", "otherData": self.to_dict()}, f)
@@ -1,56 +1,419 @@
-from typing import Iterable
+import itertools
+import sqlite3
+import sys
+import time
+from array import array
+from collections import OrderedDict
+from typing import Callable, Iterable, Iterator, Sequence, TextIO
+
+try:
+    import numpy as np
+except ImportError:     # optional: RollingHash.hash_many() falls back to pure Python
+    np = None
 
 
 class RollingHash:
-    _POWER_B: list[int]
-    _M: int
+    """
+    Polynomial hash sum(x_i * B^i) mod M of a wirevec.
+    If M2 is set, the same sum is also taken mod M2 and the two are combined as h1 * M2 + h2: this still fits in a
+    SQLite INTEGER, while every intermediate product stays below 2^60 so SQL and NumPy can compute it exactly.
+    """
+    _B: int
+    _moduli: tuple[int, ...]
+    _powers: list[list[int]]    # B^i mod m, one table per modulus
+
+    def __init__(self, B: int = 257, M: int = 10**9+7, M2: int | None = 998244353):
+        self._B = B
+        self._moduli = (M,) if M2 is None else (M, M2)
+        self._powers = [[1, B % m] for m in self._moduli]
 
-    def __init__(self, B: int = 257, M: int = 10**9+7):
-        self._POWER_B = [1, B]
-        self._M = M
+    @property
+    def B(self) -> int:
+        return self._B
+
+    @property
+    def M(self) -> int:
+        return self._moduli[0]
 
-    def hash(self, xs: Iterable[int]) -> int:
-        h = 0
-        for x in xs:
-            h = (h * self._POWER_B[1] + x) % self._M
-        return h
+    @property
+    def M2(self) -> int | None:
+        return self._moduli[1] if len(self._moduli) > 1 else None
+
+    def powers(self, n: int, k: int = 0) -> list[int]:
+        """
+        Return the power table B^i mod M (mod M2 for k=1), extended to at least n entries.
+        The table grows by doubling: B^(j+i) = B^j * B^i.
+        """
+        table, m = self._powers[k], self._moduli[k]
+        while len(table) < n:
+            size = len(table)
+            b_size = table[-1] * table[1] % m
+            table.extend(p * b_size % m for p in table[:n - size])
+        return table
+
+    def _combine(self, hs: Sequence[int]) -> int:
+        return hs[0] if len(hs) == 1 else hs[0] * self._moduli[1] + hs[1]
+
+    def _split(self, h: int) -> tuple[int, ...]:
+        return (h,) if len(self._moduli) == 1 else divmod(h, self._moduli[1])
+
+    def hash(self, xs: Sequence[int]) -> int:
+        """
+        Return sum(x_i * B^i) mod M (combined with mod M2), so that update() can replace any x_i in place.
+        """
+        hs = []
+        for m in self._moduli:
+            h = 0
+            for x in reversed(xs):
+                h = (h * self._B + x) % m
+            hs.append(h)
+        return self._combine(hs)
+
+    def hash_many(self, wvs: Sequence[Sequence[int]]) -> list[int]:
+        """
+        Return [hash(wv) for wv in wvs], vectorized with NumPy when it is available.
+        """
+        if np is None or len(wvs) < 2:
+            return [self.hash(wv) for wv in wvs]
+        lengths = np.fromiter((len(wv) for wv in wvs), dtype=np.int64, count=len(wvs))
+        xs = np.fromiter(itertools.chain.from_iterable(wvs), dtype=np.int64, count=int(lengths.sum()))
+        starts = np.zeros_like(lengths)
+        np.cumsum(lengths[:-1], out=starts[1:])
+        idx = np.arange(len(xs), dtype=np.int64) - np.repeat(starts, lengths)  # position of each wire in its wirevec
+        nonempty = lengths > 0
+        width = int(lengths.max())
+        result = np.zeros(len(wvs), dtype=np.int64)
+        for k, m in enumerate(self._moduli):
+            powers = np.array(self.powers(width, k)[:width], dtype=np.int64)
+            terms = (xs % m) * powers[idx] % m   # both factors < 2^30
+            h = np.zeros(len(wvs), dtype=np.int64)
+            if len(terms):
+                h[nonempty] = np.add.reduceat(terms, starts[nonempty]) % m
+            result = result * m + h if k else h
+        return result.tolist()
 
     def update(self, old_h: int, index: int, old_x: int, new_x: int) -> int:
         """
         Update the hash value by replacing old_x at index with new_x.
         """
-        while len(self._POWER_B) <= index:
-            self._POWER_B.append((self._POWER_B[-1] * self._POWER_B[1]) % self._M)
-        h = (old_h - old_x * self._POWER_B[index]) % self._M    # TODO: is it safe? underflow?
-        h = (h + new_x * self._POWER_B[index]) % self._M
-        return h
+        return self.update_many(old_h, ((index, old_x, new_x),))
+
+    def update_many(self, old_h: int, subs: Iterable[tuple[int, int, int]]) -> int:
+        """
+        Update the hash value by applying the (index, old_x, new_x) substitutions at once.
+        """
+        subs = list(subs)
+        if not subs:
+            return old_h
+        n = max(index for index, _, _ in subs) + 1
+        hs = []
+        for k, (m, h) in enumerate(zip(self._moduli, self._split(old_h))):
+            powers = self.powers(n, k)
+            delta = sum((new_x - old_x) * powers[index] for index, old_x, new_x in subs)
+            hs.append((h + delta) % m)  # Python's % is always non-negative
+        return self._combine(hs)
 
 
 class DisjointSetUnion:
+    """
+    Union-find over arbitrary integer ids (e.g. wires).
+    Ids are remapped to dense indices on first sight and the forest lives in flat arrays: union by size,
+    iterative path compression. The representative returned by find() is still the smallest id of the set.
+    """
+    _index: dict[int, int]  # id -> dense index
+    _ids: array             # dense index -> id
+    _parent: array          # dense index -> dense index of the parent
+    _size: array            # set size, valid at roots
+    _least: array           # smallest id of the set, valid at roots
+    _flat: bool             # every index points directly at its root
+
     def __init__(self):
-        self._parents: dict[int, int] = {}
+        self._index = {}
+        self._ids = array("q")
+        self._parent = array("q")
+        self._size = array("q")
+        self._least = array("q")
+        self._flat = True
+
+    def __len__(self) -> int:
+        return len(self._ids)
 
     @property
     def parents(self) -> dict[int, int]:
-        return self._parents
+        """
+        Return {id: find(id)} for every id seen so far.
+        """
+        return dict(zip(self._ids, self.canonicalize(self._ids)))
+
+    def _add(self, x: int) -> int:
+        i = self._index.get(x)
+        if i is None:
+            i = self._index[x] = len(self._ids)
+            self._ids.append(x)
+            self._parent.append(i)
+            self._size.append(1)
+            self._least.append(x)
+        return i
+
+    def _root(self, i: int) -> int:
+        parent = self._parent
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:    # path compression
+            parent[i], i = root, parent[i]
+        return root
 
     def find(self, x: int) -> int:
-        if x not in self._parents:
-            self._parents[x] = x  # initialize parent to itself
-            return x
-        if self._parents[x] != x:
-            self._parents[x] = self.find(self._parents[x])  # path compression
-        return self._parents[x]
+        return self._least[self._root(self._add(x))]
 
     def union(self, x: int, y: int) -> bool:
-        xr, yr = self.find(x), self.find(y)
+        xr, yr = self._root(self._add(x)), self._root(self._add(y))
         if xr == yr:
             return False  # already in same set
 
-        # union
-        if xr < yr:
-            self._parents[yr] = xr  # choose the smaller as parent
+        # union by size, the smaller tree goes under the larger one
+        if self._size[xr] < self._size[yr]:
+            xr, yr = yr, xr
+        self._parent[yr] = xr
+        self._flat = False
+        self._size[xr] += self._size[yr]
+        self._least[xr] = min(self._least[xr], self._least[yr])
+
+        return True
+
+    def union_many(self, pairs: Iterable[tuple[int, int]]) -> int:
+        """
+        Union every (x, y) pair and return the number of merges.
+        """
+        index, add, parent, size, least = self._index, self._add, self._parent, self._size, self._least
+        merged = 0
+        for x, y in pairs:
+            # same as union(), with the lookups and root walks inlined
+            xr = index.get(x)
+            if xr is None:
+                xr = add(x)
+            while parent[xr] != xr:
+                parent[xr] = xr = parent[parent[xr]]    # path halving
+            yr = index.get(y)
+            if yr is None:
+                yr = add(y)
+            while parent[yr] != yr:
+                parent[yr] = yr = parent[parent[yr]]
+            if xr == yr:
+                continue
+            if size[xr] < size[yr]:
+                xr, yr = yr, xr
+            parent[yr] = xr
+            size[xr] += size[yr]
+            if least[yr] < least[xr]:
+                least[xr] = least[yr]
+            merged += 1
+        if merged:
+            self._flat = False
+        return merged
+
+    def _flatten(self):
+        """
+        Point every index directly at its root.
+        """
+        if self._flat:
+            return
+        if np is None:
+            for i in range(len(self._parent)):
+                self._root(i)
+        else:
+            parent = np.frombuffer(self._parent, dtype=np.int64)
+            while True:     # pointer jumping
+                grand = parent[parent]
+                if np.array_equal(grand, parent):
+                    break
+                parent[:] = grand
+        self._flat = True
+
+    def canonicalize(self, ids: Iterable[int]) -> list[int]:
+        """
+        Return find(x) for each x, leaving ids never seen unchanged (and unregistered).
+        """
+        self._flatten()
+        index, parent, least = self._index, self._parent, self._least
+        return [x if (i := index.get(x)) is None else least[parent[i]] for x in ids]
+
+    def mapping(self) -> Iterator[tuple[int, int]]:
+        """
+        Yield the (id, find(id)) pairs of the ids that are not their own representative.
+        """
+        self._flatten()
+        if np is None:
+            parent, least = self._parent, self._least
+            return ((x, least[parent[i]]) for i, x in enumerate(self._ids) if least[parent[i]] != x)
+        ids = np.frombuffer(self._ids, dtype=np.int64)
+        roots = np.frombuffer(self._least, dtype=np.int64)[np.frombuffer(self._parent, dtype=np.int64)]
+        changed = roots != ids
+        return zip(ids[changed].tolist(), roots[changed].tolist())
+
+    def to_sql(self, conn: sqlite3.Connection, table: str, columns: tuple[str, str] = ("id", "root")) -> int:
+        """
+        Stream mapping() into table (e.g. a temp table the caller then joins against) and return the row count.
+        """
+        cur = conn.executemany(f"INSERT INTO {table} ({columns[0]}, {columns[1]}) VALUES (?, ?)", self.mapping())
+        return cur.rowcount
+
+
+class InternCache:
+    """
+    Bounded map from wirevec contents (a tuple of wires) to wirevec id, evicting the least recently used entries
+    once the estimated memory use exceeds max_bytes. A reverse index from wire (and from id) to entry lets merges
+    drop or redirect just the entries they affect (see discard_wires() and remap()).
+    """
+    _ENTRY_BYTES = 200      # rough cost of an entry: the dict slots and the tuple header...
+    _MEMBER_BYTES = 80      # ... plus, per member, its tuple slot, int object and reverse index slot
+
+    _max_bytes: int
+    _bytes: int
+    _entries: OrderedDict[tuple[int, ...], int]
+    _by_wire: dict[int, set[tuple[int, ...]]]
+    _by_id: dict[int, tuple[int, ...]]
+    hits: int
+    misses: int
+
+    def __init__(self, max_bytes: int = 64 << 20):
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._by_wire = {}
+        self._by_id = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: tuple[int, ...]) -> int | None:
+        id = self._entries.get(key)
+        if id is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return id
+
+    def put(self, key: tuple[int, ...], id: int):
+        if key in self._entries:
+            self._pop(key)
+        self._entries[key] = id
+        old = self._by_id.get(id)
+        if old is not None:     # the members of id changed without discard_wires(), forget the stale entry
+            self._pop(old)
+        self._by_id[id] = key
+        for w in set(key):
+            self._by_wire.setdefault(w, set()).add(key)
+        self._bytes += self._ENTRY_BYTES + self._MEMBER_BYTES * len(key)
+        while self._bytes > self._max_bytes and self._entries:
+            self._pop(next(iter(self._entries)))
+
+    def _pop(self, key: tuple[int, ...]):
+        id = self._entries.pop(key)
+        if self._by_id.get(id) == key:
+            del self._by_id[id]
+        for w in set(key):
+            keys = self._by_wire[w]
+            keys.discard(key)
+            if not keys:
+                del self._by_wire[w]
+        self._bytes -= self._ENTRY_BYTES + self._MEMBER_BYTES * len(key)
+
+    def discard_wires(self, wires: Iterable[int]) -> int:
+        """
+        Drop the entries containing any of wires, e.g. the wires merged into another one. Return how many were dropped.
+        """
+        dropped = 0
+        for w in wires:
+            for key in list(self._by_wire.get(w, ())):
+                self._pop(key)
+                dropped += 1
+        return dropped
+
+    def remap(self, pairs: Iterable[tuple[int, int]]):
+        """
+        Redirect the entries of each id to root, for (id, root) pairs of wirevecs with the same members.
+        """
+        for id, root in pairs:
+            key = self._by_id.pop(id, None)
+            if key is not None:
+                self._entries[key] = root
+                self._by_id[root] = key
+
+    def clear(self):
+        self._entries.clear()
+        self._by_wire.clear()
+        self._by_id.clear()
+        self._bytes = 0
+
+
+class Progress:
+    """
+    Throughput report for a long loop, e.g. Progress("cells", total=n): update() once per item, close() at the end.
+    The report is rewritten in place (one line per report when file is not a terminal) at most every interval seconds.
+    With tell (and size), the bytes consumed so far, e.g. JsonStream.tell, are reported as well.
+    """
+    _unit: str
+    _total: int | None
+    _size: int | None
+    _tell: Callable[[], int] | None
+    _interval: float
+    _file: TextIO
+    _count: int
+    _start: float
+    _last: float
+
+    def __init__(
+        self,
+        unit: str,
+        total: int | None = None,
+        size: int | None = None,
+        tell: Callable[[], int] | None = None,
+        interval: float = 1.0,
+        file: TextIO | None = None
+    ):
+        self._unit = unit
+        self._total = total
+        self._size = size
+        self._tell = tell
+        self._interval = interval
+        self._file = sys.stdout if file is None else file
+        self._count = 0
+        self._start = self._last = time.monotonic()
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def update(self, n: int = 1):
+        self._count += n
+        now = time.monotonic()
+        if now - self._last >= self._interval:
+            self._last = now
+            self._report(now)
+
+    def _report(self, now: float, end: str = ""):
+        elapsed = max(now - self._start, 1e-9)
+        total = "" if self._total is None else f"/{self._total}"
+        line = f"Processed {self._count}{total} {self._unit} ({self._count / elapsed:.0f} {self._unit}/s"
+        if self._tell is not None:
+            mib = self._tell() / 2**20
+            size = "" if self._size is None else f"/{self._size / 2**20:.1f}"
+            line += f", {mib:.1f}{size} MiB at {mib / elapsed:.1f} MiB/s"
+        line += f", {elapsed:.1f}s)"
+        if self._file.isatty():
+            self._file.write(f"\r{line}\033[K{end}")
         else:
-            self._parents[xr] = yr
+            self._file.write(line + "\n")
+        self._file.flush()
 
-        return True
\ No newline at end of file
+    def close(self):
+        self._report(time.monotonic(), end="\n")
@@ -0,0 +1,275 @@
+"""
+Streaming access to Yosys JSON netlists (write_json), for designs too large to json.load() at once.
+Only one cell is held in memory at a time: everything outside the selected module is skipped without being decoded,
+and write_module() emits the netlist of a NetlistDB back as it reads the cell tables.
+"""
+import itertools
+import json
+import re
+from typing import TYPE_CHECKING, Any, Iterator, TextIO
+
+if TYPE_CHECKING:
+    from .db import NetlistDB
+
+
+class JsonStream:
+    """
+    Incremental reader over a JSON text file: containers are walked key by key (iter_object()), while the values
+    of interest are decoded as a whole (read_value()) and the others are skipped (skip_value()).
+    """
+    _WS = re.compile(r"[ \t\n\r]*")
+    _SPECIAL = re.compile(r'["{}\[\]]')
+    _DELIMITERS = frozenset(" \t\n\r,:]}")   # what may follow a value
+    _STRING_END = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+    _decoder = json.JSONDecoder()
+
+    _f: TextIO
+    _chunk_size: int
+    _buf: str
+    _pos: int       # read position in _buf
+    _dropped: int   # characters dropped from the front of _buf so far
+    _eof: bool
+
+    def __init__(self, f: TextIO, chunk_size: int = 1 << 20):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._buf = ""
+        self._pos = 0
+        self._dropped = 0
+        self._eof = False
+
+    def tell(self) -> int:
+        """
+        Return the number of characters consumed so far (bytes, for the ASCII output of Yosys).
+        """
+        return self._dropped + self._pos
+
+    def _fill(self, size: int | None = None) -> bool:
+        """
+        Read one more chunk (of size characters, by default the chunk size), dropping the consumed part of the buffer.
+        Return False at end of file.
+        """
+        if self._eof:
+            return False
+        data = self._f.read(size or self._chunk_size)
+        if not data:
+            self._eof = True
+            return False
+        self._dropped += self._pos
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """
+        Skip whitespace and return the next character ("" at end of file) without consuming it.
+        """
+        while True:
+            self._pos = self._WS.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf) or not self._fill():
+                return self._buf[self._pos:self._pos + 1]
+
+    def _expect(self, c: str):
+        if self._peek() != c:
+            raise ValueError(f"Expected {c!r} at offset {self.tell()}")
+        self._pos += 1
+
+    def read_value(self) -> Any:
+        """
+        Decode the next value.
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                # every attempt decodes the value from its start: at least double the buffered part of it, so that
+                # a value spanning many chunks is decoded O(log n) times for O(n) work overall, not once per chunk
+                if self._fill(max(self._chunk_size, len(self._buf) - self._pos)):
+                    continue
+                raise
+            # a number may go on in the next chunk, even after a prefix that decodes on its own (1.5e|3)
+            if end < len(self._buf) and self._buf[end] in self._DELIMITERS or not self._fill():
+                self._pos = end
+                return value
+
+    def skip_value(self):
+        """
+        Skip the next value without decoding it.
+        """
+        c = self._peek()
+        if c not in ("{", "["):
+            self.read_value()
+            return
+        depth = 0
+        while True:
+            m = self._SPECIAL.search(self._buf, self._pos)
+            if m is None:
+                self._pos = len(self._buf)
+                if not self._fill():
+                    raise ValueError("Unexpected end of file")
+                continue
+            c = m.group()
+            self._pos = m.end()
+            if c == '"':
+                while (end := self._STRING_END.match(self._buf, self._pos)) is None:
+                    if not self._fill():   # the string goes on in the next chunk
+                        raise ValueError("Unterminated string")
+                self._pos = end.end()
+                continue
+            depth += 1 if c in "{[" else -1
+            if depth == 0:
+                return
+
+    def iter_object(self) -> Iterator[str]:
+        """
+        Walk the next value, which must be an object, yielding its keys.
+        The caller consumes each value (read_value(), skip_value() or iter_object()) before asking for the next key.
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self._expect(":")
+            yield key
+            c = self._peek()
+            self._pos += 1
+            if c == "}":
+                return
+            if c != ",":
+                raise ValueError(f"Expected ',' or '}}' at offset {self.tell() - 1}")
+
+
+def iter_module(stream: JsonStream, module: str | None = None) -> Iterator[tuple[str, str, Any]]:
+    """
+    Yield ("port", name, port) and ("cell", name, cell) for the given module (the first one if None) of a Yosys
+    JSON netlist, in file order: Yosys writes the ports before the cells.
+    """
+    for key in stream.iter_object():
+        if key != "modules":
+            stream.skip_value()
+            continue
+        for name in stream.iter_object():
+            if module is not None and name != module:
+                stream.skip_value()
+                continue
+            for section in stream.iter_object():
+                if section == "ports":
+                    for port in stream.iter_object():
+                        yield ("port", port, stream.read_value())
+                elif section == "cells":
+                    for cell in stream.iter_object():
+                        yield ("cell", cell, stream.read_value())
+                else:
+                    stream.skip_value()
+            return  # the rest of the file is not needed
+    raise KeyError(f"Module {module} not found" if module is not None else "No module found")
+
+
+# word-level types whose signedness is folded into the type by NetlistDB ($addu, $adds, ...)
+_SIGNED_TYPES = {"$and", "$or", "$xor", "$add", "$sub", "$mul", "$mod"}
+
+
+def _param(value: int) -> str:
+    return format(value, "032b")
+
+
+def _bits(wires: list[int]) -> list[int | str]:
+    """
+    Undo NetlistDB.bit_to_int(): 0, 1 and -1 are the constants "0", "1" and "x".
+    """
+    return [w if w > 1 else "x" if w == -1 else str(w) for w in wires]
+
+
+def _cell(type_: str, params: dict[str, Any], directions: dict[str, str], conns: dict[str, list[int | str]]) -> dict[str, Any]:
+    return {
+        "hide_name": 1, "type": type_, "parameters": params, "attributes": {},
+        "port_directions": directions, "connections": conns
+    }
+
+
+def _iter_cells(db: "NetlistDB", chunk_size: int) -> Iterator[tuple[str | None, dict[str, Any]]]:
+    """
+    Yield the cells of db as (name, Yosys cell), reading chunk_size rows at a time.
+    Only blackbox instances have a name, the other cells are anonymous (None).
+    """
+    members = db._members_sql
+    decode = db._decode_members
+
+    def rows(sql: str) -> Iterator[tuple]:
+        cur = db.execute(sql)
+        while chunk := cur.fetchmany(chunk_size):
+            yield from chunk
+
+    for type_, a, b, y in rows(f"SELECT type, {members('a')}, {members('b')}, {members('y')} FROM aby_cells"):
+        a, b, y = decode(a), decode(b), decode(y)
+        signed = 0
+        if type_[:-1] in _SIGNED_TYPES:
+            type_, signed = type_[:-1], int(type_[-1] == "s")
+        params = {"A_SIGNED": _param(signed), "A_WIDTH": _param(len(a)), "B_SIGNED": _param(signed), "B_WIDTH": _param(len(b)), "Y_WIDTH": _param(len(y))}
+        yield None, _cell(type_, params, {"A": "input", "B": "input", "Y": "output"}, {"A": _bits(a), "B": _bits(b), "Y": _bits(y)})
+    for type_, a, y in rows(f"SELECT type, {members('a')}, {members('y')} FROM ay_cells"):
+        a, y = decode(a), decode(y)
+        params = {"A_SIGNED": _param(0), "A_WIDTH": _param(len(a)), "Y_WIDTH": _param(len(y))}
+        yield None, _cell(type_, params, {"A": "input", "Y": "output"}, {"A": _bits(a), "Y": _bits(y)})
+    for type_, a, b, s, y in rows(f"SELECT type, {members('a')}, {members('b')}, {members('s')}, {members('y')} FROM absy_cells"):
+        a, b, s, y = decode(a), decode(b), decode(s), decode(y)
+        yield None, _cell(
+            type_, {"WIDTH": _param(len(y))}, {"A": "input", "B": "input", "S": "input", "Y": "output"},
+            {"A": _bits(a), "B": _bits(b), "S": _bits(s), "Y": _bits(y)}
+        )
+    for d, q in rows(f"SELECT {members('d')}, {members('q')} FROM dffs"):
+        if db._clk is None:
+            raise ValueError("Global clock is not defined")
+        d, q = decode(d), decode(q)
+        yield None, _cell(
+            "$dff", {"CLK_POLARITY": _param(1), "WIDTH": _param(len(q))}, {"CLK": "input", "D": "input", "Q": "output"},
+            {"CLK": _bits([db._clk]), "D": _bits(d), "Q": _bits(q)}
+        )
+    ports = rows(f"""
+        SELECT i.name, i.module, i.params, p.port, p.direction, {members('p.signal')}
+        FROM instances AS i LEFT JOIN instance_ports AS p ON p.instance = i.name
+        ORDER BY i.name
+    """)
+    for name, group in itertools.groupby(ports, key=lambda row: row[0]):
+        group = list(group)
+        _, module, params, *_ = group[0]
+        signals = [(port, direction, decode(signal)) for _, _, _, port, direction, signal in group if port is not None]
+        cell = _cell(
+            module, json.loads(params), {port: direction for port, direction, _ in signals if direction is not None},
+            {port: _bits(signal) for port, _, signal in signals}
+        )
+        cell["attributes"]["module_not_derived"] = _param(1)
+        yield name, cell
+
+
+def write_module(db: "NetlistDB", f: TextIO, module: str = "top", chunk_size: int = 10000):
+    """
+    Write the netlist of db to f as a Yosys JSON netlist (read_json) with a single module, streaming the cells.
+    Every cell row becomes one cell: this is a proper netlist when each e-class has a single e-node (e.g. right after
+    build_from_json()), otherwise the wires of an e-class get several drivers.
+    """
+    f.write(f'{{\n  "creator": "emap",\n  "modules": {{\n    {json.dumps(module)}: {{\n      "ports": {{')
+    members = db._members_sql
+    ports = db.execute(f"""
+        SELECT name, 'input', {members('source')} FROM from_inputs
+        UNION ALL
+        SELECT name, 'output', {members('sink')} FROM as_outputs
+    """).fetchall()     # one row per module port
+    sep = "\n        "
+    for name, direction, bits in ports:
+        f.write(f"{sep}{json.dumps(name)}: {json.dumps({'direction': direction, 'bits': _bits(db._decode_members(bits))})}")
+        sep = ",\n        "
+    f.write('\n      },\n      "cells": {')
+    sep = "\n        "
+    for i, (name, cell) in enumerate(_iter_cells(db, chunk_size)):
+        f.write(f"{sep}{json.dumps(f'$emap${i}' if name is None else name)}: {json.dumps(cell)}")
+        sep = ",\n        "
+    f.write('\n      },\n      "netnames": {')
+    sep = "\n        "
+    for name, _, bits in ports:
+        f.write(f"{sep}{json.dumps(name)}: {json.dumps({'hide_name': 0, 'bits': _bits(db._decode_members(bits)), 'attributes': {}})}")
+        sep = ",\n        "
+    f.write("\n      }\n    }\n  }\n}\n")
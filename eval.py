@@ -1,13 +1,14 @@
 import emap
 import emap.rewrites as rewrites
+from emap.extract import extract
 import json
 
 TESTS_PATH = "../tests/designs/systolic"
 netlist = emap.NetlistDB("emap/schema.sql")
 import time
 start = time.time()
-with open(f"{TESTS_PATH}/systolic.json", "r") as f:
-    netlist.build_from_json(json.load(f)["modules"]["systolic"])
+# parsed as it is loaded, the JSON never has to fit in memory
+netlist.build_from_file(f"{TESTS_PATH}/systolic.json", "systolic")
 print(f"Built netlist in {time.time() - start:.2f} seconds")
 
 # netlist = emap.NetlistDB("emap/schema.sql")
@@ -19,25 +20,20 @@ print(f"Built netlist in {time.time() - start:.2f} seconds")
 
 netlist.rebuild()
 
-cnt = 1
-while cnt > 0:
-    comm_matches = rewrites.ematch_comm(netlist, ["$adds", "$addu", "$muls", "$mulu"])
-    assoc_to_right_matches = rewrites.ematch_assoc_to_right(netlist, ["$adds", "$addu", "$muls", "$mulu"])
-    assoc_to_left_matches = rewrites.ematch_assoc_to_left(netlist, ["$adds", "$addu", "$muls", "$mulu"])
-    dff_forward_aby_cell_matches = rewrites.ematch_dff_forward_aby_cell(netlist, ["$adds", "$addu", "$muls", "$mulu"])
-
-    cnt = 0
-    cnt += rewrites.apply_comm(netlist, comm_matches)
-    cnt += rewrites.apply_assoc_to_right(netlist, assoc_to_right_matches)
-    cnt += rewrites.apply_assoc_to_left(netlist, assoc_to_left_matches)
-    cnt += rewrites.apply_dff_forward_aby_cell(netlist, dff_forward_aby_cell_matches)
-
-    if cnt > 0:
-        print(f"Applied {cnt} rewrites")
-    else:
-        print("No rewrites applied, stopping")
-    netlist.rebuild()
-    # print(netlist.dump_tables())
+types = ["$adds", "$addu", "$muls", "$mulu"]
+# the rules are applied inside SQLite (in_db=True), matches never come back to Python
+runner = emap.Runner(netlist, [
+    rewrites.rewrite("comm", rewrites.COMM, types, in_db=True),
+    rewrites.rewrite("assoc_to_right", rewrites.ASSOC_TO_RIGHT, types, in_db=True),
+    rewrites.rewrite("assoc_to_left", rewrites.ASSOC_TO_LEFT, types, in_db=True),
+    rewrites.rewrite("dff_forward_aby_cell", rewrites.DFF_FORWARD_ABY_CELL, types, in_db=True),
+], iter_limit=None, time_limit=3600)
+report = runner.run()
+for it in report.iterations:
+    print(f"Iteration {it.index}: applied {it.applied} rewrites, {it.enodes} e-nodes, {it.total_time:.2f} seconds")
+    for rule in it.rules:
+        print(f"  {rule.name}: {rule.matches} matches, {rule.applied} applied{' (banned)' if rule.banned else ''}")
+print(f"Stopped: {report.stop_reason.value} after {report.total_time:.2f} seconds")
 
 # with open("systolic.json", "w") as f:
 #     json.dump(netlist.dump_tables(), f, indent=2)
@@ -46,4 +42,8 @@ while cnt > 0:
 #     print("Rebuilt once")
 
 with open("systolic_out.json", "w") as f:
-    json.dump(netlist.dump_tables(), f, indent=2)
\ No newline at end of file
+    netlist.write_tables(f)    # streamed, dump_tables() would hold the whole e-graph in memory
+
+# the cheapest netlist in the saturated e-graph, back to Yosys
+with open("systolic_extracted.json", "w") as f:
+    extract(netlist).write_json(f, "systolic")
@@ -0,0 +1,56 @@
+import pathlib
+import sys
+from typing import Any, Callable
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+from emap import NetlistDB  # noqa: E402
+
+SCHEMA_FILE = str(pathlib.Path(__file__).parent.parent / "emap" / "schema.sql")
+
+
+@pytest.fixture(params=[False, True], ids=["rows", "packed"])
+def packed(request) -> bool:
+    return request.param
+
+
+@pytest.fixture
+def new_db(packed: bool) -> Callable[..., NetlistDB]:
+    """
+    Factory of NetlistDBs in the layout under test, closed at the end of the test.
+    """
+    dbs = []
+
+    def make(db_file: str = ":memory:", **kwargs) -> NetlistDB:
+        kwargs.setdefault("packed", packed)
+        db = NetlistDB(SCHEMA_FILE, db_file, **kwargs)
+        dbs.append(db)
+        return db
+
+    yield make
+    for db in dbs:
+        db.close()
+
+
+def netlist(db: NetlistDB) -> dict[str, list[tuple[Any, ...]]]:
+    """
+    The cells and ports of db with every wirevec spelled out as its tuple of wires: independent of the layout
+    and of the wirevec ids.
+    """
+    result = {}
+    tables = {table: (keys, refs) for table, (keys, refs) in db._CELL_TABLES.items()}
+    tables.update({table: (("name",), (ref,)) for table, ref in db._PORT_TABLES.items() if table != "instance_ports"})
+    for table, (keys, refs) in tables.items():
+        cols = ", ".join([f"t.{key}" for key in keys] + [db._members_sql(f"t.{ref}") for ref in refs])
+        result[table] = sorted(
+            tuple(row[:len(keys)]) + tuple(tuple(db._decode_members(m)) for m in row[len(keys):])
+            for row in db.execute(f"SELECT {cols} FROM {table} AS t")
+        )
+    return result
+
+
+@pytest.fixture
+def spelled() -> Callable[[NetlistDB], dict[str, list[tuple[Any, ...]]]]:
+    return netlist
@@ -0,0 +1,91 @@
+import json
+import sqlite3
+
+import pytest
+
+from emap import NetlistDB
+from emap.bench import generators
+
+
+def test_bulk_load_in_batch(new_db, spelled):
+    mod = generators.systolic(4)
+    ref = new_db()
+    ref._add_input("extra", [1000, 1001])
+    ref.build_from_json(mod, bulk=True, progress=False)
+    db = new_db()
+    with db.batch():
+        db._add_input("extra", [1000, 1001])
+        db.build_from_json(mod, bulk=True, progress=False)
+        assert db.in_transaction
+    assert not db.in_transaction
+    assert spelled(db) == spelled(ref)
+
+
+def test_build_from_file_in_batch(new_db, spelled, tmp_path):
+    mod = generators.random_dag(64)
+    path = tmp_path / "design.json"
+    path.write_text(json.dumps({"modules": {"top": mod}}))
+    ref = new_db()
+    ref.build_from_json(mod, bulk=True, progress=False)
+    db = new_db()
+    with db.batch():
+        db.build_from_file(str(path), progress=False)
+    assert spelled(db) == spelled(ref)
+
+
+def test_failed_bulk_load_keeps_the_batch(new_db):
+    bad = generators.adder_tree(4)
+    next(iter(bad["cells"].values()))["type"] = "$unknown"
+    db = new_db()
+    with db.batch():
+        db._add_input("kept", [1000, 1001])
+        with pytest.raises(ValueError):
+            db.build_from_json(bad, bulk=True, progress=False)
+    assert db.execute("SELECT name FROM from_inputs").fetchall() == [("kept",)]
+    assert db.count_enodes() == 0
+
+
+def test_batch_rolls_back(new_db):
+    db = new_db()
+    with pytest.raises(KeyError):
+        with db.batch():
+            db.build_from_json(generators.adder_tree(4), progress=False)
+            with db.batch():    # nested blocks share the outer transaction
+                db._add_input("more", [1000])
+            raise KeyError
+    assert not db.in_transaction
+    assert db.count_enodes() == 0
+    assert db.execute("SELECT COUNT(*) FROM wirevecs").fetchone()[0] == 0
+
+
+def test_batch_commits_once(new_db, tmp_path):
+    path = str(tmp_path / "batch.db")
+    db = new_db(path)
+    other = sqlite3.connect(path)
+    with db.batch():
+        db.build_from_json(generators.adder_tree(8), progress=False)
+        assert other.execute("SELECT COUNT(*) FROM aby_cells").fetchone()[0] == 0
+        with pytest.raises(RuntimeError):
+            db.checkpoint(str(tmp_path / "checkpoint.db"))
+        with pytest.raises(RuntimeError):
+            db.open_reader()
+    assert other.execute("SELECT COUNT(*) FROM aby_cells").fetchone()[0] == db.count_enodes() > 0
+    other.close()
+
+
+@pytest.mark.parametrize("profile", ["bulk", "durable"])
+def test_profiles(new_db, spelled, tmp_path, profile):
+    mod = generators.mac_chain(4)
+    db = new_db(str(tmp_path / f"{profile}.db"), profile=profile)
+    levels = {"OFF": 0, "NORMAL": 1, "FULL": 2, "MEMORY": 2}    # synchronous and temp_store read back as numbers
+    for pragma, value in NetlistDB.PROFILES[profile].items():
+        actual = db.execute(f"PRAGMA {pragma}").fetchone()[0]
+        if pragma in ("synchronous", "temp_store"):
+            value = levels[value]
+        assert str(actual).lower() == str(value).lower()
+    db.build_from_json(mod, progress=False)
+    ref = new_db()
+    ref.build_from_json(mod, progress=False)
+    assert spelled(db) == spelled(ref)
+    with pytest.raises(ValueError):
+        new_db(profile="fast")
@@ -0,0 +1,34 @@
+import pytest
+
+from emap import bench
+from emap.bench import generators
+
+
+@pytest.mark.parametrize("generator", list(generators.GENERATORS))
+def test_generators(new_db, generator):
+    mod = generators.GENERATORS[generator](8, 4, seed=1)
+    assert mod == generators.GENERATORS[generator](8, 4, seed=1)    # deterministic
+    db = new_db()
+    db.build_from_json(mod, bulk=True, progress=False)
+    assert db.count_enodes() == len(mod["cells"])
+    assert generators.GENERATORS[generator](16, 4)["cells"].keys() > mod["cells"].keys()     # grows with size
+
+
+def test_run_case():
+    case = bench.run_case("mac_chain", 4, width=4, iters=2, cpp=False)
+    assert case["cells"] == 12
+    assert case["enodes"] == 12
+    assert {"comm", "pattern:comm"} <= case["rules"].keys()
+    assert case["rules"]["comm"]["matches"] == case["rules"]["pattern:comm"]["matches"] > 0
+    assert case["saturation"]["iterations"] <= 2
+
+
+def test_scaling_and_compare():
+    cases = [bench.run_case("adder_tree", size, width=4, iters=1, cpp=False) for size in (4, 8)]
+    curves = bench.scaling(cases)
+    assert [x for x, _ in curves["adder_tree"]["build"]["points"]] == [3, 7]
+    report = {"cases": cases}
+    assert bench.compare(report, report) == []
+    slower = {"cases": [{**case, "build": case["build"] * 10 + 1} for case in cases]}
+    regressions = bench.compare(slower, report, min_time=0.0)
+    assert len(regressions) == 2 and all("build" in line for line in regressions)
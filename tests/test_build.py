@@ -0,0 +1,64 @@
+import pytest
+
+from emap.bench import generators
+
+
+def _with_blackbox(size: int = 4, width: int = 8) -> dict:
+    """
+    An adder tree whose result goes through an instance of another module.
+    """
+    mod = generators.adder_tree(size, width)
+    y = mod["ports"]["y"]["bits"]
+    z = list(range(1000, 1000 + width))
+    mod["cells"]["sub"] = {"hide_name": 0, "type": "child", "parameters": {}, "attributes": {}, "connections": {"A": y, "Y": z}}
+    mod["ports"]["z"] = {"direction": "output", "bits": z}
+    return mod
+
+
+@pytest.mark.parametrize("generator", list(generators.GENERATORS))
+def test_bulk_build_matches_row_by_row(new_db, generator):
+    mod = generators.GENERATORS[generator](8)
+    rows, bulk = new_db(), new_db()
+    rows.build_from_json(mod, progress=False)
+    bulk.build_from_json(mod, bulk=True, progress=False)
+    assert bulk.dump_tables() == rows.dump_tables()
+
+
+def test_bulk_build_blackbox(new_db):
+    rows, bulk = new_db(), new_db()
+    rows.build_from_json(_with_blackbox(), progress=False, submodules=["child"])
+    bulk.build_from_json(_with_blackbox(), bulk=True, progress=False, submodules=["child"])
+    assert bulk.dump_tables() == rows.dump_tables()
+    assert len(bulk.dump_tables()["instance_ports"]) == 2
+
+
+def test_bulk_load_in_small_batches(new_db):
+    mod = generators.systolic(4)
+    whole, batched = new_db(), new_db()
+    whole._bulk_load(whole._iter_netlist(mod, progress=False))
+    batched._bulk_load(batched._iter_netlist(mod, progress=False), batch_size=3)
+    assert batched.dump_tables() == whole.dump_tables()
+
+
+def test_bulk_build_interns_existing_wirevecs(new_db):
+    # a second module reading signals of the first reuses their wirevecs, as the row-by-row path does
+    first = generators.adder_tree(4)
+    a, b, y = first["ports"]["y"]["bits"], first["ports"]["x0"]["bits"], list(range(1000, 1016))
+    second = {
+        "ports": {"y2": {"direction": "output", "bits": y}},
+        "cells": {"add": {**first["cells"]["$cell0"], "connections": {"A": a, "B": b, "Y": y}}}
+    }
+    rows, bulk = new_db(), new_db()
+    for db, bulk_ in ((rows, False), (bulk, True)):
+        db.build_from_json(first, bulk=bulk_, progress=False)
+        db.build_from_json(second, bulk=bulk_, progress=False)
+    assert bulk.dump_tables() == rows.dump_tables()
+
+
+def test_bulk_build_restores_indexes(new_db):
+    db = new_db()
+    indexes = "SELECT name FROM sqlite_master WHERE type = 'index' ORDER BY name"
+    before = db.execute(indexes).fetchall()
+    db.build_from_json(generators.adder_tree(8), bulk=True, progress=False)
+    assert db.execute(indexes).fetchall() == before
+    assert not db.in_transaction
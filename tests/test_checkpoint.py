@@ -0,0 +1,53 @@
+import pytest
+
+from emap import NetlistDB, Runner
+from emap.bench import generators
+from emap.design import default_rules
+
+from conftest import SCHEMA_FILE, netlist
+
+
+def _built(new_db, db_file: str = ":memory:") -> NetlistDB:
+    db = new_db(db_file)
+    db.build_from_json(generators.adder_tree(16, 8), bulk=True, progress=False)
+    db.rebuild()
+    return db
+
+
+@pytest.mark.parametrize("in_memory", [False, True], ids=["file", "in_memory"])
+def test_resumed_run_matches_uninterrupted(new_db, tmp_path, packed, in_memory):
+    path = str(tmp_path / "checkpoint.db")
+    reference = _built(new_db)
+    whole = Runner(reference, default_rules(), iter_limit=6).run()
+
+    first = _built(new_db)
+    Runner(first, default_rules(), iter_limit=3, checkpoint_every=2, checkpoint_path=path).run()
+    first.close()
+    resumed = NetlistDB.open(path, SCHEMA_FILE, in_memory=in_memory)
+    try:
+        assert resumed.packed == packed
+        report = Runner(resumed, default_rules(), iter_limit=3).run()
+        assert [it.index for it in report.iterations] == [3, 4, 5]
+        assert [it.enodes for it in report.iterations] == [it.enodes for it in whole.iterations[3:]]
+        assert netlist(resumed) == netlist(reference)
+        assert resumed.get_meta("runner")["iteration"] == 6
+    finally:
+        resumed.close()
+
+
+def test_checkpoint_refuses_its_own_file(new_db, tmp_path):
+    db = _built(new_db, str(tmp_path / "db.db"))
+    with pytest.raises(ValueError):
+        db.checkpoint(str(tmp_path / "db.db"))
+
+
+def test_open_keeps_the_layout(new_db, tmp_path, packed):
+    path = str(tmp_path / "db.db")
+    db = _built(new_db, path)
+    cnt = db._cnt
+    db.close()
+    reopened = NetlistDB.open(path, SCHEMA_FILE)
+    assert (reopened.packed, reopened._cnt) == (packed, cnt)
+    reopened.close()
+    with pytest.raises(ValueError):
+        NetlistDB(SCHEMA_FILE, path, packed=not packed).close()
@@ -0,0 +1,58 @@
+from emap import Runner
+from emap.bench import generators
+from emap.design import default_rules
+
+
+def _live(netlist: dict) -> dict:
+    """
+    The cells of a spelled netlist (see conftest.netlist()) that the outputs depend on, walking back from the outputs.
+    """
+    live = {sink for _, sink in netlist["as_outputs"]} | {source for _, source in netlist["from_inputs"]}
+    result = {table: set() for table in netlist}
+    changed = True
+    while changed:
+        changed = False
+        for table in ("ay_cells", "aby_cells", "absy_cells", "dffs"):
+            for cell in netlist[table]:
+                if cell[-1] in live and cell not in result[table]:
+                    result[table].add(cell)
+                    live.update(ref for ref in cell if isinstance(ref, tuple))
+                    changed = True
+    return {table: sorted(cells) for table, cells in result.items() if table in ("ay_cells", "aby_cells", "absy_cells", "dffs")}
+
+
+def test_compact_keeps_the_live_netlist(new_db, spelled):
+    db = new_db()
+    db.build_from_json(generators.random_dag(64), bulk=True, progress=False)
+    db.rebuild()
+    before = spelled(db)
+    removed = db.compact(vacuum=False)
+    assert sum(removed.values()) > 0
+    after = spelled(db)
+    assert _live(before) == {table: after[table] for table in _live(before)}
+    assert after["as_outputs"] == before["as_outputs"]
+    assert after["from_inputs"] == before["from_inputs"]
+    assert sum(db.compact(vacuum=False).values()) == 0
+
+
+def test_compact_renumbers(new_db, spelled):
+    db = new_db()
+    db.build_from_json(generators.random_dag(64), bulk=True, progress=False)
+    db.rebuild()
+    db.compact(vacuum=False)
+    before = spelled(db)
+    db.compact(renumber=True)
+    ids = [id for (id,) in db.execute("SELECT id FROM wirevecs ORDER BY id")]
+    assert ids == list(range(1, len(ids) + 1))
+    assert spelled(db) == before
+    # new wirevecs continue after the renumbered ones
+    assert db._add_wirevec([db.auto_id]) == len(ids) + 1
+
+
+def test_runner_compacts(new_db):
+    db = new_db()
+    db.build_from_json(generators.random_dag(64), bulk=True, progress=False)
+    db.rebuild()
+    report = Runner(db, default_rules(), iter_limit=2, compact_every=1).run()
+    assert report.iterations[0].swept > 0
+    assert sum(db.compact(vacuum=False).values()) == 0
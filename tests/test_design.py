@@ -0,0 +1,54 @@
+import json
+from contextlib import closing
+
+from emap.bench import generators
+from emap.design import module_digest, optimize
+
+
+def _design(width: int = 8) -> dict:
+    """
+    A top module instantiating two identical leaves (up to names and attributes) that sum four inputs.
+    """
+    leaf = generators.adder_tree(4, width)
+    copy = json.loads(json.dumps(leaf))
+    copy["cells"] = {f"renamed{i}": {**cell, "attributes": {"src": "leaf_b.v:1"}} for i, cell in enumerate(leaf["cells"].values())}
+    top = generators._Module()
+    xs = [top.input(f"x{i}", width) for i in range(4)]
+    for name in ("leaf_a", "leaf_b"):
+        y = top.bits(width)
+        top.cells[f"u_{name}"] = {
+            "hide_name": 0, "type": name, "parameters": {}, "attributes": {},
+            "connections": {**{f"x{i}": x for i, x in enumerate(xs)}, "y": y}
+        }
+        top.output(f"y_{name}", y)
+    return {"modules": {"top": top.to_json(), "leaf_a": leaf, "leaf_b": copy}}
+
+
+def test_module_digest_ignores_names():
+    design = _design()["modules"]
+    assert module_digest(design["leaf_a"]) == module_digest(design["leaf_b"])
+    assert module_digest(design["leaf_a"]) != module_digest(design["top"])
+
+
+def test_optimize(tmp_path):
+    design = _design()
+    path = tmp_path / "design.json"
+    path.write_text(json.dumps(design))
+    result = optimize(str(path), str(tmp_path / "out"), workers=2, iter_limit=2)
+    leaf_a, leaf_b, top = (result.modules[name] for name in ("leaf_a", "leaf_b", "top"))
+    assert leaf_a.db_file == leaf_b.db_file      # identical modules are optimized once
+    assert (leaf_a.name, leaf_b.name) == ("leaf_a", "leaf_b")
+    assert leaf_a.enodes > leaf_a.cells
+    assert result.tops() == ["top"]
+    assert sorted(top.instances) == [("u_leaf_a", "leaf_a"), ("u_leaf_b", "leaf_b")]
+    with closing(result.index()) as conn:
+        assert sorted(conn.execute("SELECT instance, module FROM hierarchy WHERE parent = 'top'")) == sorted(top.instances)
+        assert conn.execute("SELECT COUNT(DISTINCT db_file) FROM modules").fetchone()[0] == 2
+    db = result.open("leaf_b")
+    assert db.count_enodes() == leaf_b.enodes
+    assert db.packed
+    db.close()
+    # the parsed design gives the same modules
+    again = optimize(design, str(tmp_path / "again"), workers=1, iter_limit=2)
+    assert {name: (r.digest, r.enodes) for name, r in again.modules.items()} == \
+        {name: (r.digest, r.enodes) for name, r in result.modules.items()}
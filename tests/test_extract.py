@@ -0,0 +1,92 @@
+import io
+import json
+
+import pytest
+
+from emap import Runner
+from emap.bench import generators
+from emap.design import default_rules
+
+pytest.importorskip("numpy")
+from emap.extract import AREA, DELAY, extract  # noqa: E402
+
+
+def _drivers(mod: dict) -> list:
+    """
+    The output bits of every cell of a Yosys JSON module.
+    """
+    return [
+        bit for cell in mod["cells"].values()
+        for port, bits in cell["connections"].items() if port in ("Y", "Q") for bit in bits
+    ]
+
+
+def _cell_widths(db) -> list:
+    """
+    The (type, output width) of every cell of db.
+    """
+    outputs = {table: (("c.type" if keys else "'$dff'"), refs[-1]) for table, (keys, refs) in db._CELL_TABLES.items()}
+    return [
+        row for table, (type_, y) in outputs.items()
+        for row in db.execute(f"SELECT {type_}, w.width FROM {table} AS c JOIN wirevecs AS w ON w.id = c.{y}")
+    ]
+
+
+@pytest.mark.parametrize("generator", ["systolic", "random_dag"])
+def test_extract_round_trip(new_db, spelled, generator):
+    db = new_db()
+    db.build_from_json(generators.GENERATORS[generator](16), bulk=True, progress=False)
+    db.rebuild()
+    f = io.StringIO()
+    extract(db).write_json(f, "top")
+    mod = json.loads(f.getvalue())["modules"]["top"]
+    assert len(_drivers(mod)) == len(set(_drivers(mod)))
+    copy = new_db(packed=False)
+    copy.build_from_json(mod, bulk=True, progress=False)
+    db.compact(vacuum=False)    # extraction keeps what the outputs need
+    assert spelled(copy) == spelled(db)     # nothing to choose before saturation: the netlist itself
+
+
+@pytest.mark.parametrize("model", [AREA, DELAY], ids=["area", "delay"])
+def test_extract_saturated_is_a_netlist(new_db, model):
+    db = new_db()
+    db.build_from_json(generators.mac_chain(6), bulk=True, progress=False)
+    db.rebuild()
+    Runner(db, default_rules(), iter_limit=3).run()
+    f = io.StringIO()
+    extract(db, model).write_json(f, "top")
+    mod = json.loads(f.getvalue())["modules"]["top"]
+    drivers = _drivers(mod)
+    assert len(drivers) == len(set(drivers))
+    outputs = {bit for port in mod["ports"].values() if port["direction"] == "output" for bit in port["bits"]}
+    assert outputs <= set(drivers)
+
+
+def test_extract_in_batch(new_db):
+    db = new_db()
+    with pytest.raises(KeyError):
+        with db.batch():
+            db.build_from_json(generators.adder_tree(8), progress=False)
+            db.rebuild()
+            extraction = extract(db)
+            extraction.to_db().close()
+            assert db.in_transaction    # neither committed the batch
+            raise KeyError
+    assert db.count_enodes() == 0
+
+
+@pytest.mark.parametrize("model", [AREA, DELAY], ids=["area", "delay"])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_extract_never_worsens(new_db, model, seed):
+    db = new_db()
+    db.build_from_json(generators.random_dag(64, seed=seed), bulk=True, progress=False)
+    db.rebuild()
+    db.compact(vacuum=False)
+    before = extract(db, model).cost
+    Runner(db, default_rules(), iter_limit=4).run()
+    extraction = extract(db, model)
+    assert extraction.cost <= before
+    if model is AREA:
+        # the cost reported is the area of the netlist written
+        assert sum(model.cost(t, w) for t, w in _cell_widths(extraction.to_db())) == pytest.approx(extraction.cost)
+
@@ -0,0 +1,44 @@
+import pytest
+
+from emap import NetlistDB, Runner
+from emap.bench import generators
+from emap.design import default_rules
+
+from conftest import SCHEMA_FILE, netlist
+
+
+def test_pack_round_trip():
+    wires = [2, 3, 1 << 30, 7]
+    view = NetlistDB.unpack_wirevec(NetlistDB.pack_wirevec(wires))
+    assert view.tolist() == wires
+    assert view.readonly
+
+
+@pytest.mark.parametrize("generator", ["systolic", "random_dag"])
+def test_packed_matches_rows(generator):
+    results = []
+    for packed in (False, True):
+        db = NetlistDB(SCHEMA_FILE, packed=packed)
+        db.build_from_json(generators.GENERATORS[generator](6), bulk=True, progress=False)
+        db.rebuild()
+        Runner(db, default_rules(), iter_limit=3).run()
+        results.append((netlist(db), db.count_enodes(), db.execute("SELECT id, hash, width FROM wirevecs ORDER BY id").fetchall()))
+        db.close()
+    assert results[0] == results[1]
+
+
+def test_packed_matches_rows_through_extract():
+    pytest.importorskip("numpy")
+    from emap.extract import extract
+    results = []
+    for packed in (False, True):
+        db = NetlistDB(SCHEMA_FILE, packed=packed)
+        db.build_from_json(generators.mac_chain(6), bulk=True, progress=False)
+        db.rebuild()
+        Runner(db, default_rules(), iter_limit=3).run()
+        extraction = extract(db)
+        out = extraction.to_db(packed=False)
+        results.append((extraction.cost, netlist(out)))
+        out.close()
+        db.close()
+    assert results[0] == results[1]
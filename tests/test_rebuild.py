@@ -0,0 +1,80 @@
+import pytest
+
+from emap import rewrites
+from emap.bench import generators
+
+TYPES = ["$adds", "$addu", "$muls", "$mulu"]
+
+
+def _congruent(width: int = 8) -> dict:
+    """
+    Two copies of x * (x + y): the adders are congruent, and so are the multipliers once the adders are merged.
+    """
+    m = generators._Module()
+    x, y = m.input("x", width), m.input("y", width)
+    for i in range(2):
+        s = m.cell("$add", width, A=x, B=y)
+        m.output(f"t{i}", m.cell("$mul", width, A=s, B=x))
+    return m.to_json()
+
+
+@pytest.mark.parametrize("full", [False, True], ids=["incremental", "full"])
+def test_rebuild_merges_congruent_cells(new_db, full):
+    db = new_db()
+    db.build_from_json(_congruent(), progress=False)
+    assert db.count_enodes() == 4
+    assert db.rebuild(full) >= 1
+    assert db.count_enodes() == 2
+    (t0,), (t1,) = db.execute("SELECT sink FROM as_outputs ORDER BY name")
+    assert t0 == t1
+    # every reference is to a live wirevec
+    for table, refs in db._wirevec_refs():
+        for ref in refs:
+            assert not db.execute(f"SELECT 1 FROM {table} WHERE {ref} NOT IN (SELECT id FROM wirevecs)").fetchall()
+    assert db.rebuild(full) == 0
+
+
+def test_merge_wires_probes_by_wire(new_db):
+    """
+    The wire merging statements look up the merged wires through an index, never scanning the references to all wires.
+    """
+    db = new_db()
+    db.build_from_json(_congruent(), progress=False)
+    statements = []
+    db.set_trace_callback(statements.append)
+    db.rebuild()
+    db.set_trace_callback(None)
+    statements = [
+        sql for sql in statements
+        if "temp.wire_map" in sql and not sql.lstrip().startswith(("DELETE FROM temp.wire_map", "INSERT INTO temp.wire_map"))
+    ]
+    assert statements
+    for sql in statements:
+        for *_, detail in db.execute("EXPLAIN QUERY PLAN " + sql):
+            if detail.startswith("SCAN "):
+                # only the wire map itself and the derived tables built from it are scanned
+                assert detail.split()[1] in ("wm", "d"), (sql, detail)
+
+
+def _rewrite(db, rounds: int, full: bool):
+    patterns = [
+        rewrites.Pattern("comm", rewrites.COMM),
+        rewrites.Pattern("assoc_to_right", rewrites.ASSOC_TO_RIGHT),
+        rewrites.Pattern("assoc_to_left", rewrites.ASSOC_TO_LEFT),
+    ]
+    for _ in range(rounds):
+        for pattern in patterns:
+            pattern.apply(db, pattern.stage(db, TYPES))
+        db.rebuild(full)
+
+
+@pytest.mark.parametrize("generator", ["adder_tree", "systolic"])
+def test_incremental_rebuild_matches_full(new_db, generator):
+    incremental, full = new_db(), new_db()
+    for db, full_ in ((incremental, False), (full, True)):
+        db.build_from_json(generators.GENERATORS[generator](4), bulk=True, progress=False)
+        db.rebuild(full_)
+        _rewrite(db, 3, full_)
+    assert incremental.dump_tables() == full.dump_tables()
+    # a full scan finds nothing the incremental rebuild missed
+    assert incremental.rebuild(full=True) == 0
@@ -0,0 +1,203 @@
+import pytest
+
+from emap import Runner, rewrites
+from emap.bench import generators
+from emap.design import default_rules
+from emap.rewrites.pattern import Term, Var, parse
+from emap.runner import Rule
+
+TYPES = ["$adds", "$addu", "$muls", "$mulu"]
+
+
+def _saturate(db, rules: list[Rule], mod: dict, iter_limit: int = 3) -> tuple[int, int, int]:
+    """
+    Return the number of e-nodes before and after running rules on mod, and the number of e-classes after.
+    """
+    db.build_from_json(mod, bulk=True, progress=False)
+    db.rebuild()
+    before = db.count_enodes()
+    Runner(db, rules, iter_limit=iter_limit).run()
+    return before, db.count_enodes(), db.execute("SELECT COUNT(*) FROM wirevecs").fetchone()[0]
+
+
+def _registered_sums(size: int, width: int = 8) -> dict:
+    """
+    Sums of registered inputs, (dff x) + (dff y), which the retiming rule moves behind a register.
+    """
+    m = generators._Module()
+    m.input("clk", 1)
+    qs = [m.cell("$dff", width, D=m.input(f"x{i}", width)) for i in range(size)]
+    for i in range(size - 1):
+        m.output(f"y{i}", m.cell("$add", width, A=qs[i], B=qs[i + 1]))
+    return m.to_json()
+
+
+def test_parse():
+    assert parse("(?op (dff ?a) (add ?b ?c))") == Term(Var("op"), (Term("$dff", (Var("a"),)), Term("$add", (Var("b"), Var("c")))))
+    assert parse("?x") == Var("x")
+
+
+@pytest.mark.parametrize("src", [
+    "(?op ?a", "(?op ?a ?b))", "()", "(?op a ?b)", "(dff ?a ?b)", "(?op ?a ?b ?c ?d)", "",
+])
+def test_parse_errors(src):
+    with pytest.raises(ValueError):
+        parse(src)
+
+
+@pytest.mark.parametrize("src", [
+    "(?op ?a ?b)", "?a => (?op ?a ?a)", "(?op ?a ?b) => (?op ?a ?c)",
+])
+def test_pattern_errors(src):
+    with pytest.raises(ValueError):
+        rewrites.Pattern("bad", src)
+
+
+def test_unsuffixed_types_match_both_signednesses(new_db):
+    m = generators._Module()
+    x, y, z = m.input("x", 8), m.input("y", 8), m.input("z", 8)
+    for signed in ("0", "1"):
+        s = m.cell("$add", 8, A=y, B=z)
+        m.output(f"t{signed}", m.cell("$add", 8, A=x, B=s))
+        for cell in list(m.cells.values())[-2:]:
+            cell["parameters"].update(A_SIGNED=signed, B_SIGNED=signed)
+    m.output("mixed", m.cell("$add", 8, A=x, B=list(m.cells.values())[-2]["connections"]["Y"]))   # unsigned over signed
+    db = new_db()
+    db.build_from_json(m.to_json(), progress=False)
+    db.rebuild()
+    assoc = rewrites.Pattern("assoc_to_left", "(add ?a (add ?b ?c)) => (add (add ?a ?b) ?c)")
+    matches = list(assoc.ematch(db, TYPES))
+    assert sorted(type_ for _, type_, *_ in matches) == ["$adds", "$addu"]     # not the mixed pair
+    assert assoc.apply(db, matches) == 2
+    # each new pair of adders has the signedness of the pair it was matched with
+    outputs = dict(db.execute("SELECT name, sink FROM as_outputs"))
+    (z,), = db.execute("SELECT source FROM from_inputs WHERE name = 'z'")
+    for name, type_ in (("t0", "$addu"), ("t1", "$adds")):
+        (a,), = db.execute("SELECT a FROM aby_cells WHERE y = ? AND b = ? AND type = ?", (outputs[name], z, type_))
+        assert db.execute("SELECT 1 FROM aby_cells WHERE y = ? AND type = ?", (a, type_)).fetchone()
+    with pytest.raises(ValueError):
+        rewrites.Pattern("bad", "(?op ?a ?b) => (add ?a ?b)")
+
+
+@pytest.mark.parametrize("since", [None, 0], ids=["naive", "semi_naive"])
+def test_pattern_matches_legacy(new_db, since):
+    db = new_db()
+    db.build_from_json(generators.random_dag(32), bulk=True, progress=False)
+    db.rebuild()
+    if since is not None:
+        db.new_epoch()
+    for name, src in (("comm", rewrites.COMM), ("assoc_to_right", rewrites.ASSOC_TO_RIGHT)):
+        legacy = {(y, type_, *rest) for type_, *rest, y in getattr(rewrites, "ematch_" + name)(db, TYPES, since)}
+        assert legacy
+        assert set(rewrites.Pattern(name, src).ematch(db, TYPES, since)) == legacy
+
+
+def test_default_rules_apply_in_db():
+    assert all(rule.in_db for rule in default_rules())
+
+
+@pytest.mark.parametrize("name, src, mod", [
+    ("comm", rewrites.COMM, generators.adder_tree(8)),
+    ("assoc_to_right", rewrites.ASSOC_TO_RIGHT, generators.adder_tree(8)),
+    ("dff_forward_aby_cell", rewrites.DFF_FORWARD_ABY_CELL, _registered_sums(4)),
+], ids=["comm", "assoc_to_right", "dff_forward_aby_cell"])
+def test_in_db_rule_matches_legacy(new_db, name, src, mod):
+    legacy = Rule(getattr(rewrites, "ematch_" + name), getattr(rewrites, "apply_" + name), TYPES)
+    in_db = rewrites.rewrite(name, src, TYPES, in_db=True)
+    result = _saturate(new_db(), [in_db], mod)
+    assert result[1] > result[0]
+    assert result == _saturate(new_db(), [legacy], mod)
+
+
+def test_ledger_skips_applied_matches(new_db):
+    db = new_db()
+    db.build_from_json(generators.adder_tree(8), bulk=True, progress=False)
+    db.rebuild()
+    assoc = rewrites.Pattern("assoc_to_right", rewrites.ASSOC_TO_RIGHT)
+    matches = list(assoc.ematch(db, TYPES))
+    assert assoc.apply(db, matches) > 0
+    wirevecs = db.execute("SELECT COUNT(*) FROM wirevecs").fetchone()[0]
+    assert assoc.apply(db, matches) == 0
+    assert db.execute("SELECT COUNT(*) FROM wirevecs").fetchone()[0] == wirevecs     # no fresh wirevecs either
+    # the ledger follows the merges of rebuild(), so the applied matches are still recognized
+    db.rebuild()
+    found = set(assoc.ematch(db, TYPES))
+    done = set(db.execute(f"SELECT {assoc._key} FROM {assoc._ledger}"))
+    assert found & done
+    statements = []
+    db.set_trace_callback(statements.append)
+    assert len(assoc.stage(db, TYPES)) == len(found - done)
+    db.set_trace_callback(None)
+    # the ledger is probed by key, not read whole
+    sql, = (sql for sql in statements if assoc._ledger in sql)
+    plan = [detail for *_, detail in db.execute("EXPLAIN QUERY PLAN " + sql)]
+    assert any(detail.startswith("SEARCH l USING PRIMARY KEY") for detail in plan)
+    assert not any(detail.startswith("SCAN l") for detail in plan)
+
+
+def test_rules_sharing_a_name_keep_their_own_tables(new_db):
+    db = new_db()
+    db.build_from_json(generators.adder_tree(8), bulk=True, progress=False)
+    db.rebuild()
+    comm, assoc = rewrites.Pattern("r", rewrites.COMM), rewrites.Pattern("r", rewrites.ASSOC_TO_RIGHT)
+    assert comm._ledger != assoc._ledger
+    assert comm.apply(db, comm.stage(db, TYPES)) > 0
+    staged = assoc.stage(db, TYPES)
+    assert len(staged) == len(list(assoc.ematch(db, TYPES))) > 0    # nothing applied by comm is skipped
+    assert assoc.apply(db, staged) > 0
+
+
+@pytest.mark.parametrize("in_db", [False, True], ids=["fetched", "in_db"])
+def test_widths_follow_members(new_db, in_db):
+    db = new_db()
+    db.build_from_json(generators.mac_chain(4, 6), bulk=True, progress=False)
+    db.rebuild()
+    rules = [rewrites.rewrite(name, src, TYPES, in_db) for name, src in (("comm", rewrites.COMM), ("assoc", rewrites.ASSOC_TO_RIGHT))]
+    Runner(db, rules, iter_limit=3).run()
+    rows = db.execute(f"SELECT w.id, w.width, {db._members_sql('w.id')} FROM wirevecs AS w").fetchall()
+    assert rows
+    for id, width, members in rows:
+        assert width == len(db._decode_members(members)) == db._get_width(id)
+
+
+def test_lookup_distinguishes_widths(new_db):
+    m = generators._Module()
+    x, y = m.input("x", 8), m.input("y", 8)
+    m.output("narrow", m.cell("$add", 8, A=x, B=y))
+    m.output("wide", m.cell("$add", 9, A=x, B=y))
+    db = new_db()
+    db.build_from_json(m.to_json(), progress=False)
+    (a, b), = db.execute("SELECT DISTINCT a, b FROM aby_cells")
+    outputs = dict(db.execute("SELECT name, sink FROM as_outputs"))
+    assert db._lookup_aby_cell("$addu", a, b, 8) == outputs["narrow"]
+    assert db._lookup_aby_cell("$addu", a, b, 9) == outputs["wide"]
+    assert db._lookup_aby_cell("$addu", a, b, 10) is None
+
+
+def test_staged_apply_matches_fetched_apply(new_db):
+    fetched, staged = new_db(), new_db()
+    for db in (fetched, staged):
+        db.build_from_json(generators.adder_tree(8), bulk=True, progress=False)
+        db.rebuild()
+    assoc = rewrites.Pattern("assoc_to_left", rewrites.ASSOC_TO_LEFT)
+    n = assoc.apply(fetched, list(assoc.ematch(fetched, TYPES)))
+    assert assoc.apply(staged, assoc.stage(staged, TYPES)) == n > 0
+    # the matches come in another order, and so do the fresh wires: compare the shape of the e-graphs
+    shape = "SELECT type, COUNT(*) FROM aby_cells GROUP BY type UNION ALL SELECT width, COUNT(*) FROM wirevecs GROUP BY width"
+    assert staged.execute(shape).fetchall() == fetched.execute(shape).fetchall()
+    comm = rewrites.Pattern("comm", rewrites.COMM)
+    with pytest.raises(ValueError):
+        comm.apply(staged, assoc.stage(staged, TYPES))
+
+
+def test_ledger_survives_compaction(new_db):
+    db = new_db()
+    db.build_from_json(generators.random_dag(32), bulk=True, progress=False)
+    db.rebuild()
+    comm = rewrites.Pattern("comm", rewrites.COMM)
+    while len(staged := comm.stage(db, TYPES)):
+        comm.apply(db, staged)
+        db.rebuild()
+    db.compact(renumber=True, vacuum=False)     # drops dead matches, renumbers the rest along with the cells
+    assert db.execute(f"SELECT COUNT(*) FROM {comm._ledger}").fetchone()[0] > 0
+    assert len(comm.stage(db, TYPES)) == 0
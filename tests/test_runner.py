@@ -0,0 +1,120 @@
+import pytest
+
+from emap import Runner, rewrites
+from emap.bench import generators
+from emap.runner import BackoffScheduler, Rule, Scheduler, StopReason
+
+TYPES = ["$adds", "$addu", "$muls", "$mulu"]
+LEGACY = ["comm", "assoc_to_right", "assoc_to_left", "dff_forward_aby_cell"]
+PATTERNS = {
+    "comm": rewrites.COMM,
+    "assoc_to_right": rewrites.ASSOC_TO_RIGHT,
+    "assoc_to_left": rewrites.ASSOC_TO_LEFT,
+    "dff_forward_aby_cell": rewrites.DFF_FORWARD_ABY_CELL,
+}
+
+
+def _legacy_rules() -> list[Rule]:
+    return [Rule(getattr(rewrites, "ematch_" + name), getattr(rewrites, "apply_" + name), TYPES) for name in LEGACY]
+
+
+def _pattern_rules() -> list[Rule]:
+    return [rewrites.rewrite(name, src, TYPES, in_db=True) for name, src in PATTERNS.items()]
+
+
+def _naive(rule: Rule) -> Rule:
+    """
+    The same rule matching the whole e-graph in every iteration.
+    """
+    return Rule(lambda db, types, since: rule.ematch(db, types, None), rule.apply, rule.target_types, rule.name, rule.in_db)
+
+
+def _build(db, generator: str = "adder_tree", size: int = 4, width: int = 4):
+    db.build_from_json(generators.GENERATORS[generator](size, width), bulk=True, progress=False)
+    db.rebuild()
+    return db
+
+
+@pytest.mark.parametrize("rules", [_legacy_rules, _pattern_rules], ids=["legacy", "pattern"])
+@pytest.mark.parametrize("generator", ["adder_tree", "systolic"])
+def test_semi_naive_reaches_naive_fixpoint(new_db, rules, generator):
+    size = 4 if generator == "adder_tree" else 2
+    results = []
+    for wrap in (lambda rule: rule, _naive):
+        db = _build(new_db(), generator, size)
+        report = Runner(db, [wrap(rule) for rule in rules()], scheduler=Scheduler(), iter_limit=None).run()
+        assert report.stop_reason == StopReason.SATURATED
+        n_wirevecs = db.execute("SELECT COUNT(*) FROM wirevecs").fetchone()[0]
+        matches = sum(rule.matches for it in report.iterations for rule in it.rules)
+        results.append(((db.count_enodes(), n_wirevecs), matches))
+    (semi_naive, semi_naive_matches), (naive, naive_matches) = results
+    assert semi_naive == naive
+    assert semi_naive_matches <= naive_matches
+
+
+def test_iteration_limit(new_db):
+    db = _build(new_db(), size=8)
+    report = Runner(db, _pattern_rules(), iter_limit=2).run()
+    assert report.stop_reason == StopReason.ITERATION_LIMIT
+    assert [it.index for it in report.iterations] == [0, 1]
+
+
+def test_node_limit(new_db):
+    db = _build(new_db(), size=8)
+    report = Runner(db, _pattern_rules(), iter_limit=None, node_limit=50).run()
+    assert report.stop_reason == StopReason.NODE_LIMIT
+    assert report.iterations[-1].enodes > 50
+    assert all(it.enodes <= 50 for it in report.iterations[:-1])
+
+
+def test_time_limit(new_db):
+    db = _build(new_db(), size=8)
+    report = Runner(db, _pattern_rules(), iter_limit=None, time_limit=0.0).run()
+    assert report.stop_reason == StopReason.TIME_LIMIT
+    assert len(report.iterations) == 1
+
+
+def test_backoff_scheduler():
+    scheduler = BackoffScheduler(match_limit=2, ban_length=1)
+    rule = _pattern_rules()[0]
+    assert scheduler.admit(rule, 0, 2)
+    assert not scheduler.admit(rule, 0, 3)     # banned for 1 iteration
+    assert not scheduler.can_search(rule, 0)
+    assert scheduler.can_search(rule, 1)
+    assert scheduler.admit(rule, 1, 4)         # the limit doubles with each ban
+    assert not scheduler.admit(rule, 1, 5)     # banned for 2 iterations
+    assert not scheduler.can_search(rule, 2)
+    # a banned rule keeps the run from stopping, and is unbanned for one more try
+    assert not scheduler.can_stop(2)
+    assert scheduler.can_search(rule, 2)
+    assert scheduler.can_stop(2)
+    restored = BackoffScheduler(match_limit=2, ban_length=1)
+    restored.load_state(scheduler.state())
+    assert restored.state() == scheduler.state()
+
+
+def test_backoff_still_saturates(new_db):
+    db = _build(new_db())
+    report = Runner(db, _pattern_rules(), scheduler=BackoffScheduler(match_limit=4, ban_length=1), iter_limit=None).run()
+    assert any(rule.banned for it in report.iterations for rule in it.rules)
+    assert report.stop_reason == StopReason.SATURATED
+    reference = _build(new_db())
+    Runner(reference, _pattern_rules(), scheduler=Scheduler(), iter_limit=None).run()
+    assert db.count_enodes() == reference.count_enodes()
+
+
+def test_parallel_matches_serial(new_db, tmp_path):
+    serial = _build(new_db(str(tmp_path / "serial.db")), size=8)
+    parallel = _build(new_db(str(tmp_path / "parallel.db")), size=8)
+    serial_report = Runner(serial, _legacy_rules(), iter_limit=3).run()
+    parallel_report = Runner(parallel, _legacy_rules(), iter_limit=3, parallel=2).run()
+    assert parallel.dump_tables() == serial.dump_tables()
+    assert [[r.matches for r in it.rules] for it in parallel_report.iterations] == \
+        [[r.matches for r in it.rules] for it in serial_report.iterations]
+    assert parallel.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_parallel_needs_a_file(new_db):
+    db = _build(new_db())
+    with pytest.raises(RuntimeError):
+        Runner(db, _legacy_rules(), parallel=2).run()
@@ -0,0 +1,58 @@
+import json
+
+from emap import Runner
+from emap.bench import generators
+from emap.design import default_rules
+from emap.stats import normalize
+
+
+def test_normalize():
+    assert normalize("SELECT  a FROM t\n WHERE x = 42 AND y IN (?, ?, ?) AND z = 'it''s' AND w = :name") == \
+        "SELECT a FROM t WHERE x = ? AND y IN (?, ...) AND z = ? AND w = ?"
+
+
+def test_stats_phases_and_statements(new_db, tmp_path):
+    db = new_db()
+    db.build_from_json(generators.adder_tree(8), bulk=True, progress=False)
+    stats = db.enable_stats()
+    assert db.enable_stats() is stats
+    db.rebuild()
+    Runner(db, default_rules(), iter_limit=2).run()
+    assert stats.phases["rebuild"].calls >= 2
+    assert stats.phases["apply.comm"].rows > 0
+    assert {"match.comm", "rebuild.merge_cells"} <= stats.phases.keys()
+    entry = stats.statements["DELETE FROM dirty_aby_cells"]
+    assert entry.calls == entry.count > 0
+    assert any(entry.plan for entry in stats.statements.values())
+    assert "phase" in stats.summary()
+    stats.write_trace(str(tmp_path / "trace.json"))
+    trace = json.loads((tmp_path / "trace.json").read_text())
+    assert {event["cat"] for event in trace["traceEvents"]} >= {"phase"}
+    assert db.disable_stats() is stats
+    assert db.stats is None
+
+
+def test_stats_disabled_leaves_the_connection_alone(new_db):
+    db = new_db()
+    stats = db.enable_stats()
+    db.disable_stats()
+    assert not {"cursor", "execute", "executemany", "executescript"} & vars(db).keys()
+    db.build_from_json(generators.adder_tree(4), bulk=True, progress=False)
+    db.rebuild()
+    assert "rebuild" not in stats.phases
+    with db.phase("anything"):
+        pass
+
+
+def test_full_scans(new_db):
+    db = new_db()
+    db.build_from_json(generators.adder_tree(4), bulk=True, progress=False)
+    stats = db.enable_stats()
+    db.execute("SELECT type FROM ay_cells").fetchall()                                # through a covering index
+    db.execute("SELECT id FROM wirevecs WHERE members IS NULL").fetchall()            # through the table itself
+    db.execute("SELECT y FROM aby_cells WHERE a = ?", (1,)).fetchall()                # searched
+    db.execute("SELECT wm.wire FROM temp.wire_map AS wm WHERE wm.root > 0").fetchall()  # temporary
+    db.execute("SELECT root FROM wirevec_map").fetchall()
+    scans = stats.full_scans()
+    assert scans.keys() == {"SELECT type FROM ay_cells", "SELECT id FROM wirevecs WHERE members IS NULL"}
+    assert " USING COVERING INDEX " in scans["SELECT type FROM ay_cells"][0]
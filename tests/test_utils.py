@@ -0,0 +1,135 @@
+import random
+import sqlite3
+
+import pytest
+
+from emap import Runner
+from emap.bench import generators
+from emap.design import default_rules
+from emap.utils import DisjointSetUnion, InternCache, RollingHash
+
+
+@pytest.mark.parametrize("M2", [998244353, None], ids=["double", "single"])
+def test_rolling_hash(M2):
+    rhash = RollingHash(M2=M2)
+    rng = random.Random(0)
+    wvs = [[rng.randrange(1 << 31) for _ in range(rng.randrange(0, 40))] for _ in range(50)] + [[], [5]]
+    assert rhash.hash_many(wvs) == [rhash.hash(wv) for wv in wvs]
+    assert rhash.hash([]) == 0
+    wv = wvs[0]
+    subs = [(i, wv[i], rng.randrange(1 << 31)) for i in (0, 3, len(wv) - 1)]
+    new = list(wv)
+    for i, _, x in subs:
+        new[i] = x
+    assert rhash.update_many(rhash.hash(wv), subs) == rhash.hash(new)
+    assert rhash.update(rhash.hash(wv), *subs[0]) == rhash.hash([subs[0][2], *wv[1:]])
+    assert rhash.powers(100)[99] == pow(rhash.B, 99, rhash.M)
+
+
+def test_rolling_hash_is_positional():
+    rhash = RollingHash()
+    assert rhash.hash([1, 2]) != rhash.hash([2, 1])
+
+
+def test_hashes_stay_exact_in_sql(new_db):
+    # the hashes updated in SQL by rebuild() and computed for fresh wirevecs are those of the Python hash
+    db = new_db()
+    db.build_from_json(generators.systolic(3), bulk=True, progress=False)
+    db.rebuild()
+    Runner(db, default_rules(), iter_limit=3).run()
+    rows = db.execute(f"SELECT w.hash, {db._members_sql('w.id')} FROM wirevecs AS w").fetchall()
+    assert rows
+    assert all(h == db._rhash.hash(db._decode_members(members)) for h, members in rows)
+
+
+def test_disjoint_set_union():
+    dsu = DisjointSetUnion()
+    assert dsu.union(5, 3)
+    assert not dsu.union(3, 5)
+    assert dsu.union_many([(9, 7), (7, 5), (11, 12), (12, 11)]) == 3
+    assert dsu.find(9) == 3     # the smallest id of the set
+    assert dsu.find(12) == 11
+    assert dsu.find(42) == 42
+    assert dsu.canonicalize([9, 12, 100]) == [3, 11, 100]
+    assert 100 not in dsu.parents
+    assert sorted(dsu.mapping()) == [(5, 3), (7, 3), (9, 3), (12, 11)]
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE m (wire INTEGER, root INTEGER)")
+    assert dsu.to_sql(conn, "m", ("wire", "root")) == 4
+    assert sorted(conn.execute("SELECT wire, root FROM m")) == sorted(dsu.mapping())
+
+
+def test_disjoint_set_union_matches_naive():
+    rng = random.Random(1)
+    pairs = [(rng.randrange(200), rng.randrange(200)) for _ in range(300)]
+    dsu = DisjointSetUnion()
+    for x, y in pairs[:150]:
+        dsu.union(x, y)
+    dsu.union_many(pairs[150:])
+    # naive closure: relabel to the smallest id until nothing changes
+    label = {x: x for pair in pairs for x in pair}
+    changed = True
+    while changed:
+        changed = False
+        for x, y in pairs:
+            m = min(label[x], label[y])
+            if label[x] != m or label[y] != m:
+                label[x] = label[y] = m
+                changed = True
+    assert dsu.parents == label
+
+
+def test_intern_cache():
+    cache = InternCache(max_bytes=3 * (InternCache._ENTRY_BYTES + 2 * InternCache._MEMBER_BYTES))
+    cache.put((1, 2), 10)
+    cache.put((2, 3), 11)
+    cache.put((3, 4), 12)
+    assert cache.get((1, 2)) == 10 and cache.get((9, 9)) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.put((4, 5), 13)       # over budget: (2, 3) is the least recently used
+    assert cache.get((2, 3)) is None and len(cache) == 3
+    assert cache.discard_wires([4]) == 2
+    assert len(cache) == 1
+    cache.remap([(10, 7)])
+    assert cache.get((1, 2)) == 7
+    cache.put((1, 5), 7)        # new members for id 7: the old entry is stale
+    assert cache.get((1, 2)) is None
+    cache.clear()
+    assert len(cache) == 0 and cache.nbytes == 0
+
+
+def _check_interned(db):
+    """
+    Every entry of the intern cache of db names a live wirevec with exactly those members.
+    """
+    for key, id in db._interned._entries.items():
+        row = db.execute(f"SELECT {db._members_sql('w.id')} FROM wirevecs AS w WHERE w.id = ?", (id,)).fetchone()
+        assert row is not None and tuple(db._decode_members(row[0])) == key
+
+
+def test_interned_wirevecs_follow_rebuilds(new_db):
+    db = new_db()
+    db.build_from_json(generators.systolic(3), progress=False)     # the row-by-row builder goes through the cache
+    assert db._interned.hits > 0
+    _check_interned(db)
+    db.rebuild()
+    Runner(db, default_rules(), iter_limit=3).run()
+    _check_interned(db)
+    for key, id in list(db._interned._entries.items()):
+        assert db._create_or_lookup_wirevec(list(key)) == id
+
+
+def test_interned_wirevecs_remapped_on_merge(new_db):
+    # two copies of x * (x + y): the outputs of the copies become one wirevec
+    m = generators._Module()
+    x, y = m.input("x", 4), m.input("y", 4)
+    for i in range(2):
+        m.output(f"t{i}", m.cell("$mul", 4, A=m.cell("$add", 4, A=x, B=y), B=x))
+    db = new_db()
+    db.build_from_json(m.to_json(), progress=False)
+    (t0_members,), _ = db.execute(f"SELECT {db._members_sql('sink')} FROM as_outputs ORDER BY name")
+    db.rebuild()
+    (t0,), (t1,) = db.execute("SELECT sink FROM as_outputs ORDER BY name")
+    assert t0 == t1
+    _check_interned(db)
+    assert db._create_or_lookup_wirevec(db._decode_members(t0_members)) == t0
@@ -0,0 +1,112 @@
+import io
+import json
+
+import pytest
+
+from emap import yosys
+from emap.bench import generators
+
+
+def _design() -> dict:
+    """
+    A Yosys JSON design with a module before the one under test, strings that look like JSON and long numbers.
+    """
+    top = generators.mac_chain(4)
+    top["attributes"] = {"src": 'a "quoted\\" {name} [0]', "top": "00000000000000000000000000000001"}
+    return {
+        "creator": "Yosys 0.40",
+        "modules": {
+            "other": {"ports": {}, "cells": {}, "netnames": {"x": {"bits": [2, 3], "hide_name": 0}}},
+            "top": {**top, "netnames": {"n": {"bits": list(range(2, 50)), "attributes": {"big": 12345678901234567890}}}},
+        },
+        "models": {},
+    }
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 20])
+def test_iter_module(chunk_size):
+    design = _design()
+    stream = yosys.JsonStream(io.StringIO(json.dumps(design, indent=2)), chunk_size=chunk_size)
+    items = list(yosys.iter_module(stream, "top"))
+    top = design["modules"]["top"]
+    assert items == [("port", name, port) for name, port in top["ports"].items()] + \
+        [("cell", name, cell) for name, cell in top["cells"].items()]
+
+
+def test_iter_module_first_and_missing():
+    text = json.dumps(_design())
+    assert list(yosys.iter_module(yosys.JsonStream(io.StringIO(text), chunk_size=5))) == []  # "other" is empty
+    with pytest.raises(KeyError):
+        list(yosys.iter_module(yosys.JsonStream(io.StringIO(text), chunk_size=5), "missing"))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 64])
+def test_json_stream_reads_and_skips(chunk_size):
+    stream = yosys.JsonStream(io.StringIO('{"a": [1, {"b": "}]"}], "c": 1.5e3, "d": {"e": null}}'), chunk_size)
+    seen = {}
+    for key in stream.iter_object():
+        if key == "a":
+            stream.skip_value()
+        else:
+            seen[key] = stream.read_value()
+    assert seen == {"c": 1500.0, "d": {"e": None}}
+
+
+def test_json_stream_reads_value_spanning_many_chunks():
+    value = {"bits": list(range(20000)), "name": "x" * 5000}
+    stream = yosys.JsonStream(io.StringIO(json.dumps([value, 1.5e3])), chunk_size=16)
+    decoder = stream._decoder
+    attempts = []
+
+    class Counting:
+        def raw_decode(self, s, idx):
+            attempts.append(idx)
+            return decoder.raw_decode(s, idx)
+
+    stream._decoder = Counting()
+    stream._expect("[")
+    assert stream.read_value() == value
+    # the buffered part of the value at least doubles between attempts, instead of growing by one chunk
+    assert len(attempts) < 20
+    stream._expect(",")
+    assert stream.read_value() == 1500.0
+
+
+def test_build_from_file_matches_build_from_json(new_db, tmp_path):
+    design = _design()
+    path = tmp_path / "design.json"
+    path.write_text(json.dumps(design))
+    streamed, loaded = new_db(), new_db()
+    streamed.build_from_file(str(path), "top", batch_size=5, progress=False)
+    loaded.build_from_json(design["modules"]["top"], bulk=True, progress=False)
+    assert streamed.dump_tables() == loaded.dump_tables()
+
+
+@pytest.mark.parametrize("generator", ["systolic", "random_dag"])
+def test_write_module_round_trip(new_db, spelled, generator):
+    # with a blackbox instance reading one of the outputs
+    mod = generators.GENERATORS[generator](6)
+    y = next(port["bits"] for port in mod["ports"].values() if port["direction"] == "output")
+    z = list(range(5000, 5000 + len(y)))
+    mod["cells"]["sub"] = {"hide_name": 0, "type": "child", "parameters": {"N": 3}, "attributes": {}, "connections": {"A": y, "Y": z}}
+    mod["ports"]["z"] = {"direction": "output", "bits": z}
+    db = new_db()
+    db.build_from_json(mod, bulk=True, progress=False, submodules=["child"])
+    f = io.StringIO()
+    yosys.write_module(db, f, "top", chunk_size=3)
+    written = json.loads(f.getvalue())["modules"]["top"]
+    copy = new_db()
+    copy.build_from_json(written, bulk=True, progress=False)
+    assert spelled(copy) == spelled(db)
+    assert copy.dump_tables()["instances"] == db.dump_tables()["instances"]
+    assert [(p["port"], p["signal"]) for p in copy.dump_tables()["instance_ports"]] == \
+        [(p["port"], p["signal"]) for p in db.dump_tables()["instance_ports"]]
+
+
+def test_write_tables(new_db):
+    db = new_db()
+    db.build_from_json(generators.systolic(3), bulk=True, progress=False)
+    f = io.StringIO()
+    db.write_tables(f, chunk_size=2)
+    assert json.loads(f.getvalue()) == db.dump_tables()
+    assert list(db.iter_rows("wirevecs", chunk_size=1)) == db.dump_tables()["wirevecs"]